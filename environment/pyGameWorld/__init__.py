@@ -4,7 +4,37 @@ from .conditions import *
 from .jsrun import *
 from .helpers import *
 from .noisyWorld import *
-from .toolpicker_js import ToolPicker, loadToolPicker, JSRunner, CollisionChecker
+from .jsworker import JSWorker, JSWorkerError
+from .trajstore import TrajectoryStore
+from .simcache import SimulationCache
+from .batchworld import PGBatchWorld
+import importlib
+
+# These bring in scipy, execjs and pygame, so their modules are only imported
+# the first time they are used
+_lazy = {
+    'PlacementMap': 'placement',
+    'getPlacementMap': 'placement',
+    'ToolPicker': 'toolpicker_js',
+    'loadToolPicker': 'toolpicker_js',
+    'JSRunner': 'toolpicker_js',
+    'CollisionChecker': 'toolpicker_js',
+    'ToolPickerPool': 'toolpicker_js',
+    'getSettledWorld': 'toolpicker_js'
+}
+
+def __getattr__(name):
+    if name in _lazy:
+        val = getattr(importlib.import_module('.' + _lazy[name], __name__), name)
+        globals()[name] = val
+        return val
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
 
 __all__ = ['PGWorld','loadFromDict','ToolPicker','loadToolPicker',
-           'noisifyWorld','pyGetPath', 'JSRunner', 'CollisionChecker']
+           'noisifyWorld','pyGetPath', 'JSRunner', 'CollisionChecker',
+           'JSWorker', 'JSWorkerError', 'ToolPickerPool', 'PlacementMap',
+           'getPlacementMap', 'getSettledWorld', 'CollisionEventFilter',
+           'TrajectoryStore', 'SimulationCache', 'PGBatchWorld']
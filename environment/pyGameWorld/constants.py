@@ -10,6 +10,13 @@ COLTYPE_PLACED = 102
 COLTYPE_BLOCKED = 103
 COLTYPE_CHECKER = 104
 
+# Thresholds for ending runs early once nothing is moving (see isAtRest)
+DEFAULT_REST_DICT = {
+    'vel_threshold': 1.,
+    'ang_threshold': .01,
+    'window': 1.
+}
+
 DEFAULT_NOISE_DICT = {
     'position_static': 5.,
     'position_moving': 5.,
@@ -140,21 +140,25 @@ class ToolPicker(object):
     # Makes own world noisy
     def noisifySelf(self, noise_position_static = 5., noise_position_moving = 5.,
                  noise_collision_direction = .2, noise_collision_elasticity = .2, noise_gravity = .1,
-                 noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1):
+                 noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1,
+                 seed = None):
         self._world = noisifyWorld(self._world, noise_position_static, noise_position_moving,
                                    noise_collision_direction, noise_collision_elasticity, noise_gravity,
-                                   noise_object_friction, noise_object_density, noise_object_elasticity)
+                                   noise_object_friction, noise_object_density, noise_object_elasticity,
+                                   seed = seed)
 
     def runNoisyPlacement(self, toolname, position, maxtime = 20., useJS = False,
                           noise_position_static = 5., noise_position_moving = 5.,
                           noise_collision_direction = .2, noise_collision_elasticity = .2, noise_gravity = .1,
-                          noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1):
+                          noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1,
+                          seed = None):
 
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         nw = noisifyWorld(loadFromDict(self._worlddict), noise_position_static, noise_position_moving,
                                    noise_collision_direction, noise_collision_elasticity, noise_gravity,
-                                   noise_object_friction, noise_object_density, noise_object_elasticity)
+                                   noise_object_friction, noise_object_density, noise_object_elasticity,
+                                   seed = seed)
 
         # Make sure the tool can be placed
         for tverts in tool:
@@ -175,14 +179,16 @@ class ToolPicker(object):
     def runNoisyPath(self, toolname, position, maxtime = 20., useJS = False,
                      noise_position_static = 5., noise_position_moving = 5.,
                      noise_collision_direction = .2, noise_collision_elasticity = .2, noise_gravity = .1,
-                     noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1):
+                     noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1,
+                     seed = None):
 
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
 
         nw = noisifyWorld(self._world, noise_position_static, noise_position_moving,
                           noise_collision_direction, noise_collision_elasticity, noise_gravity,
-                          noise_object_friction, noise_object_density, noise_object_elasticity)
+                          noise_object_friction, noise_object_density, noise_object_elasticity,
+                          seed = seed)
 
         # Make sure the tool can be placed
         for tverts in tool:
@@ -2,17 +2,16 @@ from __future__ import division
 import pymunk as pm
 import numpy as np
 import json
-import scipy.spatial as sps
 import pdb
-import re
 import copy
 import operator
+import hashlib
 
 __all__ = ['areaForSegment','areaForPoly','centroidForPoly','recenterPoly','objectComplexity',
            'segs2Poly','polyValidate', 'word2Color', 'distanceToObject','objectBoundingBox',
-           'filterCollisionEvents', 'lineToPointDist', 
+           'filterCollisionEvents', 'CollisionEventFilter', 'lineToPointDist',
            'stripGoal', 'updateObjects',
-           'NpEncoder']
+           'NpEncoder', 'dictDigest', 'wilsonInterval']
 
 
 # Helper functions that are used to parse geometry
@@ -166,6 +165,7 @@ def objectBoundingBox(object):
 
 def objectComplexity(object):
     #this assumes the complexity is measured as the distance to the convex hull
+    import scipy.spatial as sps
     verts = [obj[i] for obj in object for i in range(0, len(obj))]
 
     hull = sps.ConvexHull(verts)
@@ -235,69 +235,89 @@ def order_contacts(fc):
     fc = sorted(fc, key=operator.itemgetter(2))
     return fc
 
-def filterCollisionEvents(eventlist, slop_time = .2):
-    begin_list = {}
-    last_list = {}
-    col_list = {}
-    col_list_beg = {}
-    output_events = []
-
-    for o1,o2,tp,tm,ci in eventlist:
+# Returns a copy of collision info with the normal(s) pointing the other way
+def _flipCollisionInfo(ci):
+    ci = list(ci)
+    # Python worlds store a single normal vector
+    if isinstance(ci[0], pm.Vec2d):
+        ci[0] = -ci[0]
+    else:
+        ci[0] = [{'x': -n['x'], 'y': -n['y']} for n in ci[0]]
+    return ci
+
+'''Merges begin & end collision events into contacts as they come in, rather
+than going through a whole list of events at the end. Contacts are
+[object 1, object 2, begin time, end time (None if still touching), collision
+info], with the objects in sorted order; breaks in contact that are no longer
+than slop_time are merged over. Only the pairs that are touching or have just
+separated are kept track of, keyed by their names
+Args:
+    slop_time [float]: the longest break in contact to ignore
+'''
+class CollisionEventFilter(object):
+
+    def __init__(self, slop_time = .2):
+        self.slop_time = slop_time
+        self._begin = {}
+        self._beginInfo = {}
+        self._last = {}
+        self._lastInfo = {}
+        self._done = []
+
+    '''Adds a single [o1, o2, 'begin' or 'end', time, collision info] event.
+    Returns the finished contact if this event closes one, otherwise None
+    '''
+    def add(self, o1, o2, tp, tm, ci):
         if o2 < o1:
-            tmp = o2
-            o2 = o1
-            o1 = tmp
-            # Also need to swap the normals
-            new_cins = []
-            for n in ci[0]:
-                new_cins.append({'x': -n['x'], 'y': -n['y']})
-            ci[0] = new_cins
-
-        comb = re.sub('__', '_', o1+"_"+o2).strip('_') # Filtering for objects that start with _
+            o1, o2 = o2, o1
+            ci = _flipCollisionInfo(ci)
+        key = (o1, o2)
+        ret = None
         if tp == 'begin':
             # We have already seen them disconnect
-            if comb in last_list.keys():
+            if key in self._last:
                 # Long break since last time they were connected
-                if tm - last_list[comb] > slop_time:
-                    try:
-                        output_events.append([o1,o2,begin_list[comb],last_list[comb], col_list[comb]])
-                    except:
-                        output_events.append([o1, o2, 0.1, last_list[comb], col_list[comb]])
-
-                    del last_list[comb]
-                    del col_list[comb]
-                    begin_list[comb] = tm
-                    col_list_beg[comb] = ci
-                # Short break since connection
-                else:
-                    del last_list[comb]
-                    del col_list[comb]
+                if tm - self._last[key] > self.slop_time:
+                    # Sometimes the beginning touch doesn't show up
+                    ret = [o1, o2, self._begin.get(key, 0.1), self._last[key],
+                           self._lastInfo[key]]
+                    self._done.append(ret)
+                    self._begin[key] = tm
+                    self._beginInfo[key] = ci
+                del self._last[key]
+                del self._lastInfo[key]
             # We have not yet seen them disconnect -- so they have never been together
             else:
-                begin_list[comb] = tm
-                col_list_beg[comb] = ci
+                self._begin[key] = tm
+                self._beginInfo[key] = ci
         elif tp == 'end':
-            last_list[comb] = tm
-            col_list[comb] = ci
-
-    # Clear out disconnects that never reconnect
-    for comb, tm in last_list.items():
-        o1, o2 = comb.split('_')
-        try:
-            output_events.append([o1,o2,begin_list[comb], last_list[comb], col_list[comb]])
-            del begin_list[comb]
-            del col_list_beg[comb]
-        except:
-            # Sometimes beginning touch doesn't show up on Kelsey's computer...
-            output_events.append([o1,o2,0.1, last_list[comb], col_list[comb]])
+            self._last[key] = tm
+            self._lastInfo[key] = ci
+        return ret
+
+    def extend(self, eventlist):
+        for ev in eventlist:
+            self.add(*ev)
+
+    '''Returns all contacts so far, including ones that have not ended, in
+    order of when they began
+    '''
+    def getContacts(self):
+        output_events = list(self._done)
+        begin = dict(self._begin)
+        # Disconnects that never reconnected
+        for key, tm in self._last.items():
+            output_events.append([key[0], key[1], begin.pop(key, 0.1), tm,
+                                  self._lastInfo[key]])
+        # Items still in contact
+        for key, tm in begin.items():
+            output_events.append([key[0], key[1], tm, None, self._beginInfo[key]])
+        return order_contacts(output_events)
 
-
-    # Add in the items still in contact
-    for comb, tm in begin_list.items():
-        o1, o2 = comb.split('_')
-        output_events.append([o1,o2,tm,None,col_list_beg[comb]])
-
-    return order_contacts(output_events)
+def filterCollisionEvents(eventlist, slop_time = .2):
+    filt = CollisionEventFilter(slop_time)
+    filt.extend(eventlist)
+    return filt.getContacts()
 
 def stripGoal(worlddict):
     wd = copy.deepcopy(worlddict)
@@ -348,3 +368,20 @@ class NpEncoder(json.JSONEncoder):
             return obj.tolist()
         else:
             return super(NpEncoder, self).default(obj)
+
+# A stable hash of JSON-serializable data (e.g., world dicts), for caching
+# things computed from it
+def dictDigest(obj):
+    s = json.dumps(obj, cls=NpEncoder, sort_keys=True)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+# The Wilson score interval for a binomial proportion: returns the (lower,
+# upper) bounds on the success probability given successes out of n samples
+def wilsonInterval(successes, n, confidence=.95):
+    from scipy.special import ndtri
+    z = ndtri(.5 + confidence / 2.)
+    p = successes / n
+    denom = 1 + z**2 / n
+    center = (p + z**2 / (2*n)) / denom
+    half = z * np.sqrt(p*(1-p)/n + z**2 / (4*n**2)) / denom
+    return max(0., float(center - half)), min(1., float(center + half))
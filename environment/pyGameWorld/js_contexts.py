@@ -12,7 +12,94 @@ function zeroIfUndef(x) {{
 function isntEmpty(obj) {{
   return Object.keys(obj).length > 0
 }}
+// Quiescence checking for ending runs early: restDict holds vel_threshold,
+// ang_threshold and window, which Python fills in from DEFAULT_REST_DICT
+// (see _restDict in toolpicker_js.py). A world is at rest once every
+// dynamic body has been below both thresholds for window seconds while no
+// goal condition is counting down; an empty or undefined restDict turns the
+// check off
+function makeRestCheck(world, restDict) {{
+    if (typeof(restDict) === 'undefined' || restDict === null || !isntEmpty(restDict)) return null
+    var bodies = []
+    for (var onm in world.objects) {{
+        if (!world.objects[onm].isStatic()) bodies.push(world.objects[onm].cpBody)
+    }}
+    return {{
+        world: world,
+        bodies: bodies,
+        vthresh: restDict.vel_threshold,
+        athresh: restDict.ang_threshold,
+        window: restDict.window,
+        still: 0,
+        atRest: false
+    }}
+}}
+function isAtRest(rest, stepSize) {{
+    if (rest === null) return false
+    var gc = rest.world.goalCond
+    var moving = (gc !== null && gc.remainingTime() !== null)
+    for (var i = 0; i < rest.bodies.length && !moving; i++) {{
+        var b = rest.bodies[i]
+        moving = (Math.sqrt(b.vx*b.vx + b.vy*b.vy) > rest.vthresh || Math.abs(b.w) > rest.athresh)
+    }}
+    rest.still = moving ? 0 : rest.still + stepSize
+    rest.atRest = rest.still >= rest.window
+    return rest.atRest
+}}
+// Recording options for the path functions: recordDict.track lists the names
+// of the objects to record (defaults to every dynamic object) and
+// recordDict.every only records every k-th step (the first and last states are
+// always recorded). Unrecorded states are never put in the path
+function isTracked(world, onm, recordDict) {{
+    if (recordDict && recordDict.track) return recordDict.track.indexOf(onm) !== -1
+    return !world.objects[onm].isStatic()
+}}
+function recordEvery(recordDict) {{
+    return (recordDict && recordDict.every > 1) ? recordDict.every : 1
+}}
+// Adds why the run ended ('goal', 'rest' or 'timeout') to the end of a result
+// list, but only when the quiescence check is on
+function withStopReason(ret, world, rest) {{
+    if (rest === null) return ret
+    if (world.checkEnd()) ret.push('goal')
+    else if (rest.atRest) ret.push('rest')
+    else ret.push('timeout')
+    return ret
+}}
+// Seeded noise: NoisyPG draws all of its noise from Math.random, so when the
+// noise dict has a seed (four 32-bit ints, see noisyWorld.noiseSeed) that is
+// swapped for an sfc32 generator started from the seed for the run. noiseRng
+// holds the generator state so that it can be checkpointed
+var unseededRandom = Math.random
+var noiseRng = null
+function seededRandom() {{
+    var s = noiseRng
+    var t = (s[0] + s[1] | 0) + s[3] | 0
+    s[3] = s[3] + 1 | 0
+    s[0] = s[1] ^ (s[1] >>> 9)
+    s[1] = s[2] + (s[2] << 3) | 0
+    s[2] = (s[2] << 21) | (s[2] >>> 11)
+    s[2] = s[2] + t | 0
+    return (t >>> 0) / 4294967296
+}}
+// Puts the unseeded Math.random back; the node worker calls this after every
+// call, so a seeded run never leaks its generator into later calls
+function endCall() {{
+    noiseRng = null
+    Math.random = unseededRandom
+}}
+function seedNoise(noisedict) {{
+    if (typeof(noisedict.seed) === 'undefined' || noisedict.seed === null) {{
+        endCall()
+        return
+    }}
+    noiseRng = [noisedict.seed[0] | 0, noisedict.seed[1] | 0,
+                noisedict.seed[2] | 0, noisedict.seed[3] | 0]
+    Math.random = seededRandom
+    for (var i = 0; i < 12; i++) seededRandom()
+}}
 function applyNoise(world, noisedict) {{
+    seedNoise(noisedict)
     var nps = zeroIfUndef(noisedict.noise_position_static)
     var npm = zeroIfUndef(noisedict.noise_position_moving)
     var ncd = zeroIfUndef(noisedict.noise_collision_direction)
@@ -23,7 +110,7 @@ function applyNoise(world, noisedict) {{
     var noe = zeroIfUndef(noisedict.noise_object_elasticity)
     return npg.noisifyWorld(world, nps, npm, ncd, nce, ng, nof, nod, noe)
 }}
-function runGW(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function runGW(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
     var w = pg.loadFromDict(worldDict)
     if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
         w = applyNoise(w, noiseDict)
@@ -33,17 +120,18 @@ function runGW(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
     }}
     var running = true
     var t = 0
+    var rest = makeRestCheck(w, restDict)
     while (running) {{
         w.step(stepSize)
         t += stepSize
-        if (w.checkEnd() || (t >= maxtime)) {{
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
             running = false
         }}
     }}
     if (returnNewWorld) {{
-        return [w.checkEnd(), t, returnWorld]
+        return withStopReason([w.checkEnd(), t, returnWorld], w, rest)
     }} else {{
-        return [w.checkEnd(), t]
+        return withStopReason([w.checkEnd(), t], w, rest)
     }}
 }}
 function stepGW(worldDict, stepSize) {{
@@ -51,7 +139,24 @@ function stepGW(worldDict, stepSize) {{
     w.step(stepSize)
     return w.toDict()
 }}
-function getGWPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
+// Runs the world without any intervention until it comes to rest (or maxtime
+// passes) and returns [the world dict at that point, the time taken, whether
+// it came to rest]
+function settleGW(worldDict, maxtime, stepSize, restDict) {{
+    var w = pg.loadFromDict(worldDict)
+    var rest = makeRestCheck(w, restDict)
+    var running = true
+    var t = 0
+    while (running) {{
+        w.step(stepSize)
+        t += stepSize
+        if ((t >= maxtime) || isAtRest(rest, stepSize)) {{
+            running = false
+        }}
+    }}
+    return [w.toDict(), t, rest.atRest]
+}}
+function getGWPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = pg.loadFromDict(worldDict)
     if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
         w = applyNoise(w, noiseDict)
@@ -61,33 +166,38 @@ function getGWPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
     }}
     var running = true
     var t = 0
+    var rest = makeRestCheck(w, restDict)
     var pathdict = {{}}
     var tracknames = []
     for (onm in w.objects) {{
         var o = w.objects[onm]
-        if (!o.isStatic()) {{
+        if (isTracked(w, onm, recordDict)) {{
             tracknames.push(onm)
             pathdict[onm] = [o.getPos()]
         }}
     }}
+    var every = recordEvery(recordDict)
+    var nsteps = 0
     while (running) {{
         w.step(stepSize)
         t += stepSize
-        for (var i = 0; i < tracknames.length; i++) {{
-            onm = tracknames[i]
-            pathdict[onm].push(w.objects[onm].getPos())
-        }}
-        if (w.checkEnd() || (t >= maxtime)) {{
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
             running = false
         }}
+        if (++nsteps % every === 0 || !running) {{
+            for (var i = 0; i < tracknames.length; i++) {{
+                onm = tracknames[i]
+                pathdict[onm].push(w.objects[onm].getPos())
+            }}
+        }}
     }}
     if (returnNewWorld) {{
-        return [pathdict, w.checkEnd(), t, returnWorld]
+        return withStopReason([pathdict, w.checkEnd(), t, returnWorld], w, rest)
     }} else {{
-        return [pathdict, w.checkEnd(), t]
+        return withStopReason([pathdict, w.checkEnd(), t], w, rest)
     }}
 }}
-function getGWPathAndRot(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWPathAndRot(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = pg.loadFromDict(worldDict)
     if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
         w = applyNoise(w, noiseDict)
@@ -97,34 +207,39 @@ function getGWPathAndRot(worldDict, maxtime, stepSize, noiseDict, returnNewWorld
     }}
     var running = true
     var t = 0
+    var rest = makeRestCheck(w, restDict)
     var pathdict = {{}}
     var tracknames = []
     for (onm in w.objects) {{
         var o = w.objects[onm]
-        if (!o.isStatic()) {{
+        if (isTracked(w, onm, recordDict)) {{
             tracknames.push(onm)
             pathdict[onm] = [[o.getPos()], [o.getRot()]]
         }}
     }}
+    var every = recordEvery(recordDict)
+    var nsteps = 0
     while (running) {{
         w.step(stepSize)
         t += stepSize
-        for (var i = 0; i < tracknames.length; i++) {{
-            onm = tracknames[i]
-            pathdict[onm][0].push(w.objects[onm].getPos())
-            pathdict[onm][1].push(w.objects[onm].getRot())
-        }}
-        if (w.checkEnd() || (t >= maxtime)) {{
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
             running = false
         }}
+        if (++nsteps % every === 0 || !running) {{
+            for (var i = 0; i < tracknames.length; i++) {{
+                onm = tracknames[i]
+                pathdict[onm][0].push(w.objects[onm].getPos())
+                pathdict[onm][1].push(w.objects[onm].getRot())
+            }}
+        }}
     }}
     if (returnNewWorld) {{
-        return [pathdict, w.checkEnd(), t, returnWorld]
+        return withStopReason([pathdict, w.checkEnd(), t, returnWorld], w, rest)
     }} else {{
-        return [pathdict, w.checkEnd(), t]
+        return withStopReason([pathdict, w.checkEnd(), t], w, rest)
     }}
 }}
-function getGWStatePath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWStatePath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = pg.loadFromDict(worldDict)
     if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
         w = applyNoise(w, noiseDict)
@@ -134,33 +249,97 @@ function getGWStatePath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld)
     }}
     var running = true
     var t = 0
+    var rest = makeRestCheck(w, restDict)
     var pathdict = {{}}
     var tracknames = []
     for (onm in w.objects) {{
         var o = w.objects[onm]
-        if (!o.isStatic()) {{
+        if (isTracked(w, onm, recordDict)) {{
             tracknames.push(onm)
             pathdict[onm] = [[o.getPos()[0], o.getPos()[1], o.getRot(), o.getVel()[0], o.getVel()[1]]]
         }}
     }}
+    var every = recordEvery(recordDict)
+    var nsteps = 0
     while (running) {{
         w.step(stepSize)
         t += stepSize
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
+            running = false
+        }}
+        if (++nsteps % every === 0 || !running) {{
+            for (var i = 0; i < tracknames.length; i++) {{
+                onm = tracknames[i]
+                pathdict[onm].push([w.objects[onm].getPos()[0], w.objects[onm].getPos()[1], w.objects[onm].getRot(), w.objects[onm].getVel()[0], w.objects[onm].getVel()[1]])
+            }}
+        }}
+    }}
+    if (returnNewWorld) {{
+        return withStopReason([pathdict, w.checkEnd(), t, returnWorld], w, rest)
+    }} else {{
+        return withStopReason([pathdict, w.checkEnd(), t], w, rest)
+    }}
+}}
+// Same as getGWStatePath, but the states go into a single Float32Array laid
+// out as (steps, objects, 5) with [x, y, rotation, vel_x, vel_y] for each
+// object instead of nested lists, so they can be sent back as raw bytes. The
+// path is returned as {{names: object names, frames: steps, data: states}}
+function getGWStateArray(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    var w = pg.loadFromDict(worldDict)
+    if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
+        w = applyNoise(w, noiseDict)
+    }}
+    if (returnNewWorld){{
+        var returnWorld = w.toDict()
+    }}
+    var running = true
+    var t = 0
+    var rest = makeRestCheck(w, restDict)
+    var tracknames = []
+    for (onm in w.objects) {{
+        if (isTracked(w, onm, recordDict)) tracknames.push(onm)
+    }}
+    var stride = tracknames.length * 5
+    var states = new Float32Array((Math.ceil(maxtime / stepSize) + 2) * stride)
+    var frames = 0
+    function record() {{
+        if ((frames + 1) * stride > states.length) {{
+            var bigger = new Float32Array(2 * states.length + stride)
+            bigger.set(states)
+            states = bigger
+        }}
+        var k = frames * stride
         for (var i = 0; i < tracknames.length; i++) {{
-            onm = tracknames[i]
-            pathdict[onm].push([w.objects[onm].getPos()[0], w.objects[onm].getPos()[1], w.objects[onm].getRot(), w.objects[onm].getVel()[0], w.objects[onm].getVel()[1]])
+            var o = w.objects[tracknames[i]]
+            var p = o.getPos()
+            var v = o.getVel()
+            states[k++] = p[0]
+            states[k++] = p[1]
+            states[k++] = o.getRot()
+            states[k++] = v[0]
+            states[k++] = v[1]
         }}
-        if (w.checkEnd() || (t >= maxtime)) {{
+        frames++
+    }}
+    var every = recordEvery(recordDict)
+    var nsteps = 0
+    record()
+    while (running) {{
+        w.step(stepSize)
+        t += stepSize
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
             running = false
         }}
+        if (++nsteps % every === 0 || !running) record()
     }}
+    var path = {{names: tracknames, frames: frames, data: states.subarray(0, frames * stride)}}
     if (returnNewWorld) {{
-        return [pathdict, w.checkEnd(), t, returnWorld]
+        return withStopReason([path, w.checkEnd(), t, returnWorld], w, rest)
     }} else {{
-        return [pathdict, w.checkEnd(), t]
+        return withStopReason([path, w.checkEnd(), t], w, rest)
     }}
 }}
-function getGWGeomPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWGeomPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = pg.loadFromDict(worldDict)
     if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
         w = applyNoise(w, noiseDict)
@@ -170,6 +349,7 @@ function getGWGeomPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld)
     }}
     var running = true
     var t = 0
+    var rest = makeRestCheck(w, restDict)
     var pathdict = {{}}
     var tracknames = []
     function toGeom(o) {{
@@ -186,30 +366,34 @@ function getGWGeomPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld)
     }}
     for (onm in w.objects) {{
         var o = w.objects[onm]
-        if (!o.isStatic()) {{
+        if (isTracked(w, onm, recordDict)) {{
             tracknames.push(onm)
             pathdict[onm] = [[o.type, toGeom(o), o.getVel()]]
         }}
     }}
+    var every = recordEvery(recordDict)
+    var nsteps = 0
     while (running) {{
         w.step(stepSize)
         t += stepSize
-        for (var i = 0; i < tracknames.length; i++) {{
-            onm = tracknames[i]
-            o = w.objects[onm]
-            pathdict[onm].push([o.type, toGeom(o), o.getVel()])
-        }}
-        if (w.checkEnd() || (t >= maxtime)) {{
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
             running = false
         }}
+        if (++nsteps % every === 0 || !running) {{
+            for (var i = 0; i < tracknames.length; i++) {{
+                onm = tracknames[i]
+                o = w.objects[onm]
+                pathdict[onm].push([o.type, toGeom(o), o.getVel()])
+            }}
+        }}
     }}
     if (returnNewWorld) {{
-        return [pathdict, w.checkEnd(), t, returnWorld]
+        return withStopReason([pathdict, w.checkEnd(), t, returnWorld], w, rest)
     }} else {{
-        return [pathdict, w.checkEnd(), t]
+        return withStopReason([pathdict, w.checkEnd(), t], w, rest)
     }}
 }}
-function getGWCollisionPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWCollisionPath(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = pg.loadFromDict(worldDict)
     if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
         w = applyNoise(w, noiseDict)
@@ -219,34 +403,39 @@ function getGWCollisionPath(worldDict, maxtime, stepSize, noiseDict, returnNewWo
     }}
     var running = true
     var t = 0
+    var rest = makeRestCheck(w, restDict)
     var pathdict = {{}}
     var tracknames = []
     for (onm in w.objects) {{
         var o = w.objects[onm]
-        if (!o.isStatic()) {{
+        if (isTracked(w, onm, recordDict)) {{
             tracknames.push(onm)
             pathdict[onm] = [o.getPos()]
         }}
     }}
+    var every = recordEvery(recordDict)
+    var nsteps = 0
     while (running) {{
         w.step(stepSize)
         t += stepSize;
-        for (var i = 0; i < tracknames.length; i++) {{
-            onm = tracknames[i];
-            pathdict[onm].push(w.objects[onm].getPos())
-        }}
-        if (w.checkEnd() || (t >= maxtime)) {{
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
             running = false
         }}
+        if (++nsteps % every === 0 || !running) {{
+            for (var i = 0; i < tracknames.length; i++) {{
+                onm = tracknames[i];
+                pathdict[onm].push(w.objects[onm].getPos())
+            }}
+        }}
     }}
     collisions = w.getCollisionEvents()
     if (returnNewWorld) {{
-        return [pathdict, collisions, w.checkEnd(), t, returnWorld]
+        return withStopReason([pathdict, collisions, w.checkEnd(), t, returnWorld], w, rest)
     }} else {{
-        return [pathdict, collisions, w.checkEnd(), t]
+        return withStopReason([pathdict, collisions, w.checkEnd(), t], w, rest)
     }}
 }}
-function getGWCollisionPathAndRot(worldDict, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWCollisionPathAndRot(worldDict, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = pg.loadFromDict(worldDict)
     if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
         w = applyNoise(w, noiseDict)
@@ -256,33 +445,234 @@ function getGWCollisionPathAndRot(worldDict, maxtime, stepSize, noiseDict, retur
     }}
     var running = true
     var t = 0
+    var rest = makeRestCheck(w, restDict)
     var pathdict = {{}}
     var tracknames = []
     for (onm in w.objects) {{
         var o = w.objects[onm]
-        if (!o.isStatic()) {{
+        if (isTracked(w, onm, recordDict)) {{
             tracknames.push(onm)
             pathdict[onm] = [[o.getPos()], [o.getRot()]]
         }}
     }}
+    var every = recordEvery(recordDict)
+    var nsteps = 0
     while (running) {{
         w.step(stepSize)
         t += stepSize
+        if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
+            running = false
+        }}
+        if (++nsteps % every === 0 || !running) {{
+            for (var i = 0; i < tracknames.length; i++) {{
+                onm = tracknames[i]
+                pathdict[onm][0].push(w.objects[onm].getPos())
+                pathdict[onm][1].push(w.objects[onm].getRot())
+            }}
+        }}
+    }}
+    collisions = w.getCollisionEvents()
+    if (returnNewWorld) {{
+        return withStopReason([pathdict, collisions, w.checkEnd(), t, returnWorld], w, rest)
+    }} else {{
+        return withStopReason([pathdict, collisions, w.checkEnd(), t], w, rest)
+    }}
+}}
+// Checkpoints for branching runs: records the own properties of every object
+// reachable from the world, so that restoring can put them back in place.
+// Objects keep their identity, so the collision & goal callbacks (closures
+// bound to the world objects) stay valid and the engine stays as fast as it
+// was before the checkpoint
+function checkpointWorld(w) {{
+    var seen = new Set([w])
+    var stack = [w]
+    var saved = []
+    while (stack.length > 0) {{
+        var x = stack.pop()
+        var vals = Array.isArray(x) ? x.slice() : Object.assign({{}}, x)
+        var ks = Object.keys(vals)
+        saved.push([x, vals, ks.length])
+        for (var i = 0; i < ks.length; i++) {{
+            var v = vals[ks[i]]
+            if (v !== null && typeof(v) === 'object' && !seen.has(v)) {{
+                seen.add(v)
+                stack.push(v)
+            }}
+        }}
+    }}
+    return saved
+}}
+function restoreWorld(ckpt) {{
+    for (var i = 0; i < ckpt.length; i++) {{
+        var x = ckpt[i][0]
+        var vals = ckpt[i][1]
+        if (Array.isArray(x)) {{
+            x.length = vals.length
+            for (var j = 0; j < vals.length; j++) x[j] = vals[j]
+            continue
+        }}
+        // Drop anything added since the checkpoint
+        if (Object.keys(x).length !== ckpt[i][2]) {{
+            for (var k in x) {{
+                if (x.hasOwnProperty(k) && !vals.hasOwnProperty(k)) delete x[k]
+            }}
+        }}
+        Object.assign(x, vals)
+    }}
+}}
+// Runs the world once up to bumpTime, then branches off one continuation per
+// bump ([object name, impulse, world location or null for its center]) from a
+// checkpoint taken there. Returns a list with one getGWPath result per bump
+function getGWPathBumpBranches(worldDict, bumpTime, bumps, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
+    var w = pg.loadFromDict(worldDict)
+    if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
+        w = applyNoise(w, noiseDict)
+    }}
+    if (returnNewWorld){{
+        var returnWorld = w.toDict()
+    }}
+    var t = 0
+    var pathdict = {{}}
+    var tracknames = []
+    for (onm in w.objects) {{
+        var o = w.objects[onm]
+        if (!o.isStatic()) {{
+            tracknames.push(onm)
+            pathdict[onm] = [o.getPos()]
+        }}
+    }}
+    function record(pd) {{
         for (var i = 0; i < tracknames.length; i++) {{
             onm = tracknames[i]
-            pathdict[onm][0].push(w.objects[onm].getPos())
-            pathdict[onm][1].push(w.objects[onm].getRot())
+            pd[onm].push(w.objects[onm].getPos())
         }}
+    }}
+    function finish(pd, rest) {{
+        var ret = [pd, w.checkEnd(), t]
+        if (returnNewWorld) ret.push(returnWorld)
+        return withStopReason(ret, w, rest)
+    }}
+    // The shared part: nothing to branch if the run ends before the bump
+    var running = true
+    while (running && t < bumpTime - stepSize / 2) {{
+        w.step(stepSize)
+        t += stepSize
+        record(pathdict)
         if (w.checkEnd() || (t >= maxtime)) {{
             running = false
         }}
     }}
-    collisions = w.getCollisionEvents()
+    var results = []
+    if (!running) {{
+        var ret = finish(pathdict, makeRestCheck(w, restDict))
+        for (var b = 0; b < bumps.length; b++) results.push(ret)
+        return results
+    }}
+    var ckpt = checkpointWorld(w)
+    var rngCkpt = (noiseRng === null) ? null : noiseRng.slice()
+    var t0 = t
+    for (var b = 0; b < bumps.length; b++) {{
+        if (b > 0) {{
+            restoreWorld(ckpt)
+            if (rngCkpt !== null) noiseRng = rngCkpt.slice()
+        }}
+        t = t0
+        // Impulses are applied at an offset from the center of mass; vectors
+        // come from the same chipmunk module that the world uses
+        var body = w.getObject(bumps[b][0]).cpBody
+        var Vect = body.p.constructor
+        var loc = bumps[b][2]
+        var off = (typeof(loc) === 'undefined' || loc === null) ? new Vect(0, 0) :
+            new Vect(loc[0] - body.p.x, loc[1] - body.p.y)
+        body.applyImpulse(new Vect(bumps[b][1][0], bumps[b][1][1]), off)
+        var bpath = {{}}
+        for (var i = 0; i < tracknames.length; i++) {{
+            bpath[tracknames[i]] = pathdict[tracknames[i]].slice()
+        }}
+        var rest = makeRestCheck(w, restDict)
+        running = !(w.checkEnd() || (t >= maxtime))
+        while (running) {{
+            w.step(stepSize)
+            t += stepSize
+            record(bpath)
+            if (w.checkEnd() || (t >= maxtime) || isAtRest(rest, stepSize)) {{
+                running = false
+            }}
+        }}
+        results.push(finish(bpath, rest))
+    }}
+    return results
+}}
+function getGWPathBumpAndNoise(worldDict, bumpTime, bumpObj, bumpImpulse, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
+    return getGWPathBumpAndNoiseLocation(worldDict, bumpTime, bumpObj, bumpImpulse, null,
+                                         maxtime, stepSize, noiseDict, returnNewWorld, restDict)
+}}
+// A single bump in one straight run: steps up to bumpTime, applies the impulse
+// at bumpLocation (or the center of bumpObj if null) and runs on from there
+function getGWPathBumpAndNoiseLocation(worldDict, bumpTime, bumpObj, bumpImpulse, bumpLocation, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
+    var w = pg.loadFromDict(worldDict)
+    if (typeof(noiseDict) !== 'undefined' && isntEmpty(noiseDict)) {{
+        w = applyNoise(w, noiseDict)
+    }}
+    if (returnNewWorld){{
+        var returnWorld = w.toDict()
+    }}
+    var running = true
+    var bumped = false
+    var t = 0
+    var rest = null
+    var pathdict = {{}}
+    var tracknames = []
+    for (onm in w.objects) {{
+        var o = w.objects[onm]
+        if (!o.isStatic()) {{
+            tracknames.push(onm)
+            pathdict[onm] = [o.getPos()]
+        }}
+    }}
+    while (running) {{
+        if (!bumped && t >= bumpTime - stepSize / 2) {{
+            var body = w.getObject(bumpObj).cpBody
+            var Vect = body.p.constructor
+            var off = (typeof(bumpLocation) === 'undefined' || bumpLocation === null) ? new Vect(0, 0) :
+                new Vect(bumpLocation[0] - body.p.x, bumpLocation[1] - body.p.y)
+            body.applyImpulse(new Vect(bumpImpulse[0], bumpImpulse[1]), off)
+            bumped = true
+            // Only check for rest once the bump has been applied
+            rest = makeRestCheck(w, restDict)
+            if (w.checkEnd() || (t >= maxtime)) break
+        }}
+        w.step(stepSize)
+        t += stepSize
+        for (var i = 0; i < tracknames.length; i++) {{
+            onm = tracknames[i]
+            pathdict[onm].push(w.objects[onm].getPos())
+        }}
+        if (w.checkEnd() || (t >= maxtime) || (bumped && isAtRest(rest, stepSize))) {{
+            running = false
+        }}
+    }}
+    if (!bumped) rest = makeRestCheck(w, restDict)
     if (returnNewWorld) {{
-        return [pathdict, collisions, w.checkEnd(), t, returnWorld]
+        return withStopReason([pathdict, w.checkEnd(), t, returnWorld], w, rest)
     }} else {{
-        return [pathdict, collisions, w.checkEnd(), t]
+        return withStopReason([pathdict, w.checkEnd(), t], w, rest)
+    }}
+}}
+// execjs can only pass JSON back, so its calls go through here: typed arrays
+// (up to depth levels into the result) are replaced by base64 placeholders
+function packArraysBase64(obj, depth) {{
+    if (ArrayBuffer.isView(obj)) {{
+        return {{__array__: obj.constructor.name,
+                base64: Buffer.from(obj.buffer, obj.byteOffset, obj.byteLength).toString('base64')}}
+    }}
+    if (depth > 0 && obj !== null && typeof(obj) === 'object') {{
+        for (var k in obj) obj[k] = packArraysBase64(obj[k], depth - 1)
     }}
+    return obj
+}}
+function callPacked(fname, args) {{
+    return packArraysBase64(eval(fname).apply(null, args), 3)
 }}
 '''
 
@@ -302,6 +692,13 @@ function checkMultiPlaceCollide(tool, position) {{
     }}
     return false
 }}
+function checkMultiPlaceCollideBatch(tool, positions) {{
+    var ret = []
+    for (var i=0; i < positions.length; i++) {{
+        ret.push(checkMultiPlaceCollide(tool, positions[i]))
+    }}
+    return ret
+}}
 '''
 
 
@@ -336,32 +733,196 @@ function addBall(worldDict, pos, rad) {{
     }}
     return worldDict
 }}
-function runGWPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function runGWPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
+    var w = addTool(worldDict, toolverts, pos)
+    return runGW(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict)
+}}
+function getGWPathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    var w = addTool(worldDict, toolverts, pos)
+    return getGWPath(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
+}}
+function getGWPathAndRotPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    var w = addTool(worldDict, toolverts, pos)
+    return getGWPathAndRot(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
+}}
+function getGWStatePathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = addTool(worldDict, toolverts, pos)
-    return runGW(w, maxtime, stepSize, noiseDict, returnNewWorld)
+    return getGWStatePath(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
 }}
-function getGWPathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWStateArrayPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = addTool(worldDict, toolverts, pos)
-    return getGWPath(w, maxtime, stepSize, noiseDict, returnNewWorld)
+    return getGWStateArray(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
 }}
-function getGWPathAndRotPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWCollisionPathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = addTool(worldDict, toolverts, pos)
-    return getGWPathAndRot(w, maxtime, stepSize, noiseDict, returnNewWorld)
+    return getGWCollisionPath(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
 }}
-function getGWStatePathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWCollisionPathAndRotPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = addTool(worldDict, toolverts, pos)
-    return getGWStatePath(w, maxtime, stepSize, noiseDict, returnNewWorld)
+    return getGWCollisionPathAndRot(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
 }}
-function getGWCollisionPathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWGeomPathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
     var w = addTool(worldDict, toolverts, pos)
-    return getGWCollisionPath(w, maxtime, stepSize, noiseDict, returnNewWorld)
+    return getGWGeomPath(w, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
 }}
-function getGWCollisionPathAndRotPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWPathBumpBranchesPlacement(worldDict, toolverts, pos, bumpTime, bumps, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
     var w = addTool(worldDict, toolverts, pos)
-    return getGWCollisionPathAndRot(w, maxtime, stepSize, noiseDict, returnNewWorld)
+    return getGWPathBumpBranches(w, bumpTime, bumps, maxtime, stepSize, noiseDict, returnNewWorld, restDict)
 }}
-function getGWGeomPathPlacement(worldDict, toolverts, pos, maxtime, stepSize, noiseDict, returnNewWorld) {{
+function getGWPathBumpAndNoisePlacement(worldDict, toolverts, pos, bumpTime, bumpObj, bumpImpulse, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
     var w = addTool(worldDict, toolverts, pos)
-    return getGWGeomPath(w, maxtime, stepSize, noiseDict, returnNewWorld)
+    return getGWPathBumpAndNoise(w, bumpTime, bumpObj, bumpImpulse, maxtime, stepSize, noiseDict, returnNewWorld, restDict)
+}}
+function getGWPathBumpAndNoiseLocationPlacement(worldDict, toolverts, pos, bumpTime, bumpObj, bumpImpulse, bumpLocation, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
+    var w = addTool(worldDict, toolverts, pos)
+    return getGWPathBumpAndNoiseLocation(w, bumpTime, bumpObj, bumpImpulse, bumpLocation, maxtime, stepSize, noiseDict, returnNewWorld, restDict)
+}}
+// Batched versions: tools is a dict of tool vertices and placements is a list
+// of [toolname, position] or [toolname, position, noise seed]; returns a list
+// with one result per placement
+function placementBatch(fnc, worldStr, tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    var results = []
+    for (var i = 0; i < placements.length; i++) {{
+        var p = placements[i]
+        var nd = noiseDict
+        if (p.length > 2 && isntEmpty(noiseDict)) {{
+            nd = Object.assign({{}}, noiseDict)
+            nd.seed = p[2]
+        }}
+        results.push(fnc(JSON.parse(worldStr), tools[p[0]], p[1], maxtime, stepSize, nd, returnNewWorld, restDict, recordDict))
+    }}
+    return results
+}}
+function runGWPlacementBatch(worldDict, tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    return placementBatch(runGWPlacement, JSON.stringify(worldDict), tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
+}}
+function getGWPathPlacementBatch(worldDict, tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    return placementBatch(getGWPathPlacement, JSON.stringify(worldDict), tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
+}}
+function getGWStatePathPlacementBatch(worldDict, tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    return placementBatch(getGWStatePathPlacement, JSON.stringify(worldDict), tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
 }}
+// World registry: when the context lives in a persistent worker, worlds (and
+// their tools) can be registered once and later calls only send the handle
+var worldFunctions = {{
+    runGW: runGW,
+    getGWPath: getGWPath,
+    getGWPathAndRot: getGWPathAndRot,
+    getGWStatePath: getGWStatePath,
+    getGWStateArray: getGWStateArray,
+    getGWGeomPath: getGWGeomPath,
+    getGWCollisionPath: getGWCollisionPath,
+    getGWCollisionPathAndRot: getGWCollisionPathAndRot
+}}
+var placementFunctions = {{
+    runGWPlacement: runGWPlacement,
+    getGWPathPlacement: getGWPathPlacement,
+    getGWPathAndRotPlacement: getGWPathAndRotPlacement,
+    getGWStatePathPlacement: getGWStatePathPlacement,
+    getGWStateArrayPlacement: getGWStateArrayPlacement,
+    getGWCollisionPathPlacement: getGWCollisionPathPlacement,
+    getGWCollisionPathAndRotPlacement: getGWCollisionPathAndRotPlacement,
+    getGWGeomPathPlacement: getGWGeomPathPlacement
+}}
+var worldRegistry = {{}}
+var nextWorldHandle = 0
+function registerWorld(worldDict, tools) {{
+    var handle = nextWorldHandle++
+    worldRegistry[handle] = {{world: JSON.stringify(worldDict), tools: tools}}
+    return handle
+}}
+function releaseWorld(handle) {{
+    delete worldRegistry[handle]
+}}
+function getRegisteredWorld(handle) {{
+    var entry = worldRegistry[handle]
+    if (typeof(entry) === 'undefined') throw new Error('No world registered with handle ' + handle)
+    return entry
+}}
+function runHandle(fnc, handle, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    var entry = getRegisteredWorld(handle)
+    return worldFunctions[fnc](JSON.parse(entry.world), maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
+}}
+function runPlacementHandle(fnc, handle, toolname, pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    var entry = getRegisteredWorld(handle)
+    return placementFunctions[fnc](JSON.parse(entry.world), entry.tools[toolname], pos, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
+}}
+function runPlacementBatchHandle(fnc, handle, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict) {{
+    var entry = getRegisteredWorld(handle)
+    return placementBatch(placementFunctions[fnc], entry.world, entry.tools, placements, maxtime, stepSize, noiseDict, returnNewWorld, restDict, recordDict)
+}}
+function runBumpBranchesHandle(handle, toolname, pos, bumpTime, bumps, maxtime, stepSize, noiseDict, returnNewWorld, restDict) {{
+    var entry = getRegisteredWorld(handle)
+    return getGWPathBumpBranchesPlacement(JSON.parse(entry.world), entry.tools[toolname], pos, bumpTime, bumps, maxtime, stepSize, noiseDict, returnNewWorld, restDict)
+}}
+'''
+
+# The program run by a persistent node worker (see jsworker.py). Messages are
+# framed as a 4-byte big-endian length followed by a UTF-8 JSON payload:
+#   ['load', source] compiles a context once and keeps its functions alive
+#   ['call', fname, args] calls a function in the loaded context (and then its
+#       endCall function, if it has one, to clean up after the call)
+# Each message is answered by an ['ok', result, nbuffers] or ['err', message, 0]
+# frame. Typed arrays in a result (e.g., from getGWStateArray) are not put in the
+# JSON but sent raw in the nbuffers frames that follow it, and the result holds
+# {__array__: type name, index: i} placeholders for them
+worker_context = '''
+console.log = console.error
+var lookup = null
+var endCall = null
+var pending = Buffer.alloc(0)
+// Contexts add their module path with module.paths.push(...)
+var ctxModule = {paths: []}
+function ctxRequire(id) {
+    return require(require.resolve(id, {paths: ctxModule.paths.concat([process.cwd()])}))
+}
+function packArrays(obj, buffers, depth) {
+    if (ArrayBuffer.isView(obj)) {
+        buffers.push(Buffer.from(obj.buffer, obj.byteOffset, obj.byteLength))
+        return {__array__: obj.constructor.name, index: buffers.length - 1}
+    }
+    if (depth > 0 && obj !== null && typeof(obj) === 'object') {
+        for (var k in obj) obj[k] = packArrays(obj[k], buffers, depth - 1)
+    }
+    return obj
+}
+function frame(buf) {
+    var head = Buffer.alloc(4)
+    head.writeUInt32BE(buf.length, 0)
+    return [head, buf]
+}
+function send(status, result) {
+    var buffers = []
+    result = packArrays(result, buffers, 3)
+    var frames = frame(Buffer.from(JSON.stringify([status, result, buffers.length]), 'utf8'))
+    for (var i = 0; i < buffers.length; i++) frames = frames.concat(frame(buffers[i]))
+    process.stdout.write(Buffer.concat(frames))
+}
+function handle(msg) {
+    if (msg[0] === 'load') {
+        lookup = new Function('module', 'require',
+            msg[1] + '\\nreturn function(__fnm) { return eval(__fnm) }')(ctxModule, ctxRequire)
+        endCall = lookup("typeof(endCall) === 'function' ? endCall : null")
+        return null
+    }
+    try {
+        return lookup(msg[1]).apply(null, msg[2])
+    } finally {
+        if (endCall !== null) endCall()
+    }
+}
+process.stdin.on('data', function(chunk) {
+    pending = Buffer.concat([pending, chunk])
+    while (pending.length >= 4) {
+        var n = pending.readUInt32BE(0)
+        if (pending.length < n + 4) break
+        var msg = JSON.parse(pending.toString('utf8', 4, n + 4))
+        pending = pending.slice(n + 4)
+        try {
+            send('ok', handle(msg))
+        } catch (err) {
+            send('err', String((err && err.stack) || err))
+        }
+    }
+})
 '''
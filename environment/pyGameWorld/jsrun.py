@@ -1,13 +1,13 @@
-from execjs import get
 from .world import loadFromDict
-from .helpers import filterCollisionEvents
+from .helpers import filterCollisionEvents, CollisionEventFilter
+from .constants import DEFAULT_REST_DICT
+import numpy as np
 import copy
 import os, json
 
-__all__ = ["jsRunGame", "pyRunGame", "jsGetPath", "pyGetPath", "jsGetStatePath", "pyGetStatePath", "jsGetCollisions", "pyGetCollisions", "pyGetCollisionsAddForces"]
+__all__ = ["jsRunGame", "pyRunGame", "jsGetPath", "pyGetPath", "jsGetStatePath", "pyGetStatePath", "jsGetCollisions", "pyGetCollisions", "pyGetCollisionsAddForces", "pyGetCollisionsBranchForces", "pySettleGame"]
 
-jsruntime = get('Node')
-jscontext = jsruntime.compile('''
+_runSource = '''
     module.paths.push('%s');
     var pg = require('PhysicsGaming');
     function runGW(worldDict, maxtime, stepSize) {
@@ -23,9 +23,9 @@ jscontext = jsruntime.compile('''
         }
         return [w.checkEnd(), t];
     };
-''' % os.path.join(os.path.dirname(__file__), 'node_modules'))
+''' % os.path.join(os.path.dirname(__file__), 'node_modules')
 
-jscontext_path = jsruntime.compile('''
+_pathSource = '''
     module.paths.push('%s');
     var pg = require('PhysicsGaming');
     function getGWPath(worldDict, maxtime, stepSize) {
@@ -54,9 +54,9 @@ jscontext_path = jsruntime.compile('''
         }
         return [pathdict, w.checkEnd(), t];
     };
-''' % os.path.join(os.path.dirname(__file__), 'node_modules'))
+''' % os.path.join(os.path.dirname(__file__), 'node_modules')
 
-jscontext_statepath = jsruntime.compile('''
+_statePathSource = '''
     module.paths.push('%s');
     var pg = require('PhysicsGaming');
     function getGWStatePath(worldDict, maxtime, stepSize) {
@@ -85,9 +85,9 @@ jscontext_statepath = jsruntime.compile('''
         }
         return [pathdict, w.checkEnd(), t];
     };
-''' % os.path.join(os.path.dirname(__file__), 'node_modules'))
+''' % os.path.join(os.path.dirname(__file__), 'node_modules')
 
-jscontext_collision = jsruntime.compile('''
+_collisionSource = '''
     module.paths.push('%s');
     var pg = require('PhysicsGaming');
     function getGWPath(worldDict, maxtime, stepSize) {
@@ -118,22 +118,93 @@ jscontext_collision = jsruntime.compile('''
 
         return [pathdict, collisions, w.checkEnd(), t];
     };
-''' % os.path.join(os.path.dirname(__file__), 'node_modules'))
+''' % os.path.join(os.path.dirname(__file__), 'node_modules')
 
+# The execjs contexts are only compiled (and Node looked up) on first use, so
+# that importing the package does not need Node
+_sources = {'jscontext': _runSource, 'jscontext_path': _pathSource,
+            'jscontext_statepath': _statePathSource,
+            'jscontext_collision': _collisionSource}
+_compiled = dict()
 
-def pyRunGame(gameworld, maxtime = 20., stepSize=.1):
+def _jsContext(name):
+    if name not in _compiled:
+        from execjs import get
+        _compiled[name] = get('Node').compile(_sources[name])
+    return _compiled[name]
+
+def __getattr__(name):
+    if name in _sources:
+        return _jsContext(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+# Ends runs early once the world has been at rest for a while. restDict can
+# override the entries of DEFAULT_REST_DICT; an empty or None restDict turns the
+# check off, and the py* functions then return exactly what they used to
+class _RestCheck(object):
+    def __init__(self, restDict):
+        self.on = bool(restDict)
+        rd = dict(DEFAULT_REST_DICT)
+        if self.on:
+            rd.update(restDict)
+        self.velThreshold = rd['vel_threshold']
+        self.angThreshold = rd['ang_threshold']
+        self.window = rd['window']
+        self.still = 0
+        self.atRest = False
+
+    def __call__(self, gameworld, stepSize):
+        if not self.on:
+            return False
+        if gameworld.isAtRest(self.velThreshold, self.angThreshold):
+            self.still += stepSize
+        else:
+            self.still = 0
+        self.atRest = self.still >= self.window
+        return self.atRest
+
+    # Adds why the run ended ('goal', 'rest' or 'timeout') if the check is on
+    def finish(self, gameworld, ret):
+        if not self.on:
+            return ret
+        if gameworld.checkEnd():
+            reason = 'goal'
+        elif self.atRest:
+            reason = 'rest'
+        else:
+            reason = 'timeout'
+        return ret + (reason,)
+
+def pyRunGame(gameworld, maxtime = 20., stepSize=.1, restDict=None):
     running = True
     t = 0
+    rest = _RestCheck(restDict)
     while running:
         gameworld.step(stepSize)
         t += stepSize
-        if gameworld.checkEnd() or (t >= maxtime):
+        if gameworld.checkEnd() or (t >= maxtime) or rest(gameworld, stepSize):
+            running = False
+    return rest.finish(gameworld, (gameworld.checkEnd(), t))
+
+# Same as settleGW in JS: runs the world with nothing added until it comes to
+# rest (judged by restDict, defaulting to DEFAULT_REST_DICT) or maxtime passes,
+# and returns the world dict at that point, the time taken and whether it
+# came to rest
+def pySettleGame(gameworld, maxtime = 10., stepSize = .1, restDict=None):
+    running = True
+    t = 0
+    rest = _RestCheck(restDict or DEFAULT_REST_DICT)
+    while running:
+        gameworld.step(stepSize)
+        t += stepSize
+        if (t >= maxtime) or rest(gameworld, stepSize):
             running = False
-    return gameworld.checkEnd(), t
+    return gameworld.toDict(), t, rest.atRest
 
-def pyGetPath(gameworld, maxtime = 20., stepSize = .1):
+def pyGetPath(gameworld, maxtime = 20., stepSize = .1, restDict=None):
     running = True
     t = 0
+    rest = _RestCheck(restDict)
     pathdict = dict()
     tracknames = []
     for onm, o in gameworld.objects.items():
@@ -145,13 +216,19 @@ def pyGetPath(gameworld, maxtime = 20., stepSize = .1):
         t += stepSize
         for onm in tracknames:
             pathdict[onm].append(gameworld.objects[onm].position)
-        if gameworld.checkEnd() or (t >= maxtime):
+        if gameworld.checkEnd() or (t >= maxtime) or rest(gameworld, stepSize):
             running = False
-    return pathdict, gameworld.checkEnd(), t
+    return rest.finish(gameworld, (pathdict, gameworld.checkEnd(), t))
 
-def pyGetStatePath(gameworld, maxtime = 20., stepSize = .1):
+# With asArray, the path dict is replaced by a (states, names) pair: a (steps,
+# objects, 5) float32 array of [x, y, rotation, vel_x, vel_y] and the name of
+# the object at each index of its second axis (as JSRunner.run_gw_state_path)
+def pyGetStatePath(gameworld, maxtime = 20., stepSize = .1, restDict=None, asArray=False):
+    if asArray:
+        return _pyGetStateArray(gameworld, maxtime, stepSize, restDict)
     running = True
     t = 0
+    rest = _RestCheck(restDict)
     pathdict = dict()
     tracknames = []
     for onm, o in gameworld.objects.items():
@@ -163,38 +240,76 @@ def pyGetStatePath(gameworld, maxtime = 20., stepSize = .1):
         t += stepSize
         for onm in tracknames:
             pathdict[onm].append([gameworld.objects[onm].position[0], gameworld.objects[onm].position[1], gameworld.objects[onm].rotation, gameworld.objects[onm].velocity[0], gameworld.objects[onm].velocity[1]])
-        if gameworld.checkEnd() or (t >= maxtime):
+        if gameworld.checkEnd() or (t >= maxtime) or rest(gameworld, stepSize):
             running = False
-    return pathdict, gameworld.checkEnd(), t
+    return rest.finish(gameworld, (pathdict, gameworld.checkEnd(), t))
 
-def pyGetCollisions(gameworld, maxtime = 20., stepSize = .1, collisionSlop = 0.2001):
+def _pyGetStateArray(gameworld, maxtime, stepSize, restDict):
     running = True
     t = 0
+    rest = _RestCheck(restDict)
+    tracknames = [onm for onm, o in gameworld.objects.items() if not o.isStatic()]
+    tracked = [gameworld.objects[onm] for onm in tracknames]
+    states = np.empty((int(np.ceil(maxtime / stepSize)) + 2, len(tracked), 5),
+                      dtype=np.float32)
+    frames = 0
+    while True:
+        if frames == len(states):
+            states = np.concatenate([states, np.empty_like(states)])
+        for i, o in enumerate(tracked):
+            states[frames, i] = (o.position[0], o.position[1], o.rotation,
+                                 o.velocity[0], o.velocity[1])
+        frames += 1
+        if not running:
+            break
+        gameworld.step(stepSize)
+        t += stepSize
+        if gameworld.checkEnd() or (t >= maxtime) or rest(gameworld, stepSize):
+            running = False
+    return rest.finish(gameworld, ((states[:frames], tracknames), gameworld.checkEnd(), t))
+
+# Sends the world's collision events to a filter as they happen for the rest of
+# the run, starting with the events it has already stored
+def _streamCollisions(gameworld, collisionSlop):
+    filt = CollisionEventFilter(collisionSlop)
+    filt.extend(gameworld.collisionEvents)
+    gameworld.setCollisionEventFilter(filt)
+    return filt
+
+def pyGetCollisions(gameworld, maxtime = 20., stepSize = .1, collisionSlop = 0.2001, restDict=None):
+    running = True
+    t = 0
+    rest = _RestCheck(restDict)
     pathdict = dict()
     tracknames = []
     for onm, o in gameworld.objects.items():
         if not o.isStatic():
             tracknames.append(onm)
             pathdict[onm] = [o.position]
+    filt = _streamCollisions(gameworld, collisionSlop)
     while running:
         gameworld.step(stepSize)
         t += stepSize
         for onm in tracknames:
             pathdict[onm].append(gameworld.objects[onm].position)
-        if gameworld.checkEnd() or (t >= maxtime):
+        if gameworld.checkEnd() or (t >= maxtime) or rest(gameworld, stepSize):
             running = False
-    collisions = filterCollisionEvents(gameworld.collisionEvents, collisionSlop)
-    return pathdict, collisions, gameworld.checkEnd(), t
+    gameworld.setCollisionEventFilter(None)
+    return rest.finish(gameworld, (pathdict, filt.getContacts(), gameworld.checkEnd(), t))
 
-def pyGetCollisionsAddForces(gameworld, force_times={}, maxtime = 20., stepSize = .1, collisionSlop = 0.2001):
+def pyGetCollisionsAddForces(gameworld, force_times={}, maxtime = 20., stepSize = .1, collisionSlop = 0.2001, restDict=None):
     running = True
     t = 0
+    rest = _RestCheck(restDict)
+    # Don't stop for rest while there are still forces left to apply
+    lastforce = max(force_times.keys(), default=0)
     pathdict = dict()
     tracknames = []
     for onm, o in gameworld.objects.items():
         if not o.isStatic():
             tracknames.append(onm)
             pathdict[onm] = [o.position]
+    filt = _streamCollisions(gameworld, collisionSlop)
     while running:
         gameworld.step(stepSize)
         t += stepSize
@@ -205,27 +320,88 @@ def pyGetCollisionsAddForces(gameworld, force_times={}, maxtime = 20., stepSize
                 position = obj_force[2]
                 gameworld.objects[onm].kick(impulse, position)
 
+        for onm in tracknames:
+            pathdict[onm].append(gameworld.objects[onm].position)
+        if gameworld.checkEnd() or (t >= maxtime) or (rest(gameworld, stepSize) and t >= lastforce):
+            running = False
+    gameworld.setCollisionEventFilter(None)
+    return rest.finish(gameworld, (pathdict, filt.getContacts(), gameworld.checkEnd(), t))
+
+'''Like pyGetCollisionsAddForces with a single bump at bumpTime, but for a
+whole sweep of bumps: runs the world once up to bumpTime, snapshots it, and
+continues from that snapshot once for every [object name, impulse, position]
+in forces (a position of None kicks the object at its center). Returns a list
+with one pyGetCollisionsAddForces-style result per force.
+
+Note that continuing from a snapshot starts with fresh contact caches (see
+PGWorld.snapshot), so the continuations can differ very slightly from
+separate runs. The world is left at the end of the last continuation
+'''
+def pyGetCollisionsBranchForces(gameworld, bumpTime, forces, maxtime = 20., stepSize = .1, collisionSlop = 0.2001, restDict=None):
+    running = True
+    t = 0
+    pathdict = dict()
+    tracknames = []
+    for onm, o in gameworld.objects.items():
+        if not o.isStatic():
+            tracknames.append(onm)
+            pathdict[onm] = [o.position]
+    filt = _streamCollisions(gameworld, collisionSlop)
+    # The shared part: nothing to branch if the run ends before the bump
+    while running and t < bumpTime - stepSize/2.:
+        gameworld.step(stepSize)
+        t += stepSize
         for onm in tracknames:
             pathdict[onm].append(gameworld.objects[onm].position)
         if gameworld.checkEnd() or (t >= maxtime):
             running = False
-    collisions = filterCollisionEvents(gameworld.collisionEvents, collisionSlop)
-    return pathdict, collisions, gameworld.checkEnd(), t
+    if not running:
+        gameworld.setCollisionEventFilter(None)
+        ret = _RestCheck(restDict).finish(gameworld, (pathdict, filt.getContacts(), gameworld.checkEnd(), t))
+        return [copy.deepcopy(ret) for _ in forces]
+
+    snap = gameworld.snapshot()
+    snapfilt = copy.deepcopy(filt)
+    t0 = t
+    results = []
+    for onm, impulse, position in forces:
+        gameworld.restore(snap)
+        filt = copy.deepcopy(snapfilt)
+        gameworld.setCollisionEventFilter(filt)
+        t = t0
+        rest = _RestCheck(restDict)
+        obj = gameworld.objects[onm]
+        if position is None:
+            obj.kick(impulse, obj.position, unsafe=True)
+        else:
+            obj.kick(impulse, position)
+        bpath = dict([(nm, list(p)) for nm, p in pathdict.items()])
+        running = not (gameworld.checkEnd() or (t >= maxtime))
+        while running:
+            gameworld.step(stepSize)
+            t += stepSize
+            for nm in tracknames:
+                bpath[nm].append(gameworld.objects[nm].position)
+            if gameworld.checkEnd() or (t >= maxtime) or rest(gameworld, stepSize):
+                running = False
+        results.append(rest.finish(gameworld, (bpath, filt.getContacts(), gameworld.checkEnd(), t)))
+    gameworld.setCollisionEventFilter(None)
+    return results
 
 def jsRunGame(gameworld, maxtime = 20., stepSize=.1):
     w = gameworld.toDict()
-    return jscontext.call('runGW', w, maxtime, stepSize)
+    return _jsContext('jscontext').call('runGW', w, maxtime, stepSize)
 
 def jsGetPath(gameworld, maxtime = 20., stepSize = .1):
     w = gameworld.toDict()
-    return jscontext_path.call('getGWPath', w, maxtime, stepSize)
+    return _jsContext('jscontext_path').call('getGWPath', w, maxtime, stepSize)
 
 def jsGetStatePath(gameworld, maxtime = 20., stepSize = .1):
     w = gameworld.toDict()
-    return jscontext_statepath.call('getGWStatePath', w, maxtime, stepSize)
+    return _jsContext('jscontext_statepath').call('getGWStatePath', w, maxtime, stepSize)
 
 def jsGetCollisions(gameworld, maxtime = 20., stepSize = .1, collisionSlop = 0.2001):
     w = gameworld.toDict()
-    path,col,end,t = jscontext_collision.call('getGWPath', w, maxtime, stepSize)
+    path,col,end,t = _jsContext('jscontext_collision').call('getGWPath', w, maxtime, stepSize)
     fcol = filterCollisionEvents(col, collisionSlop)
     return [path,fcol,end,t]
@@ -0,0 +1,137 @@
+from __future__ import division, print_function
+import base64
+import json
+import shutil
+import struct
+import subprocess
+import threading
+from .js_contexts import worker_context
+from .helpers import NpEncoder
+import numpy as np
+
+__all__ = ['JSWorker', 'JSWorkerError']
+
+
+class JSWorkerError(Exception):
+    pass
+
+
+# numpy types for the JS typed arrays that can come back in results
+_ARRAY_TYPES = {
+    'Float32Array': np.float32,
+    'Float64Array': np.float64,
+    'Int32Array': np.int32,
+    'Uint8Array': np.uint8
+}
+
+# Replaces the {'__array__': type name, ...} placeholders for typed arrays in a
+# JS result (up to depth levels in) with numpy arrays. The data is either the
+# index of one of the raw buffers sent after the result by a worker, or base64
+# (for results packed by callPacked through execjs)
+def _unpackArrays(obj, buffers=(), depth=3):
+    if isinstance(obj, dict):
+        if '__array__' in obj:
+            if 'base64' in obj:
+                data = bytearray(base64.b64decode(obj['base64']))
+            else:
+                data = buffers[obj['index']]
+            return np.frombuffer(data, dtype=_ARRAY_TYPES[obj['__array__']])
+        if depth > 0:
+            return {k: _unpackArrays(v, buffers, depth-1) for k, v in obj.items()}
+    elif isinstance(obj, list) and depth > 0:
+        return [_unpackArrays(v, buffers, depth-1) for v in obj]
+    return obj
+
+
+def _nodeBinary():
+    node = shutil.which('node') or shutil.which('nodejs')
+    if node is None:
+        raise JSWorkerError("Could not find a node.js binary on the PATH")
+    return node
+
+
+'''A long-lived node process that compiles a JS context once and then answers
+calls over a pipe. Has the same call(fname, *args) interface as the contexts
+returned by execjs.compile(), so it can be swapped in for those directly, but
+does not spawn a new node process (or resend the context) for every call.
+
+Messages are framed as a 4-byte big-endian length followed by a JSON payload.
+Typed arrays in results come back as raw bytes after the JSON (see
+worker_context) and are returned as numpy arrays
+Args:
+    source [str]: the JS context to load (e.g., a formatted js_contexts string)
+'''
+class JSWorker(object):
+
+    def __init__(self, source):
+        self._lock = threading.Lock()
+        self._proc = subprocess.Popen([_nodeBinary(), '-e', worker_context],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE)
+        self._request(['load', source])
+
+    def _send(self, msg):
+        if self._proc is None:
+            raise JSWorkerError("The node worker has been closed")
+        body = json.dumps(msg, cls=NpEncoder).encode('utf-8')
+        try:
+            self._proc.stdin.write(struct.pack('>I', len(body)) + body)
+            self._proc.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            raise JSWorkerError("The node worker is no longer running")
+
+    def _readExactly(self, n):
+        data = self._proc.stdout.read(n)
+        if data is None or len(data) < n:
+            raise JSWorkerError("The node worker exited unexpectedly")
+        return data
+
+    def _recvFrame(self):
+        n, = struct.unpack('>I', self._readExactly(4))
+        return self._readExactly(n)
+
+    def _recv(self):
+        status, result, nbuffers = json.loads(self._recvFrame().decode('utf-8'))
+        buffers = [bytearray(self._recvFrame()) for _ in range(nbuffers)]
+        if status == 'err':
+            raise JSWorkerError(result)
+        if nbuffers:
+            return _unpackArrays(result, buffers)
+        return result
+
+    def _request(self, msg):
+        with self._lock:
+            self._send(msg)
+            return self._recv()
+
+    '''Calls the JS function fname with the given (JSON-serializable) args and
+    returns the decoded result
+    '''
+    def call(self, fname, *args):
+        return self._request(['call', fname, list(args)])
+
+    def isAlive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            self._proc.wait(timeout=5)
+        except Exception:
+            self._proc.kill()
+        self._proc.stdout.close()
+        self._proc = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
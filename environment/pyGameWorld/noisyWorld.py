@@ -1,14 +1,95 @@
 from .world import *
 from .constants import *
-from scipy.stats import norm, truncnorm
 import numpy as np
 import pymunk as pm
+import math
+from collections import OrderedDict
 from copy import copy
 import pickle
 
-__all__ = ['noisifyWorld', 'truncNorm', 'wrappedNorm']
-
-def truncNorm(mu, sig, lower = None, upper = None):
+__all__ = ['noisifyWorld', 'truncNorm', 'wrappedNorm', 'NoiseBuffer',
+           'noiseSeed']
+
+_SQRT2 = math.sqrt(2)
+
+def _ndtr(x):
+    return .5 * math.erfc(-x / _SQRT2)
+
+'''A stock of pre-drawn random numbers, refilled in blocks, so that noise can
+be drawn one value at a time without paying numpy/scipy's per-call overhead.
+Blocks come from numpy's global random state (as scipy.stats draws do) unless
+an rng is given. Since a block is drawn all at once, draws from the global
+state made after filling one are shifted; the noise functions only buffer
+when given a NoiseBuffer, and otherwise draw straight from np.random
+Args:
+    blocksize [int]: how many numbers to draw at once
+    rng [np.random.Generator]: the generator to draw from (defaults to None,
+        numpy's global state)
+'''
+class NoiseBuffer(object):
+
+    def __init__(self, blocksize=1024, rng=None):
+        self.blocksize = blocksize
+        self._rng = rng
+        self._unif = []
+        self._ui = 0
+        self._norm = []
+        self._ni = 0
+
+    '''Returns a single draw from U(0, 1)'''
+    def uniform(self):
+        if self._ui >= len(self._unif):
+            if self._rng is None:
+                self._unif = np.random.random_sample(self.blocksize).tolist()
+            else:
+                self._unif = self._rng.random(self.blocksize).tolist()
+            self._ui = 0
+        self._ui += 1
+        return self._unif[self._ui - 1]
+
+    '''Returns a single draw from N(0, 1), or an array of them if size is given'''
+    def normal(self, size=None):
+        if size is not None:
+            return np.array([self.normal() for _ in range(size)])
+        if self._ni >= len(self._norm):
+            if self._rng is None:
+                self._norm = np.random.standard_normal(self.blocksize).tolist()
+            else:
+                self._norm = self._rng.standard_normal(self.blocksize).tolist()
+            self._ni = 0
+        self._ni += 1
+        return self._norm[self._ni - 1]
+
+# Draws one value at a time from numpy's global random state, for noise drawn
+# without a NoiseBuffer (so np.random.seed() gives the same draws as ever)
+class _GlobalNoise(object):
+
+    def uniform(self):
+        return np.random.random_sample()
+
+    def normal(self, size=None):
+        return np.random.standard_normal(size)
+
+_globalNoise = _GlobalNoise()
+
+# Flattens a seed like (seed, i) or ((seed, i), j) into a list of ints
+def _seedEntropy(seed):
+    if np.ndim(seed) == 0 and not isinstance(seed, (list, tuple)):
+        return [int(seed)]
+    return [e for s in seed for e in _seedEntropy(s)]
+
+'''Turns a seed into the four 32-bit ints that seed the JS noise generator.
+Seeds are ints or (nested) sequences of ints; (seed, i) gives the i-th sample
+drawn with seed its own stream, independent of the others
+'''
+def noiseSeed(seed):
+    ss = np.random.SeedSequence(_seedEntropy(seed))
+    return [int(x) for x in ss.generate_state(4)]
+
+# Samples a truncated normal by inverting its CDF on a uniform draw
+def truncNorm(mu, sig, lower = None, upper = None, buffer = None):
+    if buffer is None:
+        buffer = _globalNoise
     if lower is None:
         a = -20
     else:
@@ -17,10 +98,20 @@ def truncNorm(mu, sig, lower = None, upper = None):
         b = 20
     else:
         b = (upper - mu) /sig
-    return mu + sig * truncnorm.rvs(a,b,size=1)[0]
-
-def wrappedNorm(mu, sig):
-    return (mu + sig*norm.rvs(size=1))[0] % (2*np.pi)
+    # scipy is only loaded once noise is drawn, to keep the package import light
+    from scipy.special import ndtri
+    # Work in the lower tail, where the CDF keeps its precision
+    flip = a > 0
+    if flip:
+        a, b = -b, -a
+    pa = _ndtr(a)
+    x = float(ndtri(pa + buffer.uniform() * (_ndtr(b) - pa)))
+    return mu + sig * (-x if flip else x)
+
+def wrappedNorm(mu, sig, buffer = None):
+    if buffer is None:
+        buffer = _globalNoise
+    return (mu + sig*buffer.normal()) % (2*np.pi)
 
 # Helper function to keep track of objects that are touching before the noisification
 def _add_collisions(s1, s2, collision_list):
@@ -54,6 +145,7 @@ def _move_static(obj, pos_ch, space):
         obj._cpShape.elasticity = elast
         obj._cpShape.collision_type = COLTYPE_SOLID
         obj._cpShape.name = nm
+        obj._cpShape.pgobject = obj
         space.add(obj._cpShape)
     elif obj.type == 'Ball':
         npos = obj._cpShape.offset + pos_ch
@@ -64,6 +156,7 @@ def _move_static(obj, pos_ch, space):
         obj._cpShape.elasticity = elast
         obj._cpShape.collision_type = COLTYPE_SOLID
         obj._cpShape.name = nm
+        obj._cpShape.pgobject = obj
         space.add(obj._cpShape)
     elif obj.type == 'Segment':
         a = obj._cpShape.a + pos_ch
@@ -75,6 +168,7 @@ def _move_static(obj, pos_ch, space):
         obj._cpShape.elasticity = elast
         obj._cpShape.collision_type = COLTYPE_SOLID
         obj._cpShape.name = nm
+        obj._cpShape.pgobject = obj
         space.add(obj._cpShape)
     elif obj.type == 'Container':
         space.remove(obj._cpPolyShapes)
@@ -90,6 +184,7 @@ def _move_static(obj, pos_ch, space):
             s.elasticity = elast
             s.collision_type = COLTYPE_SOLID
             s.name = nm
+            s.pgobject = obj
             newshapes.append(s)
         obj.polylist = newpolys
         obj._cpPolyShapes = newshapes
@@ -99,6 +194,7 @@ def _move_static(obj, pos_ch, space):
         obj._cpSensor.sensor = True
         obj._cpSensor.collision_type = COLTYPE_SENSOR
         obj._cpSensor.name = nm
+        obj._cpSensor.pgobject = obj
         space.add(obj._cpSensor)
     elif obj.type == 'Compound':
         space.remove(obj._cpShapes)
@@ -112,22 +208,184 @@ def _move_static(obj, pos_ch, space):
             s.elasticity = elast
             s.collision_type = COLTYPE_SOLID
             s.name = nm
+            s.pgobject = obj
             newshapes.append(s)
         obj.polylist = newpolys
         obj._cpShapes = newshapes
         space.add(obj._cpShapes)
 
 
+'''Splits the objects in world (other than those named in exclude) into groups
+that touch, either directly or through other objects in the group. Candidate
+pairs come from a bounding box query on the space and are confirmed with
+shapes_collide (as in checkContact); touching objects are merged with
+union-find. fixed holds groups of objects already known to touch each other
+(e.g., the static ones), which are only checked against the rest. Returns a
+list of lists of object names
+'''
+def _contactGroups(world, exclude=(), fixed=()):
+    names = [onm for onm in world.objects.keys() if onm not in exclude]
+    order = dict((onm, i) for i, onm in enumerate(names))
+    parent = list(range(len(names)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    isfixed = [False] * len(names)
+    for og in fixed:
+        for onm in og:
+            isfixed[order[onm]] = True
+            parent[find(order[onm])] = find(order[og[0]])
+    # Only the exposed shapes count as touching (as in checkContact), so e.g.
+    # the sensor inside a container is skipped
+    exposed = set(sh for onm in names for sh in world.objects[onm]._exposeShapes())
+    space = world._cpSpace
+    # Moving bodies only update their bounding boxes & place in the spatial
+    # index when the space steps, so catch up with any moves since then
+    for o in world.objects.values():
+        if not o.isStatic():
+            space.reindex_shapes_for_body(o._cpBody)
+    for i, onm in enumerate(names):
+        if isfixed[i]:
+            continue
+        for sh in world.objects[onm]._exposeShapes():
+            for other in space.bb_query(sh.cache_bb(), pm.ShapeFilter()):
+                # Each pair is only checked from the earlier object, or from
+                # the one that is not fixed
+                j = order.get(getattr(other, 'name', None), -1)
+                if (j > i or (j >= 0 and isfixed[j])) and other in exposed:
+                    ri = find(i)
+                    rj = find(j)
+                    if ri != rj and len(sh.shapes_collide(other).points) > 0:
+                        parent[rj] = ri
+    groups = dict()
+    for i, onm in enumerate(names):
+        groups.setdefault(find(i), []).append(onm)
+    return list(groups.values())
+
+# Returns the names of the objects that obj touches, and the push that moves obj
+# out of the deepest overlap with a solid shape (down to the collision slop)
+def _objectContacts(world, obj, slop):
+    touching = set()
+    push = None
+    deepest = slop
+    for sh in obj._exposeShapes():
+        for other in world._cpSpace.bb_query(sh.cache_bb(), pm.ShapeFilter()):
+            onm = getattr(other, 'name', None)
+            if onm == obj.name or onm not in world.objects:
+                continue
+            cs = sh.shapes_collide(other)
+            if len(cs.points) > 0:
+                touching.add(onm)
+                # pymunk gives overlaps as positive distances along the normal
+                # from sh to other
+                depth = max([cp.distance for cp in cs.points])
+                if not (sh.sensor or other.sensor) and depth > deepest:
+                    deepest = depth
+                    push = -cs.normal * (depth - slop)
+    return touching, push
+
+'''Adds N(0, sd) noise to the positions of the dynamic objects named in names
+while keeping everything they touch the same. Each object gets its original
+position plus noise and is then pushed out of anything it overlaps. Objects
+that now touch something new (or stopped touching something) go back to
+their original positions and get a new draw on the next attempt; the ones that
+worked stay put. Objects that still fail after maxAttempts, or once maxStalled
+attempts in a row have not placed anything (e.g., a block wedged between two
+others), keep their original positions. Returns the number of attempts used
+'''
+def _noisifyMovingObjects(world, names, sd, noise, maxAttempts=500, maxStalled=50,
+                          nPasses=10):
+    space = world._cpSpace
+    slop = space.collision_slop
+    objs = [world.objects[onm] for onm in names]
+    orig_pos = dict([(o.name, o.position) for o in objs])
+    touches = dict([(o.name, _objectContacts(world, o, slop)[0]) for o in objs])
+
+    def place(o, pos):
+        o.position = pos
+        space.reindex_shapes_for_body(o._cpBody)
+
+    todo = objs
+    attempts = 0
+    stalled = 0
+    while len(todo) > 0 and attempts < maxAttempts and stalled < maxStalled:
+        attempts += 1
+        for o in todo:
+            place(o, orig_pos[o.name] + sd*noise.normal(2))
+        # Resolve overlaps a step at a time, like the solver would
+        for i in range(nPasses):
+            moved = False
+            for o in todo:
+                push = _objectContacts(world, o, slop)[1]
+                if push is not None:
+                    place(o, o.position + np.array(push))
+                    moved = True
+            if not moved:
+                break
+        # Putting an object back can change what the others touch, so check
+        # until nothing else fails
+        failed = set()
+        changed = True
+        while changed:
+            changed = False
+            for o in todo:
+                if o.name not in failed and \
+                        _objectContacts(world, o, slop)[0] != touches[o.name]:
+                    failed.add(o.name)
+                    place(o, orig_pos[o.name])
+                    changed = True
+        stalled = stalled + 1 if len(failed) == len(todo) else 0
+        todo = [o for o in todo if o.name in failed]
+    return attempts
+
+# The geometry of a shape (static shapes hang off of the space's static body,
+# so theirs is already in world coordinates)
+def _shapeGeometry(sh):
+    if isinstance(sh, pm.Poly):
+        return tuple(tuple(v) for v in sh.get_vertices())
+    if isinstance(sh, pm.Circle):
+        return (tuple(sh.offset), sh.radius)
+    return (tuple(sh.a), tuple(sh.b), sh.radius)
+
+# Which static objects touch each other only depends on the static geometry of
+# a level, so those groups are cached under it and shared by every world (and
+# placement) of the level; only the most recent levels are kept
+_staticGroupCache = OrderedDict()
+_MAX_STATIC_GROUPS = 64
+
+def _cachedContactGroups(world, exclude=()):
+    key = (tuple(sorted(exclude)),
+           tuple((onm, tuple(_shapeGeometry(sh) for sh in o._exposeShapes()))
+                 for onm, o in world.objects.items()
+                 if o.isStatic() and onm not in exclude))
+    if key in _staticGroupCache:
+        _staticGroupCache.move_to_end(key)
+    else:
+        moving = [onm for onm, o in world.objects.items() if not o.isStatic()]
+        _staticGroupCache[key] = _contactGroups(world, list(exclude) + moving)
+        while len(_staticGroupCache) > _MAX_STATIC_GROUPS:
+            _staticGroupCache.popitem(last=False)
+    return _contactGroups(world, exclude, _staticGroupCache[key])
 
 def noisifyWorld(gameworld, noise_position_static = 5., noise_position_moving = 5.,
                  noise_collision_direction = .2, noise_collision_elasticity = .2, noise_gravity = .1,
-                 noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1):
+                 noise_object_friction = .1, noise_object_density = .1, noise_object_elasticity = .1,
+                 seed = None):
 
     w = gameworld.copy()
+    # A seed (see noiseSeed) draws all of the noise from its own stream
+    if seed is None:
+        noise = _globalNoise
+    else:
+        noise = NoiseBuffer(rng=np.random.default_rng(_seedEntropy(seed)))
+    # Kept so that branching runs can rewind the collision noise too
+    w._noise = noise
 
     # Figure out the gravity (with adjustments)
     if noise_gravity > 0:
-        grav = w.gravity * truncNorm(1, noise_gravity, 0)
+        grav = w.gravity * truncNorm(1, noise_gravity, 0, buffer=noise)
     else:
         grav = w.gravity
 
@@ -145,27 +403,12 @@ def noisifyWorld(gameworld, noise_position_static = 5., noise_position_moving =
     # With static noise, group all touching objects and move them together
     if noise_position_static > 0:
         # Make object groups (things that move together because they are touching)
-        obj_groups = []
-        objs = w.objects.values()
-        for i in range(len(objs)-1):
-            o1 = objs[i]
-            if o1.name not in wall_names:
-                this_idx = -1
-                for idx, og in enumerate(obj_groups):
-                    if o1.name in [o.name for o in og]:
-                        this_idx = idx
-                if this_idx == -1:
-                    this_idx = len(obj_groups)
-                    obj_groups.append([o1])
-                for j in range(i+1, len(objs)):
-                    o2 = objs[j]
-                    if o1.checkContact(o2):
-                        if o2.name not in [o.name for o in obj_groups[this_idx]] + wall_names:
-                            obj_groups[this_idx].append(o2)
+        obj_groups = [[w.objects[onm] for onm in og]
+                      for og in _cachedContactGroups(gameworld, wall_names)]
 
         # Now that the space is segmented, move all static items together
         for og in obj_groups:
-            pos_change = noise_position_static*norm.rvs(size = 2)
+            pos_change = noise_position_static*noise.normal(2)
             for o in og:
                 if o.isStatic():
                     _move_static(o, pos_change, w._cpSpace)
@@ -174,102 +417,29 @@ def noisifyWorld(gameworld, noise_position_static = 5., noise_position_moving =
 
     # With moving noise, adjust objects individually but make sure they are still touching everything they already were
     if noise_position_moving > 0:
-        # Find the things that need to be moved and cache their original positions and touching objects
-        free_obj = []
-        orig_pos = {}
-        orig_vel = {}
-        touch_dict = {}
-        for onm, obj in w.objects.items():
-            if not obj.isStatic():
-                free_obj.append(obj)
-                orig_pos[onm] = obj.position
-                orig_vel[onm] = obj.velocity
-          
-                obj.velocity = (0,0)
-                touch_dict[onm] = []
-                for onm2, obj2 in w.objects.items():
-                    if onm != onm2:
-                        if obj.checkContact(obj2):
-                            touch_dict[onm].append(obj2)
-
-        # Catch to ensure moving static objects doesn't produce an impossible configuration
-        noise_attempts = 0
-        max_attempts = 500
-        while len(free_obj) > 0 and noise_attempts < max_attempts:
-            noise_attempts += 1
-            #print noise_attempts
-            #if noise_attempts > 500:
-            #    return noisifyWorld(gameworld, noise_position_static, noise_position_moving, noise_collision_direction,
-            #                        noise_collision_elasticity, noise_gravity, noise_object_friction,
-            #                        noise_object_density,
-            #                        noise_object_elasticity)
-
-            # Randomly perturb everything
-            for o in free_obj:
-                o.position += noise_position_moving*norm.rvs(size = 2)
-
-            # Take tiny steps to resolve overlaps
-            for i in range(10):
-                w._cpSpace.step(.1)
-
-            # Check that any contacts that existed already still remain - if not, reset
-            checked_contacts = []
-            for o in free_obj:
-                stillgood = True
-                #for o2 in touch_dict[o.name]:
-                #    if stillgood: # Potentially save computation
-                #        if not o.checkContact(o2):
-                #            stillgood = False
-                touches = touch_dict[o.name]
-                for o2 in w.objects.values():
-                    if stillgood and o.name != o2.name: # Make sure it's not the same thing; save compuatation
-                        if o.checkContact(o2):
-                            # If there's a contact, make sure that it's not a new one
-                            if o2 not in touches:
-                                stillgood = False
-                        else:
-                            # Otherwise, make sure if it's not touching it shouldn't be
-                            if o2 in touches:
-                                stillgood = False
-                if stillgood:
-                    checked_contacts.append(o.name)
-                    o._cpBody.sleep()
-                else:
-                    o.position = orig_pos[o.name]
-
-            # Now reduce free_obj
-            
-            #things are getting messed up when we reduce free_obj in the w._cpSpace.step() phase to not include all objects. I'm not sure why,
-            #but the obvious fix for this for now is to just free up every object whenever we don't "make it" through to having no free objects
-            curr_free_obj = [o for o in free_obj if o.name not in checked_contacts] 
-            if len(curr_free_obj) > 0:
-                for o in free_obj:
-                    o._cpBody.activate() #wake things again if this isn't going to work
-            else:
-                free_obj = []
-
-        # Wake things back up
-        for onm, v in orig_vel.items():
-            o = w.objects[onm]
-            o._cpBody.activate()
-            o.velocity = v
-
-        #so as to prevent impossible configurations - just go back to original position
-        if noise_attempts >= max_attempts:
-            for onm, v in orig_vel.items():
-                o = w.objects[onm]
-                o.velocity = v
-                o.position = orig_pos[onm]
-
-    # Set the callbacks to add noise
+        free_names = [onm for onm, obj in w.objects.items() if not obj.isStatic()]
+        w.noiseAttempts = _noisifyMovingObjects(w, free_names, noise_position_moving, noise)
+    else:
+        w.noiseAttempts = 0
+
+    # Reset the world
+    w.gravity = grav
+
+    # Solid-solid separations go through the goal callbacks in noisy worlds
+    def doSolidSolidEnd(arb, space, data):
+        return w._solidGoalEnd(arb, space, data)
+    w._hooks['ssEnd'] = doSolidSolidEnd
+    w._forcedHooks.add('ssEnd')
+
+    # Set the callbacks to add noise (see PGWorld._syncHandlers)
     if noise_collision_direction > 0 or noise_collision_elasticity > 0:
         def noisifyArbiter(arb):
             # Make the restitution noisy
             if noise_collision_elasticity > 0:
-                arb.restitution += truncNorm(0, noise_collision_elasticity, -arb.restitution)
+                arb.restitution += truncNorm(0, noise_collision_elasticity, -arb.restitution, buffer=noise)
             # Make the contact normals noisy
             if noise_collision_direction > 0:
-                newnorm = arb.contact_point_set.normal.rotated(wrappedNorm(0, noise_collision_direction))
+                newnorm = arb.contact_point_set.normal.rotated(wrappedNorm(0, noise_collision_direction, buffer=noise))
                 setpoints = []
                 for cp in arb.contact_point_set.points:
                     setpoints.append(pm.ContactPoint(list(cp.point_a), list(cp.point_b), cp.distance))
@@ -279,46 +449,9 @@ def noisifyWorld(gameworld, noise_position_static = 5., noise_position_moving =
         def doSolidSolidPre(arb, space, data):
             noisifyArbiter(arb)
             return w._solidSolidPre(arb, space, data)
-
-    else:
-        def doSolidSolidPre(arb, space, data):
-            return w._solidSolidPre(arb, space, data)
-
-
-    # Reset the world
-    w.gravity = grav
-
-    def doSolidSolidBegin(arb, space, data):
-        return w._solidSolidBegin(arb, space, data)
-
-    def doSolidSolidPost(arb, space, data):
-        return w._solidSolidPost(arb, space, data)
-    def doSolidSolidEnd(arb, space, data):
-        return w._solidGoalEnd(arb, space, data)
-    def doSolidGoalBegin(arb, space, data):
-        return w._solidGoalBegin(arb, space, data)
-    def doSolidGoalEnd(arb, space, data):
-        return w._solidGoalEnd(arb, space, data)
-
-    ssch = w._cpSpace.add_collision_handler(COLTYPE_SOLID, COLTYPE_SOLID)
-    ssch.begin = doSolidSolidBegin
-    ssch.pre_solve = doSolidSolidPre
-    ssch.post_solve = doSolidSolidPost
-    ssch.separate = doSolidSolidEnd
-
-    psch = w._cpSpace.add_collision_handler(COLTYPE_PLACED, COLTYPE_SOLID)
-    psch.begin = doSolidSolidBegin
-    psch.pre_solve = doSolidSolidPre
-    psch.post_solve = doSolidSolidPost
-    psch.separate = doSolidSolidEnd
-
-    ssench = w._cpSpace.add_collision_handler(COLTYPE_SOLID, COLTYPE_SENSOR)
-    ssench.begin = doSolidGoalBegin
-    ssench.separate = doSolidGoalEnd
-
-    psench = w._cpSpace.add_collision_handler(COLTYPE_PLACED, COLTYPE_SENSOR)
-    psench.begin = doSolidGoalBegin
-    psench.separate = doSolidGoalEnd
+        w._hooks['ssPre'] = doSolidSolidPre
+        w._forcedHooks.add('ssPre')
+    w._syncHandlers()
 
     w._cpSpace.step(.0001)
     return w
@@ -140,6 +140,7 @@ class PGPoly(PGObject):
             self._cpShape.friction = friction
             self._cpShape.collision_type = COLTYPE_SOLID
             self._cpShape.name = name
+            self._cpShape.pgobject = self
             space.add(self._cpShape)
         else:
             recenterPoly(vertices)
@@ -150,6 +151,7 @@ class PGPoly(PGObject):
             self._cpShape.friction = friction
             self._cpShape.collision_type = COLTYPE_SOLID
             self._cpShape.name = name
+            self._cpShape.pgobject = self
             self._cpBody.position = loc
             space.add(self._cpBody, self._cpShape)
 
@@ -196,6 +198,7 @@ class PGBall(PGObject):
             self._cpShape.friction = friction
             self._cpShape.collision_type = COLTYPE_SOLID
             self._cpShape.name = name
+            self._cpShape.pgobject = self
             space.add(self._cpShape)
         else:
             self._cpBody = pm.Body(mass, imom)
@@ -204,6 +207,7 @@ class PGBall(PGObject):
             self._cpShape.friction = friction
             self._cpShape.collision_type = COLTYPE_SOLID
             self._cpShape.name = name
+            self._cpShape.pgobject = self
             self._cpBody.position = position
             space.add(self._cpBody, self._cpShape)
 
@@ -239,6 +243,7 @@ class PGSeg(PGObject):
             self._cpShape.friction = friction
             self._cpShape.collision_type = COLTYPE_SOLID
             self._cpShape.name = name
+            self._cpShape.pgobject = self
             space.add(self._cpShape)
         else:
             pos = pm.Vec2d((p1[0] + p2[0]) / 2., (p1[1] + p2[1]) / 2.)
@@ -251,6 +256,7 @@ class PGSeg(PGObject):
             self._cpShape.friction = friction
             self._cpShape.collision_type = COLTYPE_SOLID
             self._cpShape.name = name
+            self._cpShape.pgobject = self
             self._cpBody.position = pos
             space.add(self._cpBody, self._cpShape)
 
@@ -313,6 +319,7 @@ class PGContainer(PGObject):
             pshp.friction = friction
             pshp.collision_type = COLTYPE_SOLID
             pshp.name = name
+            pshp.pgobject = self
             self._cpPolyShapes.append(pshp)
             space.add(pshp)
 
@@ -324,6 +331,7 @@ class PGContainer(PGObject):
         self._cpSensor.sensor = True
         self._cpSensor.collision_type = COLTYPE_SENSOR
         self._cpSensor.name = name
+        self._cpSensor.pgobject = self
         space.add(self._cpSensor)
         if mass != 0:
             self._cpBody.position = loc
@@ -417,6 +425,7 @@ class PGCompound(PGObject):
                 sh.friction = friction
                 sh.collision_type = COLTYPE_SOLID
                 sh.name = name
+                sh.pgobject = self
                 space.add(sh)
                 self._cpShapes.append(sh)
                 self.polylist.append([pm.Vec2d(p) for p in vertices])
@@ -463,6 +472,7 @@ class PGCompound(PGObject):
                 sh.friction = friction
                 sh.collision_type = COLTYPE_SOLID
                 sh.name = name
+                sh.pgobject = self
                 space.add(sh)
             self._cpBody.position = loc
             space.add(self._cpBody)
@@ -528,6 +538,7 @@ class PGGoal(PGObject):
         self._cpShape.sensor = True
         self._cpShape.collision_type = COLTYPE_SENSOR
         self._cpShape.name = name
+        self._cpShape.pgobject = self
         space.add(self._cpShape)
 
     def getVertices(self):
@@ -550,6 +561,7 @@ class PGBlocker(PGObject):
         self._cpShape.sensor = True
         self._cpShape.collision_type = COLTYPE_BLOCKED
         self._cpShape.name = name
+        self._cpShape.pgobject = self
         space.add(self._cpShape)
 
     def getVertices(self):
@@ -0,0 +1,171 @@
+from __future__ import division, print_function
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+from .toolpicker_js import ToolPicker
+from .gameTypes import ToolPicker as PyToolPicker
+
+__all__ = ['ENGINES', 'parityPlacements', 'compareLevel', 'compareLevels',
+           'formatReport']
+
+# How to make a ToolPicker for each engine. The JS kernel is the reference the
+# others are compared against; 'pymunk' reloads the level for every run (as
+# gameTypes.ToolPicker & pyRunGame do), 'pymunk_inproc' reuses it through
+# snapshots (ToolPicker(backend='pymunk'))
+ENGINES = {
+    'js': lambda gd: ToolPicker(gd),
+    'pymunk': lambda gd: PyToolPicker(gd),
+    'pymunk_inproc': lambda gd: ToolPicker(gd, backend='pymunk')
+}
+
+_REFERENCE = 'js'
+
+_TRIAL_DIRS = [os.path.join(os.path.dirname(__file__), '..', 'Trials', d)
+               for d in ['Original', 'Validation']]
+
+
+'''Returns the fixed set of placements to compare engines on: nPerTool valid
+positions for each tool, sampled from its placement map with the given seed
+(so every engine and every run of the harness uses the same ones)
+'''
+def parityPlacements(toolpicker, nPerTool=3, seed=0):
+    placements = []
+    for i, tnm in enumerate(sorted(toolpicker._tools.keys())):
+        pmap = toolpicker.getPlacementMap(tnm)
+        for pos in pmap.sample(nPerTool, rng=[seed, i]):
+            placements.append((tnm, [float(pos[0]), float(pos[1])]))
+    return placements
+
+# The (steps, objects, 2) positions of the objects in names along a path dict
+def _pathArray(path, names):
+    return np.stack([np.array([[p[0], p[1]] for p in path[onm]], dtype=float)
+                     for onm in names], 1)
+
+# The largest distance between the same object at the same step of two paths,
+# over the steps both paths have
+def _divergence(path, refpath):
+    names = sorted(set(path.keys()) & set(refpath.keys()))
+    if len(names) == 0:
+        return 0.
+    a = _pathArray(path, names)
+    b = _pathArray(refpath, names)
+    n = min(len(a), len(b))
+    return float(np.sqrt(((a[:n] - b[:n]) ** 2).sum(-1)).max())
+
+# Times running every placement in a level, after a warm-up run (to leave out
+# worker start-up and loading)
+def _throughput(tp, placements, maxtime):
+    tp.runPlacement(placements[0][0], placements[0][1], maxtime)
+    start = time.perf_counter()
+    outcomes = [tp.runPlacement(tnm, pos, maxtime)[0] for tnm, pos in placements]
+    return len(placements) / (time.perf_counter() - start), outcomes
+
+
+'''Runs a fixed set of placements (see parityPlacements) in one level on each
+engine and returns a dict with, per engine:
+    agreement: the fraction of placements whose outcome matches the JS kernel
+    divergence: the mean (over placements) of the largest distance between an
+        object on that engine & in JS at the same step
+    sims_per_sec: the number of runPlacement calls per second
+along with the outcomes of each placement and the recommended engine: the
+fastest one that agrees with JS on at least minAgreement of the placements
+
+Args:
+    gamedict [dict]: the level (as loaded from a Trials json file)
+    placements [list]: (toolname, position) pairs; defaults to parityPlacements
+    engines [list]: names from ENGINES to compare
+    maxtime [float]: how long to run each placement for
+    minAgreement [float]: the agreement an engine needs to be recommended
+'''
+def compareLevel(gamedict, placements=None, engines=None, maxtime=20.,
+                 minAgreement=.95, nPerTool=3, seed=0):
+    if engines is None:
+        engines = list(ENGINES.keys())
+    assert _REFERENCE in engines, "The JS kernel is needed as the reference"
+    gamedict = json.loads(json.dumps(gamedict))
+    pickers = dict([(e, ENGINES[e](gamedict)) for e in engines])
+    if placements is None:
+        placements = parityPlacements(pickers[_REFERENCE], nPerTool, seed)
+    assert len(placements) > 0, "Need placements to compare"
+    outcomes = dict()
+    speed = dict()
+    paths = dict()
+    try:
+        for e, tp in pickers.items():
+            speed[e], outcomes[e] = _throughput(tp, placements, maxtime)
+            paths[e] = [tp.observePlacementPath(tnm, pos, maxtime)[0]
+                        for tnm, pos in placements]
+    finally:
+        # Shuts down the node workers rather than leaving one per level
+        for tp in pickers.values():
+            if hasattr(getattr(tp, '_ctx', None), 'close'):
+                tp._ctx.close()
+    res = {'placements': placements, 'outcomes': outcomes,
+           'sims_per_sec': speed, 'agreement': dict(), 'divergence': dict()}
+    for e in engines:
+        agree = [o == r for o, r in zip(outcomes[e], outcomes[_REFERENCE])]
+        res['agreement'][e] = float(np.mean(agree))
+        divs = [_divergence(p, r) for p, r in zip(paths[e], paths[_REFERENCE])
+                if p is not None and r is not None]
+        res['divergence'][e] = float(np.mean(divs)) if divs else 0.
+    trusted = [e for e in engines if res['agreement'][e] >= minAgreement]
+    res['recommended'] = max(trusted, key=lambda e: speed[e])
+    return res
+
+'''Runs compareLevel on every level json file in the given directories
+(Trials/Original & Trials/Validation by default) and returns a dict of the
+results by level name
+'''
+def compareLevels(dirs=None, verbose=False, **kwargs):
+    if dirs is None:
+        dirs = _TRIAL_DIRS
+    results = dict()
+    for d in dirs:
+        for fl in sorted(glob.glob(os.path.join(d, '*.json'))):
+            with open(fl, 'r') as jfl:
+                gamedict = json.load(jfl)
+            lvl = os.path.splitext(os.path.basename(fl))[0]
+            results[lvl] = compareLevel(gamedict, **kwargs)
+            if verbose:
+                print(formatReport({lvl: results[lvl]}, header=False))
+    return results
+
+'''Formats the results of compareLevels as a table with a row per level and
+engine
+'''
+def formatReport(results, header=True):
+    rows = []
+    if header:
+        rows.append('%-14s %-14s %9s %10s %12s %s' % (
+            'level', 'engine', 'agreement', 'divergence', 'sims/sec', ''))
+    for lvl, res in results.items():
+        for e in sorted(res['sims_per_sec'].keys()):
+            rows.append('%-14s %-14s %9.2f %10.2f %12.1f %s' % (
+                lvl, e, res['agreement'][e], res['divergence'][e],
+                res['sims_per_sec'][e], '*' if e == res['recommended'] else ''))
+    return '\n'.join(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares the JS & pymunk engines on the Trials levels')
+    parser.add_argument('dirs', nargs='*', default=None,
+                        help='directories of level json files')
+    parser.add_argument('--per-tool', type=int, default=3,
+                        help='placements to sample per tool')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--maxtime', type=float, default=20.)
+    parser.add_argument('--min-agreement', type=float, default=.95)
+    parser.add_argument('--out', help='json file to write the results to')
+    args = parser.parse_args()
+    print(formatReport({}, header=True))
+    results = compareLevels(args.dirs or None, verbose=True,
+                            nPerTool=args.per_tool, seed=args.seed,
+                            maxtime=args.maxtime,
+                            minAgreement=args.min_agreement)
+    if args.out:
+        with open(args.out, 'w') as ofl:
+            json.dump(results, ofl, indent=1)
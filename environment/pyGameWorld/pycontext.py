@@ -0,0 +1,288 @@
+from __future__ import division
+from collections import OrderedDict
+import copy
+import numpy as np
+from .world import loadFromDict
+from .helpers import word2Color
+from .noisyWorld import noisifyWorld, NoiseBuffer
+from .jsrun import _RestCheck
+
+__all__ = ['PyContext']
+
+_NOISE_KEYS = ['noise_position_static', 'noise_position_moving',
+               'noise_collision_direction', 'noise_collision_elasticity',
+               'noise_gravity', 'noise_object_friction',
+               'noise_object_density', 'noise_object_elasticity']
+
+# What each JS run function records along the way
+_RECORDS = {
+    'runGW': None,
+    'getGWPath': 'path',
+    'getGWPathAndRot': 'pathrot',
+    'getGWStatePath': 'state',
+    'getGWStateArray': 'array',
+    'getGWCollisionPath': 'path',
+    'getGWCollisionPathAndRot': 'pathrot'
+}
+
+
+# The [x, y, rotation, vel_x, vel_y] state of an object (static objects that
+# are tracked stay put)
+def _objectState(o):
+    if o.isStatic():
+        p = o.getPos()
+        return (p[0], p[1], 0., 0., 0.)
+    p = o.position
+    v = o.velocity
+    return (p[0], p[1], o.rotation, v[0], v[1])
+
+
+'''Runs the JS simulation functions of the ToolPicker & JSRunner contexts in
+process with pymunk, through the same call(fname, *args) interface, so that
+ToolPicker(backend='pymunk') needs neither Node nor any serialization.
+
+Worlds are loaded once per world dict and then reused through snapshots:
+every run restores the level, adds the tool with addPlacedCompound and steps
+it in place. Noisy runs are not in place: noise also moves static objects and
+changes gravity, which snapshots do not cover, so they noisify a copy of the
+world with noisifyWorld (a toDict/loadFromDict round trip, about a quarter of
+the set-up time of a noisy run). The
+results have the same layout as the JS ones, but come from a different build
+of chipmunk, so they are close to but not exactly the same as Node's.
+
+Args:
+    worlddict [dict]: the level world, for the collision checks of the
+        collision contexts (optional)
+    maxWorlds [int]: how many loaded worlds to keep around
+'''
+class PyContext(object):
+
+    def __init__(self, worlddict=None, maxWorlds=4):
+        self._worlds = OrderedDict()
+        self.maxWorlds = maxWorlds
+        self._checkWorld = None if worlddict is None else loadFromDict(worlddict)
+
+    # Returns the loaded world for worlddict, put back into its starting state
+    # (recording collision events or not). Worlds are cached by the identity of
+    # their dicts (which are kept alive alongside them), since the ToolPicker
+    # passes the same dicts every time
+    def _loadWorld(self, worlddict, record):
+        key = id(worlddict)
+        if key in self._worlds:
+            _, world, snap = self._worlds[key]
+            self._worlds.move_to_end(key)
+            # Set before restoring, so the rebuilt space only gets the
+            # collision hooks this run needs
+            world.recordCollisions = record
+            world.restore(snap)
+            return world
+        world = loadFromDict(worlddict)
+        snap = world.snapshot()
+        # Restoring the first time too makes every run start the same way
+        world.recordCollisions = record
+        world.restore(snap)
+        self._worlds[key] = (worlddict, world, snap)
+        while len(self._worlds) > self.maxWorlds:
+            self._worlds.popitem(last=False)
+        return world
+
+    # The level with the tool placed and noise added, for running fnc
+    def _setup(self, fnc, worlddict, toolverts, pos, noiseDict):
+        # Only the collision paths need the events, so the rest skip them
+        record = fnc.startswith('getGWCollision')
+        world = self._loadWorld(worlddict, record)
+        if toolverts is not None:
+            polys = [[[v[0] + pos[0], v[1] + pos[1]] for v in verts]
+                     for verts in toolverts]
+            world.addPlacedCompound('PLACED', polys, word2Color('blue'), 1)
+        if noiseDict and any([noiseDict.get(k, 0) for k in _NOISE_KEYS]):
+            noise = dict([(k, noiseDict.get(k, 0)) for k in _NOISE_KEYS])
+            world = noisifyWorld(world, seed=noiseDict.get('seed'), **noise)
+            world.recordCollisions = record
+        return world
+
+    def _run(self, fnc, world, maxtime, stepSize, returnNewWorld, restDict,
+             recordDict):
+        kind = _RECORDS[fnc]
+        if returnNewWorld:
+            returnWorld = world.toDict()
+        recordDict = recordDict or {}
+        track = recordDict.get('track')
+        every = max(recordDict.get('every') or 1, 1)
+        names = [onm for onm, o in world.objects.items()
+                 if (onm in track if track else not o.isStatic())]
+        tracked = [world.objects[onm] for onm in names]
+        frames = []
+        def record():
+            if kind is not None:
+                frames.append([_objectState(o) for o in tracked])
+        rest = _RestCheck(restDict)
+        running = True
+        t = 0
+        nsteps = 0
+        record()
+        while running:
+            world.step(stepSize)
+            t += stepSize
+            if world.checkEnd() or (t >= maxtime) or rest(world, stepSize):
+                running = False
+            nsteps += 1
+            if nsteps % every == 0 or not running:
+                record()
+        ret = [world.checkEnd(), t]
+        if kind is not None:
+            ret = [self._formatPath(kind, names, frames)] + ret
+        if fnc.startswith('getGWCollision'):
+            ret.insert(1, list(world.collisionEvents))
+        if returnNewWorld:
+            ret.append(returnWorld)
+        return list(rest.finish(world, tuple(ret)))
+
+    # Lays out the recorded states like the JS functions do
+    def _formatPath(self, kind, names, frames):
+        states = np.array(frames, dtype=float).reshape(len(frames), len(names), 5)
+        if kind == 'array':
+            return {'names': names, 'frames': len(frames),
+                    'data': states.astype(np.float32).ravel()}
+        path = dict()
+        for i, onm in enumerate(names):
+            if kind == 'path':
+                path[onm] = states[:, i, :2].tolist()
+            elif kind == 'pathrot':
+                path[onm] = [states[:, i, :2].tolist(), states[:, i, 2].tolist()]
+            else:
+                path[onm] = states[:, i].tolist()
+        return path
+
+    def _runWorld(self, fnc, worldDict, maxtime, stepSize, noiseDict={},
+                  returnNewWorld=False, restDict=None, recordDict=None):
+        world = self._setup(fnc, worldDict, None, None, noiseDict)
+        return self._run(fnc, world, maxtime, stepSize, returnNewWorld,
+                         restDict, recordDict)
+
+    def _runPlacement(self, fnc, worldDict, toolverts, pos, maxtime, stepSize,
+                      noiseDict={}, returnNewWorld=False, restDict=None,
+                      recordDict=None):
+        world = self._setup(fnc, worldDict, toolverts, pos, noiseDict)
+        return self._run(fnc, world, maxtime, stepSize, returnNewWorld,
+                         restDict, recordDict)
+
+    # Same as placementBatch in JS: placements are [toolname, position] or
+    # [toolname, position, noise seed]
+    def _runBatch(self, fnc, worldDict, tools, placements, maxtime, stepSize,
+                  noiseDict={}, returnNewWorld=False, restDict=None,
+                  recordDict=None):
+        results = []
+        for p in placements:
+            nd = noiseDict
+            if len(p) > 2 and noiseDict:
+                nd = dict(noiseDict)
+                nd['seed'] = p[2]
+            results.append(self._runPlacement(fnc, worldDict, tools[p[0]], p[1],
+                                              maxtime, stepSize, nd,
+                                              returnNewWorld, restDict,
+                                              recordDict))
+        return results
+
+    # Same as getGWPathBumpBranches in JS: runs up to bumpTime once, then
+    # branches off one continuation per [object name, impulse, world location
+    # or None for its center] bump from a snapshot (which seeded collision
+    # noise is rewound to as well)
+    def _runBumps(self, worldDict, toolverts, pos, bumpTime, bumps, maxtime,
+                  stepSize, noiseDict={}, returnNewWorld=False, restDict=None):
+        world = self._setup('getGWPath', worldDict, toolverts, pos, noiseDict)
+        if returnNewWorld:
+            returnWorld = world.toDict()
+        names = [onm for onm, o in world.objects.items() if not o.isStatic()]
+        tracked = [world.objects[onm] for onm in names]
+        def finish(frames, t, rest):
+            ret = [self._formatPath('path', names, frames), world.checkEnd(), t]
+            if returnNewWorld:
+                ret.append(returnWorld)
+            return list(rest.finish(world, tuple(ret)))
+        frames = [[_objectState(o) for o in tracked]]
+        running = True
+        t = 0
+        # The shared part: nothing to branch if the run ends before the bump
+        while running and t < bumpTime - stepSize/2.:
+            world.step(stepSize)
+            t += stepSize
+            frames.append([_objectState(o) for o in tracked])
+            if world.checkEnd() or (t >= maxtime):
+                running = False
+        if not running:
+            ret = finish(frames, t, _RestCheck(restDict))
+            return [copy.deepcopy(ret) for _ in bumps]
+        snap = world.snapshot()
+        noise = getattr(world, '_noise', None)
+        if isinstance(noise, NoiseBuffer):
+            noisesnap = copy.deepcopy(vars(noise))
+        else:
+            noisesnap = None
+        t0 = t
+        results = []
+        for onm, impulse, loc in bumps:
+            # Every branch starts from a restored space (as in
+            # pyGetCollisionsBranchForces), so none of them carries contact
+            # caches over and a single bump matches its branch
+            world.restore(snap)
+            if noisesnap is not None:
+                vars(noise).update(copy.deepcopy(noisesnap))
+            t = t0
+            obj = world.objects[onm]
+            obj.kick(impulse, obj.position if loc is None else loc, unsafe=True)
+            bframes = list(frames)
+            rest = _RestCheck(restDict)
+            running = not (world.checkEnd() or (t >= maxtime))
+            while running:
+                world.step(stepSize)
+                t += stepSize
+                bframes.append([_objectState(o) for o in tracked])
+                if world.checkEnd() or (t >= maxtime) or rest(world, stepSize):
+                    running = False
+            results.append(finish(bframes, t, rest))
+        return results
+
+    # A single bump (getGWPathBumpAndNoise[Location][Placement]), as a branch
+    # sweep with just that bump
+    def _runBump(self, fname, *args):
+        args = list(args)
+        if not fname.endswith('Placement'):
+            args[1:1] = [None, None]
+        if 'Location' in fname:
+            bump = args[4:7]
+            del args[4:7]
+        else:
+            bump = args[4:6] + [None]
+            del args[4:6]
+        args.insert(4, [bump])
+        return self._runBumps(*args)[0]
+
+    def _checkCollide(self, tool, position):
+        assert self._checkWorld is not None, "No world to check collisions in"
+        return any([self._checkWorld.checkCollision(position, verts)
+                    for verts in tool])
+
+    '''Calls the JS function fname (one of the run, path, state, collision
+    path, batch, bump or collision check functions) in process
+    '''
+    def call(self, fname, *args):
+        if fname == 'getGWPathBumpBranches':
+            return self._runBumps(args[0], None, None, *args[1:])
+        if fname == 'getGWPathBumpBranchesPlacement':
+            return self._runBumps(*args)
+        if fname in ['getGWPathBumpAndNoise', 'getGWPathBumpAndNoiseLocation',
+                     'getGWPathBumpAndNoisePlacement',
+                     'getGWPathBumpAndNoiseLocationPlacement']:
+            return self._runBump(fname, *args)
+        if fname in _RECORDS:
+            return self._runWorld(fname, *args)
+        if fname.endswith('PlacementBatch') and fname[:-14] in _RECORDS:
+            return self._runBatch(fname[:-14], *args)
+        if fname.endswith('Placement') and fname[:-9] in _RECORDS:
+            return self._runPlacement(fname[:-9], *args)
+        if fname == 'checkMultiPlaceCollide':
+            return self._checkCollide(*args)
+        if fname == 'checkMultiPlaceCollideBatch':
+            return [self._checkCollide(args[0], p) for p in args[1]]
+        raise ValueError(fname + " is not available in the pymunk backend")
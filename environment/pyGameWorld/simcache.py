@@ -0,0 +1,132 @@
+from __future__ import division
+from collections import OrderedDict
+import pickle
+import sqlite3
+import threading
+from .helpers import dictDigest
+
+__all__ = ['SimulationCache']
+
+# Bumped whenever the layout of cached results changes, so old entries on disk
+# are never read back
+_CACHE_VERSION = 1
+
+
+'''A cache of simulation results keyed by everything that goes into a run, so
+repeated placements (e.g., across search restarts or model runs on the same
+level) are only simulated once. Pass it to a ToolPicker as cache=...
+
+Keys are hashes of the world dict, tool vertices, position (rounded to
+resolution), noise dict & seed, maxtime and timesteps, so editing a level (or
+anything else about a run) gives new keys rather than stale results. Only
+runs that are deterministic are cached: those without noise, or with a seed.
+
+Results live in an in-memory LRU tier of up to maxsize entries and, if path is
+given, in an sqlite database there that persists across processes. Cached
+results are stored pickled, so callers always get their own copy back.
+
+Args:
+    path [str]: the sqlite file for the on-disk tier (None for memory only)
+    maxsize [int]: the number of results kept in memory
+    resolution [float]: positions closer than this share a result (the one
+        simulated first); the default only merges float rounding differences
+'''
+class SimulationCache(object):
+
+    def __init__(self, path=None, maxsize=10000, resolution=1e-6):
+        assert maxsize > 0, "The memory tier needs room for some results"
+        assert resolution > 0, "Resolution must be positive"
+        self.maxsize = maxsize
+        self.resolution = resolution
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=60,
+                                       check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                             '(key TEXT PRIMARY KEY, value BLOB)')
+            self._db.commit()
+
+    '''Returns the key for running fnc on a placement; extra holds anything
+    else the result depends on (return options, rest checks, ...)
+    '''
+    def placementKey(self, fnc, worldDigest, toolverts, position, ndict,
+                     maxtime, bts, *extra):
+        qpos = [int(round(p / self.resolution)) for p in position]
+        return dictDigest([_CACHE_VERSION, fnc, worldDigest, toolverts, qpos,
+                           ndict, maxtime, bts, list(extra)])
+
+    def _remember(self, key, blob):
+        self._mem[key] = blob
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
+
+    '''Returns (True, result) for a cached key or (False, None) otherwise
+    '''
+    def get(self, key):
+        with self._lock:
+            blob = self._mem.get(key)
+            if blob is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+            elif self._db is not None:
+                row = self._db.execute('SELECT value FROM results WHERE key = ?',
+                                       (key,)).fetchone()
+                if row is not None:
+                    blob = bytes(row[0])
+                    self._remember(key, blob)
+                    self.diskHits += 1
+            if blob is None:
+                self.misses += 1
+                return False, None
+        return True, pickle.loads(blob)
+
+    def put(self, key, result):
+        blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, blob)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?)',
+                                 (key, sqlite3.Binary(blob)))
+                self._db.commit()
+
+    '''Returns the hit (memory and disk) and miss counts
+    '''
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.diskHits,
+                    'misses': self.misses, 'memory_size': len(self._mem)}
+
+    '''Empties both tiers (and resets the counters)
+    '''
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self.hits = self.diskHits = self.misses = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+
+    def __len__(self):
+        if self._db is not None:
+            with self._lock:
+                return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return len(self._mem)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -4,14 +4,80 @@ import json
 import os
 import pdb
 from .js_contexts import modulepath, base_context, collision_context, context
-from .helpers import filterCollisionEvents, stripGoal, updateObjects, NpEncoder
+from .helpers import filterCollisionEvents, stripGoal, updateObjects, NpEncoder, dictDigest, wilsonInterval
+from .constants import DEFAULT_REST_DICT
 from .world import loadFromDict
-from .viewer import *
-import pygame as pg
+from .jsrun import pySettleGame
+from .noisyWorld import noiseSeed
+from .jsworker import JSWorker, _unpackArrays
+from .simcache import SimulationCache
 import numpy as np
 import warnings
-
-__all__ = ['ToolPicker', 'loadToolPicker', 'JSRunner']
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['ToolPicker', 'loadToolPicker', 'JSRunner', 'ToolPickerPool',
+           'getSettledWorld']
+
+# execjs contexts can only return JSON, so calls go through callPacked, which
+# sends any typed arrays in the result back as base64
+class _PackedContext(object):
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    def call(self, fname, *args):
+        return _unpackArrays(self._ctx.call('callPacked', fname, list(args)))
+
+# Compiles a JS context either into a persistent node worker (default) or
+# through execjs, which starts a fresh node process for every call
+def _compileContext(ctxstr, useWorker=True):
+    if useWorker:
+        return JSWorker(ctxstr)
+    return _PackedContext(execjs.compile(ctxstr))
+
+# The JS recordDict for recording only the objects named in track (all of the
+# dynamic objects if None; the placed tool is 'PLACED') at every k-th step of a
+# path, or None to record everything
+def _recordDict(track=None, every=1):
+    assert every >= 1 and int(every) == every, "Can only record every k >= 1 steps"
+    if track is None and every == 1:
+        return None
+    return {'track': None if track is None else list(track), 'every': int(every)}
+
+# The rest check settings to send to JS: restDict with anything it leaves out
+# filled in from DEFAULT_REST_DICT, or None to never stop at rest
+def _restDict(restDict):
+    if not restDict:
+        return None
+    rd = dict(DEFAULT_REST_DICT)
+    rd.update(restDict)
+    return rd
+
+# Turns the path from a getGWStateArray* call into a (states, names) pair, where
+# states is a (steps, objects, 5) float32 array of [x, y, rotation, vel_x,
+# vel_y] and names gives the object for each index along the second axis
+def _stateArray(ret):
+    path = ret[0]
+    states = path['data'].reshape(path['frames'], len(path['names']), 5)
+    return [(states, path['names'])] + list(ret[1:])
+
+# Cached results depend on the JS that made them, so that is part of their keys
+_CONTEXT_DIGEST = dictDigest(context)
+
+# Whether a run with noise dict ndict always gives the same result, and so can
+# be cached: it has no noise or a fixed noise seed
+def _deterministic(ndict):
+    return 'seed' in ndict or all([v == 0 for v in ndict.values()])
+
+# Adds the JS noise seed for seed to a copy of ndict (runs without noise or
+# without a seed are left alone)
+def _seeded(ndict, seed):
+    if seed is None or not ndict:
+        return ndict
+    ndict = dict(ndict)
+    ndict['seed'] = noiseSeed(seed)
+    return ndict
 
 '''A class that encapsulates a Javascript context to run world through the JS kernel
 Note: all run_* functions take the following arguments:
@@ -22,11 +88,29 @@ Note: all run_* functions take the following arguments:
         world. Defaults to the empty dict (no noise)
     return_world_dict [bool]: should the function also return a dictionary after
         adding noise to the world? Defaults to False
+    rest_dict [dict]: if given, stops the run early once every dynamic object
+        has stayed slower than rest_dict['vel_threshold'] (and
+        rest_dict['ang_threshold']) for rest_dict['window'] seconds (see
+        DEFAULT_REST_DICT). The returned list then ends with why the run
+        stopped: 'goal', 'rest' or 'timeout'. Defaults to None (run to maxtime)
+    seed [int or list]: if given, the noise is drawn from a stream seeded with
+        this (see noisyWorld.noiseSeed), so the same seed always gives the same
+        noisy run. Use (seed, i) for the i-th of a set of samples
+The path functions also take as_array: if True, the path dict is replaced by a
+(states, names) pair, where states is a single (steps, objects, 5) float32
+array of [pos_x, pos_y, rotation, vel_x, vel_y] and names[i] is the object in
+states[:, i]. These are sent from JS as raw bytes instead of JSON, so they are
+much cheaper for long runs. They also take track and record_every to record
+only the objects named in track (the placed tool is 'PLACED') at every
+record_every-th timestep. The first and last timesteps are always recorded,
+and the rest are never built or sent from JS
+The useWorker argument to the constructor keeps a single node process alive
+for all calls (see jsworker.py) instead of spawning one per call through execjs
 '''
 class JSRunner(object):
-    def __init__(self):
+    def __init__(self, useWorker=True):
         ctxstr = (base_context.format(modulepath))
-        self._ctx = execjs.compile(ctxstr)
+        self._ctx = _compileContext(ctxstr, useWorker)
 
     '''Runs the world forwards and returns a list with:
         0: A bool representing whether the goal condition was met
@@ -34,9 +118,10 @@ class JSRunner(object):
         2 (optional): A new dictionary with the noisified world
     '''
     def run_gw(self, worlddict, maxtime, timestep=0.1, noise_dict={},
-               return_world_dict=False):
+               return_world_dict=False, rest_dict=None, seed=None):
         return self._ctx.call('runGW', worlddict, maxtime, timestep,
-                              noise_dict, return_world_dict)
+                              _seeded(noise_dict, seed), return_world_dict,
+                              _restDict(rest_dict))
 
     '''Runs the world for a single step and returns the world after that step
     '''
@@ -44,6 +129,16 @@ class JSRunner(object):
         warnings.warn("Not complete -- works but mismatched to continuous run")
         return self._ctx.call('stepGW', worlddict, timestep)
 
+    '''Runs the world with nothing added until it comes to rest (as judged by
+    rest_dict, defaulting to DEFAULT_REST_DICT) and returns a list with:
+        0: A dictionary of the world at that point
+        1: A float representing the time it took
+        2: A bool representing whether it came to rest before maxtime
+    '''
+    def settle_gw(self, worlddict, maxtime=10., timestep=0.1, rest_dict=None):
+        return self._ctx.call('settleGW', worlddict, maxtime, timestep,
+                              _restDict(rest_dict or DEFAULT_REST_DICT))
+
 
     '''Runs the world forwards and returns a list with:
         0: A dict with each moveable object, including a list of its position
@@ -53,9 +148,16 @@ class JSRunner(object):
         3 (optional): A new dictionary with the noisified world
     '''
     def run_gw_path(self, worlddict, maxtime, timestep=0.1, noise_dict={},
-                    return_world_dict=False):
+                    return_world_dict=False, rest_dict=None, seed=None,
+                    as_array=False, track=None, record_every=1):
+        if as_array:
+            return self._run_state_array(worlddict, maxtime, timestep,
+                                         noise_dict, return_world_dict,
+                                         rest_dict, seed, track, record_every)
         return self._ctx.call('getGWPath', worlddict, maxtime, timestep,
-                              noise_dict, return_world_dict)
+                              _seeded(noise_dict, seed), return_world_dict,
+                              _restDict(rest_dict),
+                              _recordDict(track, record_every))
 
     '''Runs the world forwards and returns a list with:
         0: A dict with each moveable object, including two lists of its position
@@ -65,9 +167,17 @@ class JSRunner(object):
         3 (optional): A new dictionary with the noisified world
     '''
     def run_gw_path_and_rot(self, worlddict, maxtime, timestep=0.1,
-                            noise_dict={}, return_world_dict=False):
+                            noise_dict={}, return_world_dict=False, rest_dict=None,
+                            seed=None, as_array=False, track=None,
+                            record_every=1):
+        if as_array:
+            return self._run_state_array(worlddict, maxtime, timestep,
+                                         noise_dict, return_world_dict,
+                                         rest_dict, seed, track, record_every)
         return self._ctx.call('getGWPathAndRot', worlddict, maxtime, timestep,
-                              noise_dict, return_world_dict)
+                              _seeded(noise_dict, seed), return_world_dict,
+                              _restDict(rest_dict),
+                              _recordDict(track, record_every))
 
     '''Runs the world forwards and returns a list with:
         0: A dict with each moveable object, including a lists consisting of
@@ -78,9 +188,28 @@ class JSRunner(object):
         3 (optional): A new dictionary with the noisified world
     '''
     def run_gw_state_path(self, worlddict, maxtime, timestep=0.1,
-                            noise_dict={}, return_world_dict=False):
+                            noise_dict={}, return_world_dict=False, rest_dict=None,
+                            seed=None, as_array=False, track=None,
+                            record_every=1):
+        if as_array:
+            return self._run_state_array(worlddict, maxtime, timestep,
+                                         noise_dict, return_world_dict,
+                                         rest_dict, seed, track, record_every)
         return self._ctx.call('getGWStatePath', worlddict, maxtime, timestep,
-                              noise_dict, return_world_dict)
+                              _seeded(noise_dict, seed), return_world_dict,
+                              _restDict(rest_dict),
+                              _recordDict(track, record_every))
+
+    # All of the path functions give the full state array with as_array
+    def _run_state_array(self, worlddict, maxtime, timestep, noise_dict,
+                         return_world_dict, rest_dict, seed, track,
+                         record_every):
+        return _stateArray(self._ctx.call('getGWStateArray', worlddict,
+                                          maxtime, timestep,
+                                          _seeded(noise_dict, seed),
+                                          return_world_dict,
+                                          _restDict(rest_dict),
+                                          _recordDict(track, record_every)))
 
 
     '''Runs the world forwards and returns geometries of dynamic objects:
@@ -93,9 +222,12 @@ class JSRunner(object):
         3 (optional): A new dictionary with the noisified world
     '''
     def run_gw_geom_path(self, worlddict, maxtime, timestep=0.1,
-                            noise_dict={}, return_world_dict=False):
+                            noise_dict={}, return_world_dict=False, rest_dict=None,
+                            seed=None, track=None, record_every=1):
         return self._ctx.call('getGWGeomPath', worlddict, maxtime, timestep,
-                              noise_dict, return_world_dict)
+                              _seeded(noise_dict, seed), return_world_dict,
+                              _restDict(rest_dict),
+                              _recordDict(track, record_every))
 
     '''Runs the world forwards and returns a list with:
         0: A dict with each moveable object, including a list of its position
@@ -112,31 +244,44 @@ class JSRunner(object):
     '''
     def run_gw_collision_path(self, worlddict, maxtime, timestep=0.1,
                             noise_dict={}, return_world_dict=False, objAdjust=None,
-                            collision_slop=0.2001):
+                            collision_slop=0.2001, rest_dict=None, seed=None,
+                            track=None, record_every=1):
 
         fnc = 'getGWCollisionPathAndRot'
         if objAdjust:
             worlddict = updateObjects(worlddict, objAdjust)
-        if return_world_dict:
-            path, col, end, t, w = self._ctx.call('getGWCollisionPathAndRot',
-                                                  worlddict, maxtime, timestep,
-                                                  noise_dict, True)
-        else:
-            path, col, end, t = self._ctx.call(fnc,
-                                               worlddict, maxtime, timestep,
-                                               noise_dict, False)
+        r = self._ctx.call(fnc, worlddict, maxtime, timestep,
+                           _seeded(noise_dict, seed), return_world_dict,
+                           _restDict(rest_dict),
+                           _recordDict(track, record_every))
+        path, col, end, t = r[:4]
         fcol = filterCollisionEvents(col, collision_slop)
-        r = [path, fcol, end, t]
-        if return_world_dict:
-            r.append(w)
-        return r
+        # Keeps the noisy world dict and/or stop reason if those were returned
+        return [path, fcol, end, t] + r[4:]
+
+    '''Runs the world once up to bump_time, then continues it from a
+    checkpoint there once for every bump in bumps, a list of [object name,
+    impulse, world location] (a location of None bumps the object at its
+    center of mass). Returns a list with one run_gw_path-style result per bump;
+    each is identical to running the world from the start with that bump, but
+    the part before bump_time is only simulated once
+    '''
+    def run_gw_bump_branches(self, worlddict, maxtime, bump_time, bumps,
+                             timestep=0.1, noise_dict={},
+                             return_world_dict=False, rest_dict=None,
+                             seed=None):
+        return self._ctx.call('getGWPathBumpBranches', worlddict, bump_time,
+                              bumps, maxtime, timestep,
+                              _seeded(noise_dict, seed),
+                              return_world_dict, _restDict(rest_dict))
 
     def run_gw_collision_bump_path(self, worldDict, maxtime, bumpTime, bumpObj, bumpImpulse, bumpLocation=None, timeStep=0.1,
-                                    noiseDict={}, return_world_dict=False,objAdjust=None):
+                                    noiseDict={}, return_world_dict=False,objAdjust=None, seed=None):
         if objAdjust:
             worldDict = updateObjects(worldDict, objAdjust)
         if all([v == 0 for v in noiseDict.values()]):
             noiseDict = {}
+        noiseDict = _seeded(noiseDict, seed)
 
         if bumpLocation is not None:
             return self._ctx.call('getGWPathBumpAndNoiseLocation',
@@ -153,9 +298,9 @@ Args for the function:
     position: the position to place those vertices around
 '''
 class CollisionChecker(object):
-    def __init__(self, worlddict):
+    def __init__(self, worlddict, useWorker=True):
         ctxstr = (context.format(modulepath, json.dumps(worlddict, cls=NpEncoder)))
-        self._ctx = execjs.compile(ctxstr)
+        self._ctx = _compileContext(ctxstr, useWorker)
 
     def __call__(self, vertices_list, position):
         for vl in vertices_list:
@@ -164,31 +309,192 @@ class CollisionChecker(object):
         return False
 
 
+# Settled levels are cached by the level and how they were settled, so every
+# ToolPicker on the same level shares them; only the most recently used ones
+# are kept
+_settledCache = OrderedDict()
+_MAX_SETTLED = 64
+
+'''Returns the dict of the level in worlddict after it has been run with no
+tool in it until everything comes to rest (see JSRunner.settle_gw), along with
+the time that took. Levels that are still moving after maxtime are returned
+unchanged (with a time of 0). With backend='pymunk' the level is settled in
+process (see pySettleGame) rather than in Node. Results for the most recently
+used levels are cached, so each of those is only settled once per backend
+'''
+def getSettledWorld(worlddict, maxtime=10., timestep=0.1, restDict=None,
+                    useWorker=True, backend='js'):
+    assert backend in ['js', 'pymunk'], "backend must be 'js' or 'pymunk'"
+    key = dictDigest([worlddict, maxtime, timestep, restDict, backend])
+    if key in _settledCache:
+        _settledCache.move_to_end(key)
+    else:
+        if backend == 'pymunk':
+            wd, t, atRest = pySettleGame(loadFromDict(worlddict), maxtime,
+                                         timestep, restDict)
+        else:
+            runner = JSRunner(useWorker)
+            try:
+                wd, t, atRest = runner.settle_gw(worlddict, maxtime, timestep,
+                                                 restDict)
+            finally:
+                if useWorker:
+                    runner._ctx.close()
+        if atRest:
+            wd['bts'] = worlddict['bts']
+            _settledCache[key] = (wd, t)
+        else:
+            _settledCache[key] = (worlddict, 0.)
+        while len(_settledCache) > _MAX_SETTLED:
+            _settledCache.popitem(last=False)
+    wd, t = _settledCache[key]
+    return json.loads(json.dumps(wd, cls=NpEncoder)), t
+
 class ToolPicker(object):
 
-    def __init__(self, gamedict, basicTimestep=0.1, worldTimestep=0.01, maxTime=20., checkThruPy=True, tnm=None):
+    def __init__(self, gamedict, basicTimestep=0.1, worldTimestep=0.01, maxTime=20., checkThruPy=True, tnm=None,
+                 useWorker=True, restDict=None, presettle=False, cache=None,
+                 backend='js'):
+        assert backend in ['js', 'pymunk'], "backend must be 'js' or 'pymunk'"
         self._worlddict = gamedict['world']
         self._worlddict['bts'] = worldTimestep
         self._worlddict = json.loads(json.dumps(self._worlddict, cls=NpEncoder))
+        # If set, placements start from the level after it has settled with no
+        # tool in it (see getSettledWorld), so rollouts skip the jostling at
+        # the start. Levels where things are meant to move before the tool
+        # acts behave differently, so this is off by default to match the
+        # original results; times are counted from the placement
+        self.presettle = presettle
+        self.settleTime = 0.
+        if presettle:
+            self._worlddict, self.settleTime = getSettledWorld(
+                self._worlddict, useWorker=useWorker, backend=backend)
         self._wdng = stripGoal(self._worlddict)
         self.bts = basicTimestep
         self.maxTime = maxTime
         self.wts = worldTimestep
+        # If set, placements stop early once the world comes to rest and their
+        # results end with the stop reason (see JSRunner & DEFAULT_REST_DICT),
+        # which is 'collide' for placements that collide with the world
+        self.restDict = restDict
+        # If set, a SimulationCache that deterministic placement runs are
+        # looked up in before (and added to after) simulating them
+        self.cache = cache
+        self._digests = None
         if tnm is not None:
             self._tnm = tnm
         self._tools = gamedict['tools']
         self._toolNames = list(self._tools.keys())
         self.t = 0
-        ctxstr = (context.format(modulepath, json.dumps(self._worlddict, cls=NpEncoder)))
-        self._ctx = execjs.compile(ctxstr)
+        # The pymunk backend runs the same functions in process (see
+        # PyContext), without Node or any serialization
+        self.backend = backend
+        if backend == 'pymunk':
+            from .pycontext import PyContext
+            self._ctx = PyContext(self._worlddict)
+        else:
+            ctxstr = (context.format(modulepath, json.dumps(self._worlddict, cls=NpEncoder)))
+            self._ctx = _compileContext(ctxstr, useWorker)
+        # A persistent worker keeps the worlds & tools around, so calls only
+        # need to send a handle; execjs contexts need the full world each time
+        if useWorker and backend == 'js':
+            self._handles = [self._ctx.call('registerWorld', self._worlddict, self._tools),
+                             self._ctx.call('registerWorld', self._wdng, self._tools)]
+        else:
+            self._handles = None
         self._pycheck = checkThruPy
         if checkThruPy:
             self._pyworld = loadFromDict(self._worlddict)
 
+    # What a placement that collides with the world returns in place of ret:
+    # with a restDict, results end with why the run stopped, so those end in
+    # 'collide'
+    def _collided(self, *ret):
+        if self.restDict:
+            return ret + ('collide',)
+        return ret
+
     def _reset_pyworld(self):
         self._pyworld = loadFromDict(self._worlddict)
 
+    # Returns the registered world handle to run with, or None if the full
+    # world dict has to be sent instead
+    def _getHandle(self, stopOnGoal, objAdjust):
+        if self._handles is None or objAdjust:
+            return None
+        return self._handles[0 if stopOnGoal else 1]
+
+    def _getWorldDict(self, stopOnGoal, objAdjust):
+        if stopOnGoal:
+            wd = self._worlddict
+        else:
+            wd = self._wdng
+        if objAdjust:
+            wd = updateObjects(wd, objAdjust)
+        return wd
+
+    # Calls one of the *Placement JS functions on the level world
+    def _callPlacement(self, fnc, toolname, position, maxtime, ndict,
+                       returnDict, stopOnGoal, objAdjust, seed=None,
+                       recordDict=None):
+        ndict = _seeded(ndict, seed)
+        key = self._cacheKey(fnc, toolname, position, maxtime, ndict,
+                             returnDict, stopOnGoal, objAdjust, recordDict)
+        if key is not None:
+            found, ret = self.cache.get(key)
+            if found:
+                return ret
+        handle = self._getHandle(stopOnGoal, objAdjust)
+        if handle is not None:
+            ret = self._ctx.call('runPlacementHandle', fnc, handle, toolname,
+                                 position, maxtime, self.bts, ndict,
+                                 returnDict, self.restDict, recordDict)
+        else:
+            wd = self._getWorldDict(stopOnGoal, objAdjust)
+            ret = self._ctx.call(fnc, wd, self._tools[toolname], position,
+                                 maxtime, self.bts, ndict, returnDict,
+                                 self.restDict, recordDict)
+        if key is not None:
+            self.cache.put(key, ret)
+        return ret
+
+    def _worldDigest(self, stopOnGoal, objAdjust):
+        if objAdjust:
+            return dictDigest(self._getWorldDict(stopOnGoal, objAdjust))
+        if self._digests is None:
+            self._digests = [dictDigest(self._worlddict),
+                             dictDigest(self._wdng)]
+        return self._digests[0 if stopOnGoal else 1]
+
+    # The SimulationCache key for a placement run, or None if there is no
+    # cache or the run is noisy without a seed
+    def _cacheKey(self, fnc, toolname, position, maxtime, ndict, returnDict,
+                  stopOnGoal, objAdjust, recordDict):
+        if self.cache is None or not _deterministic(ndict):
+            return None
+        return self.cache.placementKey(fnc,
+                                       self._worldDigest(stopOnGoal, objAdjust),
+                                       self._tools[toolname], position, ndict,
+                                       maxtime, self.bts, returnDict,
+                                       self.restDict, recordDict,
+                                       _CONTEXT_DIGEST, self.backend)
+
+    # Runs a placement for its state path, either as the usual dict or (with
+    # asArray) as a (states, names) pair (see JSRunner)
+    def _callStatePath(self, toolname, position, ndict, returnDict, stopOnGoal,
+                       objAdjust, seed, asArray, recordDict=None):
+        if asArray:
+            return _stateArray(self._callPlacement(
+                'getGWStateArrayPlacement', toolname, position, self.maxTime,
+                ndict, returnDict, stopOnGoal, objAdjust, seed, recordDict))
+        return self._callPlacement('getGWStatePathPlacement', toolname,
+                                   position, self.maxTime, ndict, returnDict,
+                                   stopOnGoal, objAdjust, seed, recordDict)
+
+    # The viewer (and pygame) are only loaded once something is drawn
     def _get_image_array(self, worlddict, path, sample_ratio=1):
+        import pygame as pg
+        from .viewer import makeImageArray, makeImageArrayNoPath
         if path is None:
             imgs = makeImageArrayNoPath(worlddict, self.maxTime/self.bts/sample_ratio)
         else:
@@ -197,6 +503,8 @@ class ToolPicker(object):
         return imgdata
 
     def drawPathSingleImage(self, wd, path, with_tools=False):
+        import pygame as pg
+        from .viewer import drawWorld, drawPathSingleImage
         if path is None:
             world = loadFromDict(wd)
             sc = drawWorld(world, backgroundOnly=False)
@@ -208,6 +516,7 @@ class ToolPicker(object):
         return imgdata
 
     def drawTool(self, tool):
+        from .viewer import drawTool
         tool_to_draw = self._tools[self._toolNames[tool]]
         img = drawTool(tool_to_draw, color=(0,0,255), toolbox_size=(90, 90))
         return img
@@ -227,160 +536,255 @@ class ToolPicker(object):
         else:
             return self._ctx.call('checkMultiPlaceCollide', self._tools[toolname], position)
 
+    '''Vectorized checkPlacementCollide: takes an (N, 2) array of positions and
+    returns an (N,) boolean mask of the ones where the tool would collide
+    '''
+    def checkPlacementCollides(self, toolname, positions):
+        assert toolname in self._tools.keys(), "That tool does not exist!"
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        ret = (positions <= 0.0).any(1) | (positions >= 600.0).any(1)
+        inside = np.flatnonzero(~ret)
+        if len(inside) == 0:
+            return ret
+        if self._pycheck:
+            for tverts in self._tools[toolname]:
+                ret[inside] |= self._pyworld.checkCollisions(positions[inside], tverts)
+        else:
+            ret[inside] = self._ctx.call('checkMultiPlaceCollideBatch',
+                                         self._tools[toolname], positions[inside])
+        return ret
+
+    '''Returns the PlacementMap for a tool in this level (see placement.py),
+    which answers placement checks for single positions or whole arrays of them
+    with lookups, and samples valid placements uniformly. Maps are cached, so
+    each level & tool is only mapped once
+    '''
+    def getPlacementMap(self, toolname, resolution=1.):
+        from .placement import getPlacementMap
+        assert toolname in self._tools.keys(), "That tool does not exist!"
+        return getPlacementMap(self._worlddict, self._tools[toolname],
+                               resolution)
+
     def runPlacement(self, toolname, position, maxtime=20., returnDict=False,
                      stopOnGoal=True, objAdjust=None):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
-            return None, -1
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('runGWPlacement', wd, self._tools[toolname],
-                              position, maxtime, self.bts, {}, returnDict)
+            return self._collided(None, -1)
+        return self._callPlacement('runGWPlacement', toolname, position,
+                                   maxtime, {}, returnDict, stopOnGoal,
+                                   objAdjust)
 
     def observePlacementPath(self, toolname, position, maxtime=20., returnDict=False,
-                             stopOnGoal=True, objAdjust=None):
+                             stopOnGoal=True, objAdjust=None,
+                             track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
-            return None, None, -1
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWPathPlacement', wd,
-                              self._tools[toolname], position, maxtime,
-                              self.bts, {}, returnDict)
+            return self._collided(None, None, -1)
+        return self._callPlacement('getGWPathPlacement', toolname, position,
+                                   maxtime, {}, returnDict, stopOnGoal,
+                                   objAdjust,
+                                   recordDict=_recordDict(track, recordEvery))
 
     def observePath(self, maxtime=20., returnDict=False, stopOnGoal=True,
-                    objAdjust=None):
-        if stopOnGoal:
-            wd = self._worlddict
+                    objAdjust=None, asArray=False, track=None, recordEvery=1):
+        fnc = 'getGWStateArray' if asArray else 'getGWStatePath'
+        rdict = _recordDict(track, recordEvery)
+        handle = self._getHandle(stopOnGoal, objAdjust)
+        if handle is not None:
+            ret = self._ctx.call('runHandle', fnc, handle, maxtime, self.bts,
+                                 {}, returnDict, self.restDict, rdict)
         else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWStatePath', wd, maxtime, self.bts,
-                              {}, returnDict)
+            wd = self._getWorldDict(stopOnGoal, objAdjust)
+            ret = self._ctx.call(fnc, wd, maxtime, self.bts, {}, returnDict,
+                                 self.restDict, rdict)
+        return _stateArray(ret) if asArray else ret
 
     def observeFullPlacementPath(self, toolname, position, maxtime=20.,
                                  returnDict=False, stopOnGoal=True,
-                                 objAdjust=None):
+                                 objAdjust=None, track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
-            return None, None, -1, None
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWPathAndRotPlacement', wd,
-                              self._tools[toolname], position, maxtime,
-                              self.bts, {}, returnDict)
+            return self._collided(None, None, -1, None)
+        return self._callPlacement('getGWPathAndRotPlacement', toolname, position,
+                                   maxtime, {}, returnDict, stopOnGoal,
+                                   objAdjust,
+                                   recordDict=_recordDict(track, recordEvery))
 
     def observeGeomPath(self, toolname, position, maxtime=20.,
-                        returnDict=False, stopOnGoal=True, objAdjust=None):
+                        returnDict=False, stopOnGoal=True, objAdjust=None,
+                        track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
-            return None, None, -1, None
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWGeomPathPlacement', wd,
-                              self._tools[toolname], position, maxtime,
-                              self.bts, {}, returnDict)
+            return self._collided(None, None, -1, None)
+        return self._callPlacement('getGWGeomPathPlacement', toolname, position,
+                                   maxtime, {}, returnDict, stopOnGoal,
+                                   objAdjust,
+                                   recordDict=_recordDict(track, recordEvery))
 
     def observePlacementStatePath(self, toolname, position, returnDict=False,
-                                  stopOnGoal=True, objAdjust=None):
+                                  stopOnGoal=True, objAdjust=None,
+                                  asArray=False, track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
             if returnDict:
-                return None, None, -1, None
+                return self._collided(None, None, -1, None)
             else:
-                return None, None, -1
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWStatePathPlacement', wd,
-                              self._tools[toolname], position, self.maxTime,
-                              self.bts, {}, returnDict)
+                return self._collided(None, None, -1)
+        return self._callStatePath(toolname, position, {}, returnDict,
+                                   stopOnGoal, objAdjust, None, asArray,
+                                   _recordDict(track, recordEvery))
 
     def observeCollisionEvents(self, toolname, position, maxtime=20.,
                                collisionSlop=.2001, returnDict=False,
-                               stopOnGoal=True, objAdjust=None):
+                               stopOnGoal=True, objAdjust=None,
+                               track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
-            return None, None, -1, -1
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        if returnDict:
-            path, col, end, t, w = self._ctx.call('getGWCollisionPathPlacement', wd,
-                                               self._tools[toolname], position,
-                                               maxtime, self.bts, {},True)
-        else:
-            path, col, end, t = self._ctx.call('getGWCollisionPathPlacement', wd,
-                                               self._tools[toolname], position,
-                                               maxtime, self.bts, {}, False)
+            return self._collided(None, None, -1, -1)
+        r = self._callPlacement('getGWCollisionPathPlacement', toolname, position,
+                                maxtime, {}, returnDict, stopOnGoal,
+                                objAdjust,
+                                recordDict=_recordDict(track, recordEvery))
+        path, col, end, t = r[:4]
         fcol = filterCollisionEvents(col, collisionSlop)
-        r = [path, fcol, end, t]
-        if returnDict:
-            r.append(w)
-        return r
+        return [path, fcol, end, t] + r[4:]
 
     def observeFullCollisionEvents(self, toolname, position, maxtime=20.,
                                collisionSlop=.2001, returnDict=False,
-                               stopOnGoal=True, objAdjust=None):
+                               stopOnGoal=True, objAdjust=None,
+                               track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
-            return None, None, -1, -1
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        if returnDict:
-            path, col, end, t, w = self._ctx.call('getGWCollisionPathAndRotPlacement', wd,
-                                               self._tools[toolname], position,
-                                               maxtime, self.bts, {},True)
-        else:
-            path, col, end, t = self._ctx.call('getGWCollisionPathAndRotPlacement', wd,
-                                               self._tools[toolname], position,
-                                               maxtime, self.bts, {}, False)
+            return self._collided(None, None, -1, -1)
+        r = self._callPlacement('getGWCollisionPathAndRotPlacement', toolname, position,
+                                maxtime, {}, returnDict, stopOnGoal,
+                                objAdjust,
+                                recordDict=_recordDict(track, recordEvery))
+        path, col, end, t = r[:4]
         fcol = filterCollisionEvents(col, collisionSlop)
-        r = [path, fcol, end, t]
+        return [path, fcol, end, t] + r[4:]
+
+    # Calls one of the *Placement JS functions on a list of placements in one
+    # go (skipping those with cached results); placements are [toolname,
+    # position] or [toolname, position, seed]
+    def _callPlacementBatch(self, fnc, placements, maxtime, ndict, returnDict,
+                            stopOnGoal, objAdjust, recordDict=None):
+        placements = [[p[0], list(p[1])] + [noiseSeed(s) for s in p[2:]]
+                      for p in placements]
+        results = [None] * len(placements)
+        keys = [None] * len(placements)
+        torun = []
+        for i, p in enumerate(placements):
+            pdict = ndict
+            if len(p) > 2 and ndict:
+                pdict = dict(ndict)
+                pdict['seed'] = p[2]
+            keys[i] = self._cacheKey(fnc, p[0], p[1], maxtime, pdict,
+                                     returnDict, stopOnGoal, objAdjust,
+                                     recordDict)
+            found = False
+            if keys[i] is not None:
+                found, results[i] = self.cache.get(keys[i])
+            if not found:
+                torun.append(i)
+        if len(torun) > 0:
+            ran = self._batchCall(fnc, [placements[i] for i in torun], maxtime,
+                                  ndict, returnDict, stopOnGoal, objAdjust,
+                                  recordDict)
+            for i, r in zip(torun, ran):
+                results[i] = r
+                if keys[i] is not None:
+                    self.cache.put(keys[i], r)
+        return results
+
+    def _batchCall(self, fnc, placements, maxtime, ndict, returnDict,
+                   stopOnGoal, objAdjust, recordDict):
+        handle = self._getHandle(stopOnGoal, objAdjust)
+        if handle is not None:
+            return self._ctx.call('runPlacementBatchHandle', fnc, handle,
+                                  placements, maxtime, self.bts, ndict,
+                                  returnDict, self.restDict, recordDict)
+        wd = self._getWorldDict(stopOnGoal, objAdjust)
+        tools = dict([(p[0], self._tools[p[0]]) for p in placements])
+        return self._ctx.call(fnc + 'Batch', wd, tools, placements, maxtime,
+                              self.bts, ndict, returnDict, self.restDict,
+                              recordDict)
+
+    # Runs a batch of placements in a single JS call; colliding placements get
+    # collideRet without being simulated
+    def _runPlacementBatch(self, fnc, placements, maxtime, collideRet, ndict,
+                           returnDict, stopOnGoal, objAdjust, seed=None,
+                           recordDict=None):
+        for p in placements:
+            assert p[0] in self._tools.keys(), "That tool does not exist!"
+        results = [None] * len(placements)
+        torun = []
+        for i, p in enumerate(placements):
+            if self.checkPlacementCollide(p[0], p[1]):
+                results[i] = self._collided(*collideRet)
+            else:
+                torun.append(i)
+        if len(torun) == 0:
+            return results
+        if all([v == 0 for v in ndict.values()]):
+            ndict = {}
+        ndict = _seeded(ndict, seed)
+        ran = self._callPlacementBatch(fnc, [placements[i] for i in torun],
+                                       maxtime, ndict, returnDict, stopOnGoal,
+                                       objAdjust, recordDict)
+        for i, r in zip(torun, ran):
+            results[i] = r
+        return results
+
+    '''Batched versions of runPlacement, observePlacementPath and
+    observePlacementStatePath: take a list of (toolname, position) pairs and
+    return a list with the result of each placement in order, but run them all
+    in one JS call. Also take an optional noise dict (ndict) and seed; with a
+    seed, every placement starts from the same noise stream. A placement can
+    also be (toolname, position, seed) to give it its own noise seed
+    '''
+    def runPlacementBatch(self, placements, maxtime=20., ndict={},
+                          returnDict=False, stopOnGoal=True, objAdjust=None,
+                          seed=None):
+        return self._runPlacementBatch('runGWPlacement', placements,
+                                       maxtime, (None, -1), ndict,
+                                       returnDict, stopOnGoal, objAdjust, seed)
+
+    def observePlacementPathBatch(self, placements, maxtime=20., ndict={},
+                                  returnDict=False, stopOnGoal=True,
+                                  objAdjust=None, seed=None, track=None,
+                                  recordEvery=1):
+        return self._runPlacementBatch('getGWPathPlacement', placements,
+                                       maxtime, (None, None, -1), ndict,
+                                       returnDict, stopOnGoal, objAdjust, seed,
+                                       _recordDict(track, recordEvery))
+
+    def observePlacementStatePathBatch(self, placements, ndict={},
+                                       returnDict=False, stopOnGoal=True,
+                                       objAdjust=None, seed=None, track=None,
+                                       recordEvery=1):
         if returnDict:
-            r.append(w)
-        return r
+            cret = (None, None, -1, None)
+        else:
+            cret = (None, None, -1)
+        return self._runPlacementBatch('getGWStatePathPlacement',
+                                       placements, self.maxTime, cret, ndict,
+                                       returnDict, stopOnGoal, objAdjust, seed,
+                                       _recordDict(track, recordEvery))
 
     def placeObject(self, toolname, position):
         raise NotImplementedError(
@@ -396,7 +800,8 @@ class ToolPicker(object):
                           noise_position_static=0, noise_position_moving=0,
                           noise_collision_direction=0, noise_collision_elasticity=0, noise_gravity=0,
                           noise_object_friction=0, noise_object_density=0, noise_object_elasticity=0,
-                          returnDict=False, stopOnGoal=True, objAdjust=None):
+                          returnDict=False, stopOnGoal=True, objAdjust=None,
+                          seed=None):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         #if noise_object_friction > 0 or noise_object_density > 0 or noise_object_elasticity > 0:
@@ -411,41 +816,32 @@ class ToolPicker(object):
             'noise_object_density': noise_object_density,
             'noise_object_elasticity': noise_object_elasticity
         }
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('runGWPlacement', wd, self._tools[toolname],
-                              position, maxtime, self.bts, ndict, returnDict)
+        return self._callPlacement('runGWPlacement', toolname, position,
+                                   maxtime, ndict, returnDict, stopOnGoal,
+                                   objAdjust, seed)
 
     def observeNoisyPlacementStatePath(self, toolname, position, ndict={},
                                        returnDict=False, stopOnGoal=True,
-                                       objAdjust=None):
+                                       objAdjust=None, seed=None,
+                                       asArray=False, track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         # Make sure the tool can be placed
         if self.checkPlacementCollide(toolname, position):
             if returnDict:
-                return None, None, -1, None
+                return self._collided(None, None, -1, None)
             else:
-                return None, None, -1
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWStatePathPlacement', wd,
-                              self._tools[toolname], position, self.maxTime,
-                              self.bts, ndict, returnDict)
+                return self._collided(None, None, -1)
+        return self._callStatePath(toolname, position, ndict, returnDict,
+                                   stopOnGoal, objAdjust, seed, asArray,
+                                   _recordDict(track, recordEvery))
 
     def runNoisyPath(self, toolname, position, maxtime=20.,
                      noise_position_static=0, noise_position_moving=0,
                      noise_collision_direction=0, noise_collision_elasticity=0, noise_gravity=0,
                      noise_object_friction=0, noise_object_density=0, noise_object_elasticity=0,
-                     returnDict=False, stopOnGoal=True, objAdjust=None):
+                     returnDict=False, stopOnGoal=True, objAdjust=None,
+                     seed=None, track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         #if noise_object_friction > 0 or noise_object_density > 0 or noise_object_elasticity > 0:
@@ -460,20 +856,17 @@ class ToolPicker(object):
             'noise_object_density': noise_object_density,
             'noise_object_elasticity': noise_object_elasticity
         }
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWPathPlacement', wd, self._tools[toolname],
-                              position, maxtime, self.bts, ndict, returnDict)
+        return self._callPlacement('getGWPathPlacement', toolname, position,
+                                   maxtime, ndict, returnDict, stopOnGoal,
+                                   objAdjust, seed,
+                                   recordDict=_recordDict(track, recordEvery))
 
     def runFullNoisyPath(self, toolname, position, maxtime=20.,
                      noise_position_static=0, noise_position_moving=0,
                      noise_collision_direction=0, noise_collision_elasticity=0, noise_gravity=0,
                      noise_object_friction=0, noise_object_density=0, noise_object_elasticity=0,
-                     returnDict=False, stopOnGoal=True, objAdjust=None):
+                     returnDict=False, stopOnGoal=True, objAdjust=None,
+                     seed=None, track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         #if noise_object_friction > 0 or noise_object_density > 0 or noise_object_elasticity > 0:
@@ -490,20 +883,17 @@ class ToolPicker(object):
         }
         if all([v == 0 for v in ndict.values()]):
             ndict = {}
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWPathAndRotPlacement', wd, self._tools[toolname],
-                              position, maxtime, self.bts, ndict, returnDict)
+        return self._callPlacement('getGWPathAndRotPlacement', toolname, position,
+                                   maxtime, ndict, returnDict, stopOnGoal,
+                                   objAdjust, seed,
+                                   recordDict=_recordDict(track, recordEvery))
 
     def runNoisyGeomPath(self, toolname, position, maxtime=20.,
                      noise_position_static=0, noise_position_moving=0,
                      noise_collision_direction=0, noise_collision_elasticity=0, noise_gravity=0,
                      noise_object_friction=0, noise_object_density=0, noise_object_elasticity=0,
-                     returnDict=False, stopOnGoal=True, objAdjust=None):
+                     returnDict=False, stopOnGoal=True, objAdjust=None,
+                     seed=None, track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         #if noise_object_friction > 0 or noise_object_density > 0 or noise_object_elasticity > 0:
@@ -520,29 +910,101 @@ class ToolPicker(object):
         }
         if all([v == 0 for v in ndict.values()]):
             ndict = {}
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWGeomPathPlacement', wd, self._tools[toolname],
-                              position, maxtime, self.bts, ndict, returnDict)
+        return self._callPlacement('getGWGeomPathPlacement', toolname, position,
+                                   maxtime, ndict, returnDict, stopOnGoal,
+                                   objAdjust, seed,
+                                   recordDict=_recordDict(track, recordEvery))
 
     def runFullNoisyPathDict(self, toolname, position, maxtime=20.,ndict={},
-                     returnDict=False, stopOnGoal=True, objAdjust=None):
+                     returnDict=False, stopOnGoal=True, objAdjust=None,
+                     seed=None, track=None, recordEvery=1):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         if ndict != {}:
             warnings.warn("Noise on objects not yet implemented -- will have no effect")
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
-        return self._ctx.call('getGWPathAndRotPlacement', wd, self._tools[toolname],
-                              position, maxtime, self.bts, ndict, returnDict)
+        return self._callPlacement('getGWPathAndRotPlacement', toolname, position,
+                                   maxtime, ndict, returnDict, stopOnGoal,
+                                   objAdjust, seed,
+                                   recordDict=_recordDict(track, recordEvery))
+
+    '''Estimates the probability that placing toolname at position succeeds
+    under the noise in ndict, running noisy samples batchSize at a time (in one
+    JS call, or spread over the workers of a ToolPickerPool if one is given).
+    Sampling stops once the Wilson interval at the given confidence is no wider
+    than ciWidth, or after maxSamples. That interval shrinks fastest when the
+    samples all agree, so placements that clearly always (or never) work stop
+    after a few dozen samples rather than hundreds. With a seed, sample i
+    draws its noise from the (seed, i) stream.
+    Returns (probability, (lower, upper), number of samples), or
+    (None, None, 0) if the tool cannot be placed there
+    '''
+    def estimateSuccessProbability(self, toolname, position, ndict,
+                                   maxSamples=500, ciWidth=.1, batchSize=20,
+                                   confidence=.95, maxtime=20., stopOnGoal=True,
+                                   objAdjust=None, seed=None, pool=None):
+        assert toolname in self._tools.keys(), "That tool does not exist!"
+        assert maxSamples > 0 and batchSize > 0, "Need a positive number of samples"
+        assert pool is None or objAdjust is None, "Pools cannot adjust objects"
+        if self.checkPlacementCollide(toolname, position):
+            return None, None, 0
+        position = list(position)
+        if all([v == 0 for v in ndict.values()]):
+            # Without noise every sample would be the same
+            r = self._callPlacement('runGWPlacement', toolname, position,
+                                    maxtime, {}, False, stopOnGoal, objAdjust)
+            p = float(r[0])
+            return p, (p, p), 1
+        nsucc = 0
+        n = 0
+        while n < maxSamples:
+            idx = range(n, min(n + batchSize, maxSamples))
+            seeds = [None if seed is None else (seed, i) for i in idx]
+            if pool is not None:
+                futures = [pool.submit(toolname, position, ndict, maxtime,
+                                       'run', stopOnGoal, seed=s)
+                           for s in seeds]
+                ran = [f.result() for f in futures]
+            else:
+                pl = [[toolname, position] + ([] if s is None else [s])
+                      for s in seeds]
+                ran = self._callPlacementBatch('runGWPlacement', pl, maxtime,
+                                               ndict, False, stopOnGoal,
+                                               objAdjust)
+            nsucc += sum([bool(r[0]) for r in ran])
+            n += len(ran)
+            lower, upper = wilsonInterval(nsucc, n, confidence)
+            if upper - lower <= ciWidth:
+                break
+        return nsucc / n, (lower, upper), n
+
+    '''Places the tool and evaluates a sweep of bumps at bumptime (see
+    JSRunner.run_gw_bump_branches): bumps is a list of [object name, impulse,
+    world location or None]. Returns a list with one [path, success, time] per
+    bump, plus the stop reason if restDict is set (every bump gets the usual
+    collision result if the tool cannot be placed there)
+    '''
+    def runBumpBranches(self, toolname, position, bumptime, bumps, maxtime=20.,
+                        ndict={}, returnDict=False, stopOnGoal=True,
+                        objAdjust=None, seed=None):
+        assert toolname in self._tools.keys(), "That tool does not exist!"
+        # Make sure the tool can be placed
+        if self.checkPlacementCollide(toolname, position):
+            if returnDict:
+                return [self._collided(None, None, -1, None) for _ in bumps]
+            return [self._collided(None, None, -1) for _ in bumps]
+        if all([v == 0 for v in ndict.values()]):
+            ndict = {}
+        ndict = _seeded(ndict, seed)
+        handle = self._getHandle(stopOnGoal, objAdjust)
+        if handle is not None:
+            return self._ctx.call('runBumpBranchesHandle', handle, toolname,
+                                  position, bumptime, bumps, maxtime, self.bts,
+                                  ndict, returnDict, self.restDict)
+        wd = self._getWorldDict(stopOnGoal, objAdjust)
+        return self._ctx.call('getGWPathBumpBranchesPlacement', wd,
+                              self._tools[toolname], position, bumptime, bumps,
+                              maxtime, self.bts, ndict, returnDict,
+                              self.restDict)
 
     def runNoisyBumpPath(self, toolname, position, bumptime, bumpname, bumpimpulse, bumpLocation=None,
                          maxtime=20., noise_position_static=0,
@@ -550,7 +1012,7 @@ class ToolPicker(object):
                          noise_collision_elasticity=0, noise_gravity=0,
                          noise_object_friction=0, noise_object_density=0,
                          noise_object_elasticity=0, returnDict=False,
-                         stopOnGoal=True, objAdjust=None):
+                         stopOnGoal=True, objAdjust=None, seed=None):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         #if noise_object_friction > 0 or noise_object_density > 0 or noise_object_elasticity > 0:
@@ -568,6 +1030,7 @@ class ToolPicker(object):
         # Skip noisification if no noisy parameters added
         if all([v == 0 for v in ndict.values()]):
             ndict = {}
+        ndict = _seeded(ndict, seed)
 
         if stopOnGoal:
             wd = self._worlddict
@@ -589,7 +1052,7 @@ class ToolPicker(object):
 
     def runNoisyBumpPathDict(self, toolname, position, bumptime, bumpname, bumpimpulse, bumpLocation=None,
                          maxtime=20., ndict={}, returnDict=False,
-                         stopOnGoal=True, objAdjust=None):
+                         stopOnGoal=True, objAdjust=None, seed=None):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         if ndict != {}:
@@ -603,6 +1066,7 @@ class ToolPicker(object):
         else:
             ndict['noise_position_static'] = 0
             ndict['noise_position_moving'] = 0
+        ndict = _seeded(ndict, seed)
 
         if stopOnGoal:
             wd = self._worlddict
@@ -665,7 +1129,8 @@ class ToolPicker(object):
                                         noise_object_friction=0, noise_object_density=0,
                                         noise_object_elasticity=0,
                                         collisionSlop=.2001, returnDict=False,
-                                        stopOnGoal=True, objAdjust=None):
+                                        stopOnGoal=True, objAdjust=None,
+                                        seed=None):
         assert toolname in self._tools.keys(), "That tool does not exist!"
         tool = self._tools[toolname]
         ndict = {
@@ -681,20 +1146,12 @@ class ToolPicker(object):
         # Skip noisification if no noisy parameters added
         if all([v == 0 for v in ndict.values()]):
             ndict = {}
-        if stopOnGoal:
-            wd = self._worlddict
-        else:
-            wd = self._wdng
-        if objAdjust:
-            wd = updateObjects(wd, objAdjust)
+        r = self._callPlacement('getGWCollisionPathAndRotPlacement', toolname, position,
+                                maxtime, ndict, returnDict, stopOnGoal,
+                                objAdjust, seed)
+        path, col, end, t = r[:4]
         if returnDict:
-            path, col, end, t, w = self._ctx.call('getGWCollisionPathAndRotPlacement', wd,
-                                               self._tools[toolname], position,
-                                               maxtime, self.bts, ndict,True)
-        else:
-            path, col, end, t = self._ctx.call('getGWCollisionPathAndRotPlacement', wd,
-                                               self._tools[toolname], position,
-                                               maxtime, self.bts, ndict, False)
+            w = r[4]
         #fcol = filterCollisionEvents(col, collisionSlop)
         r = [path, end, t]
         if returnDict:
@@ -736,10 +1193,121 @@ class ToolPicker(object):
                     maxy = v[1]
         return [[minx, miny], [maxx, maxy]]
 
+    def getRestDict(self):
+        return self._restDict
+
+    # Stored with the defaults filled in, so JS never needs its own
+    def setRestDict(self, restDict):
+        self._restDict = _restDict(restDict)
+
     toolNames = property(getToolNames)
     worldDims = property(getWorldDims)
     world = property(exposeWorld)
     objects = property(getObjects)
+    restDict = property(getRestDict, setRestDict)
+
+
+'''A pool of persistent node workers that evaluates placements for a single
+ToolPicker level in parallel. Each worker is pre-loaded with the level world
+and tools, so jobs only send over the tool name, position and noise.
+
+Jobs come in kinds that match the ToolPicker methods:
+    'run': runPlacement / runNoisyPlacement -> [success, time]
+    'path': observePlacementPath / runNoisyPath -> [path, success, time]
+    'fullpath': observeFullPlacementPath / runFullNoisyPath
+    'statepath': observePlacementStatePath / observeNoisyPlacementStatePath
+Placements that collide with the world return the same values as the
+ToolPicker does, without going to the workers. Jobs use the ToolPicker's
+restDict, if it has one
+
+Args:
+    toolpicker [ToolPicker]: the level to evaluate placements in
+    nworkers [int]: the number of node processes (defaults to the core count)
+'''
+class ToolPickerPool(object):
+
+    _kindFunctions = {
+        'run': 'runGWPlacement',
+        'path': 'getGWPathPlacement',
+        'fullpath': 'getGWPathAndRotPlacement',
+        'statepath': 'getGWStatePathPlacement'
+    }
+    _collideReturns = {
+        'run': [None, -1],
+        'path': [None, None, -1],
+        'fullpath': [None, None, -1, None],
+        'statepath': [None, None, -1]
+    }
+
+    def __init__(self, toolpicker, nworkers=None):
+        assert toolpicker.backend == 'js', "Pools run the JS backend in node workers"
+        if nworkers is None:
+            nworkers = os.cpu_count() or 1
+        self._tp = toolpicker
+        ctxstr = context.format(modulepath,
+                                json.dumps(toolpicker._worlddict, cls=NpEncoder))
+        self._workers = [JSWorker(ctxstr) for _ in range(nworkers)]
+        self._idle = queue.Queue()
+        for w in self._workers:
+            # Every worker registers the worlds in the same order, so handles match
+            self._handles = [w.call('registerWorld', toolpicker._worlddict, toolpicker._tools),
+                             w.call('registerWorld', toolpicker._wdng, toolpicker._tools)]
+            self._idle.put(w)
+        self._executor = ThreadPoolExecutor(max_workers=nworkers)
+
+    def _runJob(self, fnc, toolname, position, maxtime, noise_dict, stopOnGoal):
+        w = self._idle.get()
+        try:
+            return w.call('runPlacementHandle', fnc,
+                          self._handles[0 if stopOnGoal else 1], toolname,
+                          position, maxtime, self._tp.bts, noise_dict, False,
+                          self._tp.restDict)
+        finally:
+            self._idle.put(w)
+
+    '''Queues up a single placement and returns a concurrent.futures.Future
+    with its result
+    '''
+    def submit(self, toolname, position, noise_dict={}, maxtime=20., kind='run',
+               stopOnGoal=True, seed=None):
+        assert toolname in self._tp._tools.keys(), "That tool does not exist!"
+        assert kind in self._kindFunctions, "Illegal job kind: " + str(kind)
+        if self._tp.checkPlacementCollide(toolname, position):
+            return self._executor.submit(
+                list, self._tp._collided(*self._collideReturns[kind]))
+        if all([v == 0 for v in noise_dict.values()]):
+            noise_dict = {}
+        noise_dict = _seeded(noise_dict, seed)
+        return self._executor.submit(self._runJob, self._kindFunctions[kind],
+                                     toolname, position, maxtime, noise_dict,
+                                     stopOnGoal)
+
+    '''Evaluates a batch of jobs, each either (toolname, position) or
+    (toolname, position, noise_dict), and returns the results in order. With a
+    seed, job i draws its noise from the (seed, i) stream
+    '''
+    def map(self, jobs, maxtime=20., kind='run', stopOnGoal=True, seed=None):
+        futures = [self.submit(*job, maxtime=maxtime, kind=kind,
+                               stopOnGoal=stopOnGoal,
+                               seed=None if seed is None else (seed, i))
+                   for i, job in enumerate(jobs)]
+        return [f.result() for f in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for w in self._workers:
+            w.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def getNumWorkers(self):
+        return len(self._workers)
+
+    nworkers = property(getNumWorkers)
 
 
 def loadToolPicker(jsonfile, basicTimestep=0.1):
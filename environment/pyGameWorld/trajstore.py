@@ -0,0 +1,213 @@
+from __future__ import division
+import numpy as np
+import json
+import os
+
+__all__ = ['TrajectoryStore']
+
+# How finely each channel ([x, y, rotation, vel_x, vel_y]) is quantized
+DEFAULT_RESOLUTION = (.01, .01, .0001, .01, .01)
+
+_HEADER = 'store.json'
+_INDEX = 'index.jsonl'
+_DATA = 'trajectories.bin'
+_ALIGN = 8
+
+
+# Makes (possibly nested) list seeds & positions hashable for index keys
+def _freeze(x):
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return tuple(_freeze(v) for v in x)
+    if isinstance(x, np.generic):
+        return x.item()
+    return x
+
+def _key(level, tool, position, seed):
+    return (level, tool, _freeze(position), _freeze(seed))
+
+# Turns a path into a (steps, objects, channels) array and the object names.
+# Takes a (states, names) pair (from the as_array path functions) or the path
+# dicts from getGWPath ([x, y] per step), getGWPathAndRot ([positions,
+# rotations]) or getGWStatePath ([x, y, rotation, vel_x, vel_y] per step)
+def _statesFromPath(path):
+    if isinstance(path, tuple):
+        states, names = path
+        return np.asarray(states, dtype=np.float64), list(names)
+    names = list(path.keys())
+    cols = []
+    for onm in names:
+        p = path[onm]
+        if len(p) == 2 and len(p[0]) > 0 and isinstance(p[0][0], (list, tuple)):
+            pos = np.asarray(p[0], dtype=np.float64)
+            cols.append(np.concatenate([pos, np.asarray(p[1], dtype=np.float64)[:, None]], 1))
+        else:
+            cols.append(np.asarray(p, dtype=np.float64))
+    if len(names) == 0:
+        return np.zeros((0, 0, 2)), names
+    return np.stack(cols, 1), names
+
+
+'''A compact on-disk archive of simulated trajectories, read back through
+memory-mapped arrays so that analyses can pull out single rollouts without
+loading the whole store.
+
+Each trajectory is kept under a (level, tool, position, noise seed) key. Every
+channel is quantized to a fixed resolution (DEFAULT_RESOLUTION: .01 for
+positions & velocities, 1e-4 radians for rotations) and stored as the first
+step plus the step-to-step differences, which fit in int16 for all but the
+most violent runs. Compared with pickling the nested lists of path dicts this
+takes about a quarter of the space (index included), and the quantized values
+come back exactly (the only loss is the rounding to the resolution).
+
+The store is a directory with a small header, an append-only binary data file
+and a JSON-lines index. Adding a trajectory under an existing key replaces it
+in the index (the old data stays in the file).
+
+Args:
+    path [str]: the directory of the store (created if needed)
+    mode [str]: 'a' to read and add trajectories (default), 'r' to only read
+    resolution [tuple]: the quantization step for each of the five channels;
+        only used when creating a new store
+'''
+class TrajectoryStore(object):
+
+    def __init__(self, path, mode='a', resolution=DEFAULT_RESOLUTION):
+        assert mode in ['a', 'r'], "mode must be 'a' or 'r'"
+        self.path = path
+        self.mode = mode
+        header = os.path.join(path, _HEADER)
+        if os.path.exists(header):
+            with open(header, 'r') as hfl:
+                self.resolution = np.array(json.load(hfl)['resolution'])
+        else:
+            assert mode == 'a', "No trajectory store at " + path
+            assert len(resolution) == 5, "Need a resolution for each channel"
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.resolution = np.array(resolution, dtype=float)
+            with open(header, 'w') as hfl:
+                json.dump({'version': 1,
+                           'resolution': self.resolution.tolist()}, hfl)
+            open(os.path.join(path, _DATA), 'ab').close()
+        self._index = dict()
+        index = os.path.join(path, _INDEX)
+        if os.path.exists(index):
+            with open(index, 'r') as ifl:
+                for line in ifl:
+                    if line.strip():
+                        self._addEntry(json.loads(line))
+        self._map = None
+        self._datafl = None
+        self._idxfl = None
+
+    def _addEntry(self, entry):
+        k = _key(entry['level'], entry['tool'], entry['position'], entry['seed'])
+        self._index[k] = entry
+
+    # The data file mapped into memory; remapped once it has grown past the
+    # part that is already mapped
+    def _data(self, upto):
+        if self._map is None or len(self._map) < upto:
+            if self._datafl is not None:
+                self._datafl.flush()
+            self._map = np.memmap(os.path.join(self.path, _DATA),
+                                  dtype=np.uint8, mode='r')
+        return self._map
+
+    '''Adds a trajectory: path is either a (states, names) pair from the
+    as_array path functions or a path dict from getGWPath, getGWPathAndRot
+    (e.g., observeFullPlacementPath) or getGWStatePath. The success and end
+    time of the run can be stored alongside it
+    '''
+    def add(self, level, tool, position, seed, path, success=None, time=None):
+        assert self.mode == 'a', "Store is read-only"
+        states, names = _statesFromPath(path)
+        nsteps, nobj, nchan = states.shape
+        assert nsteps > 0 or nobj == 0, "Cannot store an empty path"
+        q = np.rint(states / self.resolution[:nchan]).astype(np.int64)
+        first = q[:1].astype(np.int32)
+        deltas = np.diff(q, axis=0)
+        dtype = np.int16 if np.abs(deltas).max(initial=0) <= 32767 else np.int32
+        body = first.tobytes() + deltas.astype(dtype).tobytes()
+        if self._datafl is None:
+            self._datafl = open(os.path.join(self.path, _DATA), 'ab')
+            self._idxfl = open(os.path.join(self.path, _INDEX), 'a')
+        offset = self._datafl.tell()
+        self._datafl.write(body + b'\0' * (-len(body) % _ALIGN))
+        entry = {'level': level, 'tool': tool,
+                 'position': [float(p) for p in position],
+                 'seed': json.loads(json.dumps(_freeze(seed))),
+                 'names': names, 'shape': [nsteps, nobj, nchan],
+                 'offset': offset, 'dtype': np.dtype(dtype).name,
+                 'success': success, 'time': time}
+        self._idxfl.write(json.dumps(entry) + '\n')
+        self._addEntry(entry)
+
+    def _entry(self, level, tool, position, seed):
+        k = _key(level, tool, position, seed)
+        assert k in self._index, "No trajectory stored for " + str(k)
+        return self._index[k]
+
+    '''Returns the stored trajectory as a (states, names) pair, where states
+    is a float32 (steps, objects, channels) array (two channels for getGWPath
+    paths, three with rotations and five for full states). frames can be a
+    slice to decode only part of the run
+    '''
+    def get(self, level, tool, position, seed=None, frames=slice(None)):
+        e = self._entry(level, tool, position, seed)
+        nsteps, nobj, nchan = e['shape']
+        idx = range(nsteps)[frames]
+        # Only the steps up to the last one asked for need to be decoded
+        upto = max(idx) + 1 if len(idx) > 0 else 0
+        rowsize = nobj * nchan
+        q = np.zeros((upto, nobj, nchan), dtype=np.int64)
+        if upto > 0 and rowsize > 0:
+            dtype = np.dtype(e['dtype'])
+            start = e['offset'] + 4 * rowsize
+            data = self._data(start + dtype.itemsize * rowsize * (nsteps - 1))
+            q[0] = np.frombuffer(data, np.int32, rowsize,
+                                 e['offset']).reshape(nobj, nchan)
+            q[1:] = np.frombuffer(data, dtype, rowsize * (upto - 1),
+                                  start).reshape(upto - 1, nobj, nchan)
+            np.cumsum(q, axis=0, out=q)
+        states = (q[list(idx)] * self.resolution[:nchan]).astype(np.float32)
+        return states, list(e['names'])
+
+    '''Returns the stored information about a trajectory (object names,
+    shape, success, end time, ...) without decoding it
+    '''
+    def info(self, level, tool, position, seed=None):
+        return dict(self._entry(level, tool, position, seed))
+
+    '''Returns the (level, tool, position, seed) keys of the stored
+    trajectories, optionally only those for a given level and/or tool
+    '''
+    def keys(self, level=None, tool=None):
+        return [k for k in self._index
+                if (level is None or k[0] == level) and
+                (tool is None or k[1] == tool)]
+
+    def __contains__(self, key):
+        return _key(*key) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def flush(self):
+        if self._datafl is not None:
+            self._datafl.flush()
+            self._idxfl.flush()
+
+    def close(self):
+        if self._datafl is not None:
+            self._datafl.close()
+            self._idxfl.close()
+            self._datafl = None
+            self._idxfl = None
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
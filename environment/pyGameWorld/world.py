@@ -1,6 +1,8 @@
 from __future__ import division # Just in case
 import pymunk as pm
+from pymunk._chipmunk_cffi import lib as _cp
 import numpy as np
+import weakref
 from .constants import * # Add period here
 from .object import *
 from .conditions import *
@@ -16,10 +18,11 @@ def _emptyCollisionHandler(arb, space):
 def _emptyObjectHandler(o1,o2):
     return
 
-def resolveArbiter(arb):
-    shs = arb.shapes
-    o1, o2 = shs
-    return o1.name, o2.name
+# The PGObjects whose shapes are colliding (every shape in a world points back
+# to its object)
+def arbiterObjects(arb):
+    s1, s2 = arb.shapes
+    return s1.pgobject, s2.pgobject
 
 def pullCollisionInformation(arb):
     norm = arb.contact_point_set.normal
@@ -29,6 +32,38 @@ def pullCollisionInformation(arb):
     restitution = arb.restitution
     return [norm, restitution, setpoints]
 
+# Whether a collision callback has been set to something that does anything
+def _isSet(fnc):
+    return fnc is not _emptyCollisionHandler and fnc is not _emptyObjectHandler
+
+# Which pymunk callback of which collision handlers each hook is
+_SOLID_PAIRS = [(COLTYPE_SOLID, COLTYPE_SOLID), (COLTYPE_PLACED, COLTYPE_SOLID)]
+_GOAL_PAIRS = [(COLTYPE_SOLID, COLTYPE_SENSOR), (COLTYPE_PLACED, COLTYPE_SENSOR)]
+_HOOK_HANDLERS = {
+    'ssBegin': (_SOLID_PAIRS, 'begin'),
+    'ssPre': (_SOLID_PAIRS, 'pre_solve'),
+    'ssPost': (_SOLID_PAIRS, 'post_solve'),
+    'ssEnd': (_SOLID_PAIRS, 'separate'),
+    'sgBegin': (_GOAL_PAIRS, 'begin'),
+    'sgEnd': (_GOAL_PAIRS, 'separate')
+}
+
+# Takes the bodies out of a space that is being freed (as Space.remove does)
+def _releaseBodies(cpspace, bodies):
+    for b in list(bodies):
+        b._space = None
+        _cp.cpSpaceRemoveBody(cpspace, b._body)
+    bodies.clear()
+
+# chipmunk wakes up every body still in a space as it frees the space, but the
+# garbage collector frees a world's space and bodies in no set order (and a
+# space rebuilt by restore is newer than its bodies), so the bodies are taken
+# out of the space as soon as it becomes garbage, before anything is freed
+def _newSpace():
+    space = pm.Space()
+    weakref.finalize(space, _releaseBodies, space._space, space._bodies)
+    return space
+
 def _listify(l):
     if hasattr(l, "__iter__") and not isinstance(l, str):
         return [_listify(i) for i in l]
@@ -53,8 +88,9 @@ class PGWorld(object):
         self.bts = basic_timestep
         self.time = 0
         self.hasPlaceCollision = False
+        self._checkers = dict()
 
-        self._cpSpace = pm.Space()
+        self._cpSpace = _newSpace()
         self._cpSpace.gravity = (0, -gravity)
         self._cpSpace.sleep_time_threshold = 5.
 
@@ -65,6 +101,7 @@ class PGWorld(object):
         self.goalCond = None
         self.winCallback = None
         self._collisionEvents = []
+        self._eventFilter = None
         self._ssBegin = _emptyCollisionHandler
         self._ssPre = _emptyCollisionHandler
         self._ssPost = _emptyCollisionHandler
@@ -86,25 +123,27 @@ class PGWorld(object):
         def doSolidGoalEnd(arb, space, data):
             return self._solidGoalEnd(arb, space, data)
 
-        ssch = self._cpSpace.add_collision_handler(COLTYPE_SOLID, COLTYPE_SOLID)
-        ssch.begin = doSolidSolidBegin
-        ssch.pre_solve = doSolidSolidPre
-        ssch.post_solve = doSolidSolidPost
-        ssch.separate = doSolidSolidEnd
-
-        psch = self._cpSpace.add_collision_handler(COLTYPE_PLACED, COLTYPE_SOLID)
-        psch.begin = doSolidSolidBegin
-        psch.pre_solve = doSolidSolidPre
-        psch.post_solve = doSolidSolidPost
-        psch.separate = doSolidSolidEnd
-
-        ssench = self._cpSpace.add_collision_handler(COLTYPE_SOLID, COLTYPE_SENSOR)
-        ssench.begin = doSolidGoalBegin
-        ssench.separate = doSolidGoalEnd
-
-        psench = self._cpSpace.add_collision_handler(COLTYPE_PLACED, COLTYPE_SENSOR)
-        psench.begin = doSolidGoalBegin
-        psench.separate = doSolidGoalEnd
+        # The collision callbacks are only handed to pymunk while something
+        # needs them (see _syncHandlers), since each one is a call into Python
+        # for every contact -- every step for pre_solve & post_solve
+        self._hooks = {
+            'ssBegin': doSolidSolidBegin,
+            'ssPre': doSolidSolidPre,
+            'ssPost': doSolidSolidPost,
+            'ssEnd': doSolidSolidEnd,
+            'sgBegin': doSolidGoalBegin,
+            'sgEnd': doSolidGoalEnd
+        }
+        # Hooks that stay installed with nothing else needing them (e.g., the
+        # collision noise of noisifyWorld)
+        self._forcedHooks = set()
+        # The hooks handed to the collision handlers of the current space
+        self._installed = dict()
+        self._recordCollisions = True
+        # Set while the space is being rebuilt, when taking touching shapes out
+        # of the old space calls their separate callbacks
+        self._detaching = False
+        self._syncHandlers()
 
         if closed_ends[0]:
             self.addBox("_LeftWall",[-1,-1,1,self.dims[1]+1], self.def_col, 0)
@@ -139,6 +178,22 @@ class PGWorld(object):
             return False
         return self.goalCond.isWon()
 
+    '''Returns True if every dynamic object is asleep or moving slower than the
+    given linear & angular velocity thresholds, and the goal condition is not
+    in the middle of counting down
+    '''
+    def isAtRest(self, velThreshold=DEFAULT_REST_DICT['vel_threshold'],
+                 angThreshold=DEFAULT_REST_DICT['ang_threshold']):
+        if self.goalCond is not None and self.goalCond.remainingTime() is not None:
+            return False
+        for o in self.objects.values():
+            if o.isStatic() or o._cpBody.is_sleeping:
+                continue
+            if o._cpBody.velocity.length > velThreshold or \
+                    abs(o._cpBody.angular_velocity) > angThreshold:
+                return False
+        return True
+
     def getObject(self, name):
         assert name in self.objects.keys(), "No object by that name: " + name
         return self.objects[name]
@@ -293,6 +348,7 @@ class PGWorld(object):
     def setSolidCollisionPre(self, fnc = _emptyObjectHandler):
         assert callable(fnc), "Must pass legal function to callback setter"
         self._ssPre = fnc
+        self._syncHandlers()
 
     def getSolidCollisionPost(self):
         return self._ssPost
@@ -300,6 +356,7 @@ class PGWorld(object):
     def setSolidCollisionPost(self, fnc=_emptyObjectHandler):
         assert callable(fnc), "Must pass legal function to callback setter"
         self._ssPost = fnc
+        self._syncHandlers()
 
     def getSolidCollisionBegin(self):
         return self._ssBegin
@@ -307,6 +364,7 @@ class PGWorld(object):
     def setSolidCollisionBegin(self, fnc = _emptyObjectHandler):
         assert callable(fnc), "Must pass legal function to callback setter"
         self._ssBegin = fnc
+        self._syncHandlers()
 
     def getSolidCollisionEnd(self):
         return self._ssEnd
@@ -314,6 +372,7 @@ class PGWorld(object):
     def setSolidCollisionEnd(self, fnc=_emptyObjectHandler):
         assert callable(fnc), "Must pass legal function to callback setter"
         self._ssEnd = fnc
+        self._syncHandlers()
 
     def getGoalCollisionBegin(self):
         return self._sgBegin
@@ -321,6 +380,7 @@ class PGWorld(object):
     def setGoalCollisionBegin(self, fnc=_emptyObjectHandler):
         assert callable(fnc), "Must pass legal function to callback setter"
         self._sgBegin = fnc
+        self._syncHandlers()
 
     def getGoalCollisionEnd(self):
         return self._sgEnd
@@ -328,54 +388,75 @@ class PGWorld(object):
     def setGoalCollisionEnd(self, fnc=_emptyObjectHandler):
         assert callable(fnc), "Must pass legal function to callback setter"
         self._sgEnd = fnc
+        self._syncHandlers()
+
+    # The names of the collision hooks that something currently needs
+    def _neededHooks(self):
+        needed = {
+            'ssBegin': self._recordCollisions or _isSet(self._ssBegin),
+            'ssPre': _isSet(self._ssPre),
+            'ssPost': _isSet(self._ssPost),
+            'ssEnd': self._recordCollisions or _isSet(self._ssEnd),
+            'sgBegin': _isSet(self._sgBegin),
+            'sgEnd': _isSet(self._sgEnd)
+        }
+        return [hook for hook in _HOOK_HANDLERS.keys()
+                if needed[hook] or hook in self._forcedHooks]
+
+    # Hands each of the collision hooks to pymunk once something needs it:
+    # solid-solid begin & end record collision events (if recordCollisions is
+    # on) and run their callbacks, while the others only ever run callbacks.
+    # pymunk cannot take a callback back off of a handler, so hooks that are
+    # no longer needed stay on (doing nothing more than calling the empty
+    # callbacks) until restore() rebuilds the space
+    def _syncHandlers(self):
+        for hook in self._neededHooks():
+            pairs, cb = _HOOK_HANDLERS[hook]
+            fnc = self._hooks[hook]
+            if self._installed.get(hook) is not fnc:
+                for pair in pairs:
+                    setattr(self._cpSpace.add_collision_handler(*pair), cb, fnc)
+                self._installed[hook] = fnc
 
     def _solidSolidPre(self, arb, space, data):
-        onms = resolveArbiter(arb)
-        o1 = self.getObject(onms[0])
-        o2 = self.getObject(onms[1])
+        o1, o2 = arbiterObjects(arb)
         self._ssPre(o1,o2)
         return True
 
     def _solidSolidPost(self, arb, space, data):
-        onms = resolveArbiter(arb)
-        o1 = self.getObject(onms[0])
-        o2 = self.getObject(onms[1])
+        o1, o2 = arbiterObjects(arb)
         self._ssPost(o1, o2)
         return True
 
     def _solidSolidBegin(self, arb, space, data):
-        onms = resolveArbiter(arb)
-        o1 = self.getObject(onms[0])
-        o2 = self.getObject(onms[1])
+        o1, o2 = arbiterObjects(arb)
         # Add any non-static/static collisions to the events
-        if not (o1.isStatic() and o2.isStatic()):
+        if self._recordCollisions and not (o1.isStatic() and o2.isStatic()):
             collision_info = pullCollisionInformation(arb)
-            self._collisionEvents.append([onms[0],onms[1], "begin",self.time, collision_info])
+            self._addCollisionEvent([o1.name, o2.name, "begin", self.time, collision_info])
         self._ssBegin(o1, o2)
         return True
 
     def _solidSolidEnd(self, arb, space, data):
-        onms = resolveArbiter(arb)
-        o1 = self.getObject(onms[0])
-        o2 = self.getObject(onms[1])
+        if self._detaching:
+            return True
+        o1, o2 = arbiterObjects(arb)
         # Add any non-static/static collisions to the events
-        if not (o1.isStatic() and o2.isStatic()):
+        if self._recordCollisions and not (o1.isStatic() and o2.isStatic()):
             collision_info = pullCollisionInformation(arb)
-            self._collisionEvents.append([onms[0], onms[1], "end", self.time, collision_info])
+            self._addCollisionEvent([o1.name, o2.name, "end", self.time, collision_info])
         self._ssEnd(o1, o2)
         return True
 
     def _solidGoalBegin(self, arb, space, data):
-        onms = resolveArbiter(arb)
-        o1 = self.getObject(onms[0])
-        o2 = self.getObject(onms[1])
+        o1, o2 = arbiterObjects(arb)
         self._sgBegin(o1, o2)
         return True
 
     def _solidGoalEnd(self, arb, space, data):
-        onms = resolveArbiter(arb)
-        o1 = self.getObject(onms[0])
-        o2 = self.getObject(onms[1])
+        if self._detaching:
+            return True
+        o1, o2 = arbiterObjects(arb)
         self._sgEnd(o1, o2)
         return True
 
@@ -419,44 +500,109 @@ class PGWorld(object):
     def resetCollisions(self):
         self._collisionEvents = []
 
+    def _addCollisionEvent(self, event):
+        if self._eventFilter is None:
+            self._collisionEvents.append(event)
+        else:
+            self._eventFilter.add(*event)
+
+    '''Sends collision events straight to a CollisionEventFilter (or anything
+    else with an add(o1, o2, type, time, info) method) as they happen instead
+    of storing them in collisionEvents. Pass None to go back to storing them
+    '''
+    def setCollisionEventFilter(self, filt=None):
+        self._eventFilter = filt
+
+    def getCollisionEventFilter(self):
+        return self._eventFilter
+
     def _getCollisionEvents(self):
         return self._collisionEvents
 
+    def _getRecordCollisions(self):
+        return self._recordCollisions
+
+    '''Turns recording collision events on (the default) or off; with it off
+    (and no collision callbacks set) contacts never call into Python once the
+    space is next rebuilt by restore(), or from the start if it is turned off
+    before any collision hooks are needed
+    '''
+    def _setRecordCollisions(self, record):
+        self._recordCollisions = bool(record)
+        self._syncHandlers()
+
     ########################################
     # Misc
     ########################################
-    def checkCollision(self, pos, verts):
-        nvert = [(v[0]+pos[0], v[1]+pos[1]) for v in verts]
-        tmpBody = pm.Body(1,1)
-        placeShape = pm.Poly(tmpBody, nvert)
-        placeShape.collision_type = COLTYPE_CHECKER
-        placeShape.sensor = True
-        self._cpSpace.step(.000001)
+    # Returns a sensor shape for collision queries that is reused across calls;
+    # it lives on its own kinematic body outside of the space, so moving it to
+    # each queried position never touches the world itself
+    def _getChecker(self, verts=None, rad=None):
+        key = ('poly', tuple(map(tuple, verts))) if verts is not None else ('circle', rad)
+        if key not in self._checkers:
+            body = pm.Body(body_type=pm.Body.KINEMATIC)
+            if verts is not None:
+                shape = pm.Poly(body, [tuple(v) for v in verts])
+            else:
+                shape = pm.Circle(body, rad)
+            shape.collision_type = COLTYPE_CHECKER
+            shape.sensor = True
+            self._checkers[key] = shape
+        return self._checkers[key]
+
+    # Brings the collision data of moving shapes up to date with their bodies
+    # (only done by stepping otherwise) without stepping the world; returns the
+    # bounding boxes [l, b, r, t] of every shape in the world as an (N, 4) array
+    def _syncShapes(self):
+        bbs = []
+        bodies = set()
+        for sh in self._cpSpace.shapes:
+            if sh.body.body_type != pm.Body.STATIC and sh.body not in bodies:
+                bodies.add(sh.body)
+                self._cpSpace.reindex_shapes_for_body(sh.body)
+            bb = sh.bb
+            bbs.append([bb.left, bb.bottom, bb.right, bb.top])
+        return np.array(bbs).reshape(-1, 4)
+
+    def _queryChecker(self, shape, pos):
+        shape.body.position = tuple(pos)
+        return len(self._cpSpace.shape_query(shape)) > 0
 
-        self.hasPlaceCollision = False
-        squery = self._cpSpace.shape_query(placeShape)
-        """ Code doesn't account for blockers (sensors)
-        if len(squery) == 0:
-            return False
-        else:
-            for sq in squery:
-                for p in sq.contact_point_set.points:
-                    if p.distance > 0:
-                        return True
-            return False
-        """
-        return len(squery) > 0
+    def checkCollision(self, pos, verts):
+        self._syncShapes()
+        return self._queryChecker(self._getChecker(verts=verts), pos)
 
     def checkCircleCollision(self, pos, rad):
-        tmpBody = pm.Body(1,1)
-        placeShape = pm.Circle(tmpBody, rad, pos)
-        placeShape.collision_type = COLTYPE_CHECKER
-        placeShape.sensor = True
-        self._cpSpace.step(.000001)
-
-        self.hasPlaceCollision = False
-        squery = self._cpSpace.shape_query(placeShape)
-        return len(squery) > 0
+        self._syncShapes()
+        return self._queryChecker(self._getChecker(rad=rad), pos)
+
+    '''Checks whether placing the polygon verts at each of the (N, 2) positions
+    would collide with anything in the world, and returns an (N,) boolean mask.
+    Does not change the world. Positions whose bounding box misses every shape
+    in the world are ruled out without a physics query
+    '''
+    def checkCollisions(self, positions, verts):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        verts = np.asarray(verts, dtype=float)
+        vmin = verts.min(0)
+        vmax = verts.max(0)
+        return self._checkAll(self._getChecker(verts=verts), positions, vmin, vmax)
+
+    def checkCircleCollisions(self, positions, rad):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        return self._checkAll(self._getChecker(rad=rad), positions,
+                              np.array([-rad, -rad]), np.array([rad, rad]))
+
+    def _checkAll(self, shape, positions, vmin, vmax):
+        bbs = self._syncShapes()
+        lo = positions + vmin
+        hi = positions + vmax
+        near = ((lo[:, None, 0] <= bbs[None, :, 2]) & (hi[:, None, 0] >= bbs[None, :, 0]) &
+                (lo[:, None, 1] <= bbs[None, :, 3]) & (hi[:, None, 1] >= bbs[None, :, 1])).any(1)
+        ret = np.zeros(len(positions), dtype=bool)
+        for i in np.flatnonzero(near):
+            ret[i] = self._queryChecker(shape, positions[i])
+        return ret
 
     def kick(self, objectname, impulse, position):
         o = self.getObject(objectname)
@@ -559,6 +705,96 @@ class PGWorld(object):
     def copy(self):
         return loadFromDict(self.toDict())
 
+    ########################################
+    # Snapshots: cheap save & restore of the dynamic state, so a single world
+    # can be reused for many rollouts instead of copying it for each one
+    ########################################
+
+    '''Saves the state of the world: the position, velocity, angle, angular
+    velocity & sleep state of every body, the goal condition, the time, the
+    collision events and which objects exist. Returns a snapshot to pass to
+    restore(). Changes to static geometry or world parameters (e.g., from
+    noisifyWorld) are not covered -- use copy() for those
+
+    This only reads the world. Each restore() starts from a fresh physics
+    space, so for every rollout from the snapshot to run identically, restore
+    before the first one as well
+    '''
+    def snapshot(self):
+        snap = {
+            'bodies': [(b, b.position, b.velocity, b.angle, b.angular_velocity,
+                        b.is_sleeping) for b in self._cpSpace.bodies],
+            'shapes': list(self._cpSpace.shapes),
+            'objects': dict(self.objects),
+            'blockers': dict(self.blockers),
+            'goal': None,
+            'time': self.time,
+            'events': list(self._collisionEvents)
+        }
+        if self.goalCond is not None:
+            snap['goal'] = deepcopy(dict([(k, v) for k, v in vars(self.goalCond).items()
+                                          if k != 'parent']))
+        return snap
+
+    '''Puts the world back into the state it was in when snapshot was taken;
+    objects added since then (e.g., placed tools) are removed
+    '''
+    def restore(self, snap):
+        self.objects = dict(snap['objects'])
+        self.blockers = dict(snap['blockers'])
+        if snap['goal'] is not None:
+            self.goalCond.__dict__.update(deepcopy(snap['goal']))
+        self.time = snap['time']
+        self._collisionEvents = list(snap['events'])
+        self._rebuildSpace(snap)
+
+    # Moves the snapshot's bodies & shapes into a fresh space (with the same
+    # settings, and the collision hooks the world needs), so no contact caches
+    # or broadphase history carry over between rollouts
+    def _rebuildSpace(self, snap):
+        old = self._cpSpace
+        space = _newSpace()
+        for attr in ['gravity', 'damping', 'iterations', 'sleep_time_threshold',
+                     'idle_speed_threshold', 'collision_slop', 'collision_bias',
+                     'collision_persistence']:
+            setattr(space, attr, getattr(old, attr))
+        # Sleeping bodies must be woken up before they can leave the space
+        for b in old.bodies:
+            if b.body_type == pm.Body.DYNAMIC:
+                b.activate()
+        self._detaching = True
+        try:
+            old.remove(*old.shapes)
+            old.remove(*old.bodies)
+        finally:
+            self._detaching = False
+        for b, pos, vel, ang, angvel, _ in snap['bodies']:
+            # Angle first: setting the position depends on the rotation
+            b.angle = ang
+            b.position = pos
+            b.velocity = vel
+            b.angular_velocity = angvel
+            b.force = (0, 0)
+            b.torque = 0
+            # A zero-length position update clears the solver's leftover bias
+            # velocities, which would otherwise nudge the first step
+            if b.body_type == pm.Body.DYNAMIC:
+                pm.Body.update_position(b, 0.)
+        # Static shapes hang off of the space's own static body
+        for sh in snap['shapes']:
+            if sh.body is old.static_body:
+                sh.body = space.static_body
+        space.add(*[bs[0] for bs in snap['bodies']])
+        space.add(*snap['shapes'])
+        for bs in snap['bodies']:
+            if bs[5]:
+                bs[0].sleep()
+        for o in list(self.objects.values()) + list(self.blockers.values()):
+            o.space = space
+        self._cpSpace = space
+        self._installed = dict()
+        self._syncHandlers()
+
     ########################################
     # Properties (yay pythonic things!)
     ########################################
@@ -571,6 +807,7 @@ class PGWorld(object):
     goalCollisionEnd = property(getGoalCollisionEnd, setGoalCollisionEnd)
     callbackOnWin = property(_getCallbackOnWin, _setCallbackOnWin)
     collisionEvents = property(_getCollisionEvents)
+    recordCollisions = property(_getRecordCollisions, _setRecordCollisions)
 
 
 ########################################
@@ -2,13 +2,21 @@ from __future__ import division, print_function
 from builtins import super
 import os
 import sys
+import subprocess
+import time
 import unittest
 import json
 import copy
+import gc
+import tempfile
 import pdb
+import numpy as np
 
 from pyGameWorld import *
 from pyGameWorld.viewer import *
+from pyGameWorld.jsrun import pyRunGame, pyGetPath, pyGetStatePath, pySettleGame
+from pyGameWorld.noisyWorld import truncNorm, _cachedContactGroups, _staticGroupCache
+from pyGameWorld.helpers import filterCollisionEvents, NpEncoder
 
 
 BASIC_WORLD_LOC = os.path.join(os.path.dirname(__file__),
@@ -59,6 +67,180 @@ class BasicWorldTest(BasicWorldSetup):
             return self.world.checkEnd()
         self.assertFalse(getresp(), 'Running static world returns goal hit')
 
+    def test_snapshot_restore(self):
+        space = self.world._cpSpace
+        snap = self.world.snapshot()
+        before = self.world.toDict()
+        self.assertEqual(self.world.toDict(), before,
+                         "Taking a snapshot changed the world")
+        self.assertTrue(self.world._cpSpace is space,
+                        "Taking a snapshot rebuilt the space")
+        paths = []
+        for i in range(2):
+            self.world.restore(snap)
+            self.assertEqual(self.world.toDict(), before,
+                             "Restoring did not reset the world")
+            polys = [[[v[0] + WINNING_BASIC_POS[0], v[1] + WINNING_BASIC_POS[1]]
+                      for v in verts] for verts in btp_dict['tools']['obj1']]
+            self.world.addPlacedCompound('PLACED', polys, (0, 0, 255))
+            paths.append(pyGetPath(self.world, 8., .1))
+        self.assertEqual(str(paths[0]), str(paths[1]),
+                         "Rollouts from the same snapshot differ")
+        # The rebuilt space is newer than its bodies, so they are taken out of
+        # it before the world goes
+        body = [o._cpBody for o in self.world.objects.values()
+                if not o.isStatic()][0]
+        self.assertTrue(body.space is self.world._cpSpace,
+                        "Restored body is not in the rebuilt space")
+        self.world = snap = space = None
+        gc.collect()
+        self.assertTrue(body.space is None,
+                        "Body left in the space of a deleted world")
+
+    def test_noise_reproducible(self):
+        paths = []
+        for i in range(2):
+            np.random.seed(0)
+            nw = noisifyWorld(loadFromDict(self.worlddict))
+            paths.append(pyGetPath(nw, 5., .1))
+        self.assertEqual(str(paths[0]), str(paths[1]),
+                         "Seeded noisy worlds differ")
+        paths = [pyGetPath(noisifyWorld(loadFromDict(self.worlddict),
+                                        seed=(1, i)), 5., .1)
+                 for i in [0, 0, 1]]
+        self.assertEqual(str(paths[0]), str(paths[1]),
+                         "Noisy worlds with the same seed differ")
+        self.assertNotEqual(str(paths[0]), str(paths[2]),
+                            "Noisy worlds with different seeds are the same")
+        draws = [truncNorm(0, .2, -.1, .3) for _ in range(1000)]
+        self.assertTrue(min(draws) >= -.1 and max(draws) <= .3,
+                        "Truncated normal draws out of bounds")
+        # Without a NoiseBuffer, each draw takes one value from np.random
+        np.random.seed(1)
+        truncNorm(0, .2)
+        after = np.random.random_sample()
+        np.random.seed(1)
+        self.assertEqual(np.random.random_sample(2)[1], after,
+                         "Unbuffered noise drew more than it used")
+
+
+    def test_collision_filter_streaming(self):
+        stored = loadFromDict(self.worlddict)
+        filt = CollisionEventFilter(.2001)
+        self.world.setCollisionEventFilter(filt)
+        for i in range(100):
+            stored.step(.1)
+            self.world.step(.1)
+        self.assertEqual(self.world.collisionEvents, [],
+                         "Streamed events were also stored")
+        contacts = filt.getContacts()
+        self.assertEqual(str(contacts),
+                         str(filterCollisionEvents(stored.collisionEvents, .2001)),
+                         "Streamed contacts differ from filtering the stored events")
+        self.assertTrue(len(contacts) > 0, "No collisions to filter")
+        for o1, o2 in [c[:2] for c in contacts]:
+            self.assertTrue(o1 in self.world.objects and o2 in self.world.objects,
+                            "Contact has a mangled object name")
+
+    def test_contact_groups(self):
+        walls = ["_LeftWall", "_BottomWall", "_RightWall", "_TopWall"]
+        groups = _cachedContactGroups(self.world, walls)
+        names = sorted([onm for og in groups for onm in og])
+        self.assertEqual(names, sorted([onm for onm in self.world.objects.keys()
+                                        if onm not in walls]),
+                         "Contact groups do not split up the objects")
+        for og in groups:
+            for onm in og[1:]:
+                self.assertTrue(any([self.world.objects[onm].checkContact(self.world.objects[o2])
+                                     for o2 in og if o2 != onm]),
+                                "Grouped object touches nothing in its group")
+        # The static groups are shared by fresh worlds and placements of a level
+        _staticGroupCache.clear()
+        for pos in [None, [100, 300], [300, 500]]:
+            w = loadFromDict(self.worlddict)
+            if pos is not None:
+                w.addPlacedPoly('PLACED', [[pos[0]+x, pos[1]+y] for x, y in
+                                           [[-10, -10], [-10, 10], [10, 10], [10, -10]]],
+                                (0, 0, 255), 1)
+            pgroups = _cachedContactGroups(w, walls)
+            self.assertEqual(len(_staticGroupCache), 1,
+                             "Static contact groups were not cached for the level")
+            if pos is None:
+                self.assertEqual(pgroups, groups, "Cached contact groups changed")
+            else:
+                self.assertTrue(['PLACED'] in pgroups,
+                                "Placed object not grouped on its own")
+        # Groups follow objects that were moved since the space last stepped
+        self.world.objects['Ball'].position += [300, 0]
+        self.assertTrue(['Ball'] in _cachedContactGroups(self.world, walls),
+                        "Contact groups used stale bounding boxes")
+
+    def test_moving_noise_keeps_contacts(self):
+        def contacts(w):
+            return set([(o1, o2) for o1 in w.objects.keys() for o2 in w.objects.keys()
+                        if o1 != o2 and w.objects[o1].checkContact(w.objects[o2])])
+        nw = noisifyWorld(self.world, 0, 5., 0, 0, 0, 0, 0, 0, seed=2)
+        self.assertTrue(0 < nw.noiseAttempts <= 500, "Noise attempts not reported")
+        self.assertEqual(contacts(nw), contacts(self.world),
+                         "Moving noise changed which objects touch")
+
+    def test_collision_hooks(self):
+        for onm, o in self.world.objects.items():
+            for sh in o._exposeShapes():
+                self.assertIs(sh.pgobject, o, "Shape does not point to its object")
+        stored = loadFromDict(self.worlddict)
+        self.world.recordCollisions = False
+        touches = []
+        self.world.solidCollisionBegin = lambda o1, o2: touches.append((o1.name, o2.name))
+        for i in range(50):
+            stored.step(.1)
+            self.world.step(.1)
+        self.assertEqual(self.world.collisionEvents, [],
+                         "Recorded events with recording off")
+        self.assertEqual(touches, [tuple(e[:2]) for e in stored.collisionEvents
+                                   if e[2] == 'begin'],
+                         "Callbacks saw different collisions")
+        self.assertEqual([o.position.tolist() for o in self.world.objects.values()
+                          if not o.isStatic()],
+                         [o.position.tolist() for o in stored.objects.values()
+                          if not o.isStatic()],
+                         "Skipping callbacks changed the physics")
+        snap = stored.snapshot()
+        stored.recordCollisions = False
+        stored.restore(snap)
+        self.assertFalse('ssBegin' in stored._installed or 'ssEnd' in stored._installed,
+                         "Restoring kept the event recording hooks")
+
+    def test_batch_world(self):
+        polys = [[[v[0] + WINNING_BASIC_POS[0], v[1] + WINNING_BASIC_POS[1]]
+                  for v in verts] for verts in btp_dict['tools']['obj1']]
+        self.world.addPlacedCompound('PLACED', polys, (0, 0, 255))
+        def noisy(**nd):
+            return [noisifyWorld(self.world, seed=(3, i), **nd) for i in range(4)]
+        # Collision noise is drawn in a different order in a batch, so only
+        # the rest of the noise can match running the copies one by one
+        nd = dict(noise_collision_direction=0, noise_collision_elasticity=0)
+        nws = noisy(**nd)
+        single = [pyRunGame(nw, 20., .1) for nw in nws]
+        bws = noisy(**nd)
+        batch = PGBatchWorld(bws)
+        self.assertEqual(len(batch), 4, "Batch lost copies")
+        self.assertEqual(batch.runAll(), single,
+                         "Batched noisy runs differ from running them one by one")
+        self.assertTrue(np.allclose([bw.objects['Ball'].position for bw in bws],
+                                    [nw.objects['Ball'].position for nw in nws],
+                                    atol=.1),
+                        "Batched worlds were not moved back")
+        self.assertEqual(PGBatchWorld(noisy()).runAll(),
+                         PGBatchWorld(noisy()).runAll(),
+                         "Seeded batches with collision noise differ")
+        batch = PGBatchWorld(self.world, 3)
+        batch.step(2.)
+        states = batch.getStateArray()
+        self.assertEqual(states.shape, (3, len(batch.names), 5),
+                         "Batch state array has the wrong shape")
+        self.assertTrue(np.allclose(states, states[0]),
+                        "Copies of the same world interfere with each other")
 
 class JSRunTest(BasicWorldSetup):
     def setUp(self):
@@ -71,6 +253,70 @@ class JSRunTest(BasicWorldSetup):
         self.assertFalse(isin, "Running static world returns goal hit")
         self.assertTrue(tm > 20, "World stopped before end point")
 
+    def test_worker_matches_execjs(self):
+        ectx = JSRunner(useWorker=False)
+        wpath = self.ctx.run_gw_path(self.worlddict, 2)
+        epath = ectx.run_gw_path(self.worlddict, 2)
+        self.assertEqual(wpath, epath, "Node worker and execjs runs differ")
+
+    def test_record_subset(self):
+        path = self.ctx.run_gw_state_path(self.worlddict, 2)[0]
+        onm = list(path.keys())[0]
+        sub = self.ctx.run_gw_state_path(self.worlddict, 2, track=[onm],
+                                         record_every=3)[0]
+        self.assertEqual(list(sub.keys()), [onm], "Recorded untracked objects")
+        self.assertEqual(sub[onm][:-1], path[onm][:-1:3],
+                         "Did not record every third step")
+        self.assertEqual(sub[onm][-1], path[onm][-1],
+                         "Did not record the last step")
+
+    def test_trajectory_store(self):
+        path, end, tm = self.ctx.run_gw_path_and_rot(self.worlddict, 2)
+        states = self.ctx.run_gw_state_path(self.worlddict, 2, as_array=True)[0]
+        with tempfile.TemporaryDirectory() as tdir:
+            with TrajectoryStore(tdir) as store:
+                store.add('basic', 'none', [0, 0], None, path, end, tm)
+                store.add('basic', 'none', [0, 0], (1, 2), states)
+            store = TrajectoryStore(tdir, 'r')
+            self.assertEqual(len(store), 2, "Store lost trajectories")
+            stored, names = store.get('basic', 'none', (0, 0))
+            for i, onm in enumerate(names):
+                self.assertTrue(np.allclose(stored[:, i, :2], path[onm][0],
+                                            atol=.005),
+                                "Stored positions differ")
+                self.assertTrue(np.allclose(stored[:, i, 2], path[onm][1],
+                                            atol=.00005),
+                                "Stored rotations differ")
+            full = store.get('basic', 'none', [0, 0], [1, 2])[0]
+            part = store.get('basic', 'none', [0, 0], [1, 2],
+                             frames=slice(3, -2, 2))[0]
+            self.assertTrue(np.array_equal(part, full[3:-2:2]),
+                            "Slicing a stored trajectory changed it")
+            self.assertTrue(np.allclose(full, states[0], atol=.005),
+                            "Stored states differ")
+
+    def test_state_array(self):
+        path, _, tm = self.ctx.run_gw_state_path(self.worlddict, 2)
+        (states, names), _, atm = self.ctx.run_gw_state_path(self.worlddict, 2,
+                                                              as_array=True)
+        self.assertEqual(states.dtype, np.float32, "States are not float32")
+        self.assertEqual(states.shape, (len(path[names[0]]), len(path), 5),
+                         "State array has the wrong shape")
+        for i, onm in enumerate(names):
+            self.assertTrue(np.allclose(states[:, i], path[onm], rtol=1e-5,
+                                        atol=1e-3),
+                            "State array differs from the state path")
+        self.assertEqual(tm, atm, "State array run ended at a different time")
+        (estates, enames), _, _ = JSRunner(useWorker=False).run_gw_state_path(
+            self.worlddict, 2, as_array=True)
+        self.assertEqual(names, enames, "execjs state array has other objects")
+        self.assertTrue(np.array_equal(states, estates),
+                        "Node worker and execjs state arrays differ")
+        (pstates, pnames), _, _ = pyGetStatePath(loadFromDict(self.worlddict),
+                                                 2, asArray=True)
+        self.assertEqual(pstates.shape, states.shape,
+                         "Python state array has the wrong shape")
+
 
 class ToolPickerTest(BasicWorldSetup):
     def setUp(self):
@@ -84,6 +330,34 @@ class ToolPickerTest(BasicWorldSetup):
         self.assertFalse(self.tp.checkPlacementCollide('obj2', NEARMISS_BASIC_POS),
                          "Found placement collision that does not exist")
 
+    def test_placement_collision_batch(self):
+        positions = [COLLIDE_POS, NEARMISS_BASIC_POS, AWFUL_POSITION, [0, 300]]
+        mask = self.tp.checkPlacementCollides('obj3', positions)
+        for pos, m in zip(positions, mask):
+            self.assertEqual(m, self.tp.checkPlacementCollide('obj3', pos),
+                             "Batched collision check differs from single")
+        world = loadFromDict(self.worlddict)
+        before = world.toDict()
+        world.checkCollisions(positions, btp_dict['tools']['obj3'][0])
+        self.assertEqual(world.toDict(), before,
+                         "Collision check changed the world")
+
+    def test_placement_map(self):
+        pmap = self.tp.getPlacementMap('obj3')
+        self.assertFalse(pmap.isValid(COLLIDE_POS),
+                         "Placement map missed a collision")
+        self.assertTrue(pmap.isValid(WINNING_BASIC_POS),
+                        "Placement map found collision that does not exist")
+        self.assertTrue(pmap is self.tp.getPlacementMap('obj3'),
+                        "Placement map was not cached")
+        samples = pmap.sample(20, rng=0)
+        self.assertTrue(all(pmap.isValid(samples)), "Sampled invalid placements")
+        self.assertTrue(all(pmap.distance(samples) > 0),
+                        "Valid placements have negative distance")
+        for pos in samples:
+            self.assertFalse(self.tp.checkPlacementCollide('obj3', list(pos)),
+                             "Sampled a placement that collides")
+
     def test_good_placement(self):
         ret, tm = self.tp.runPlacement('obj1', WINNING_BASIC_POS)
         self.assertTrue(ret, "Did not find valid solution")
@@ -96,5 +370,239 @@ class ToolPickerTest(BasicWorldSetup):
         self.assertFalse(ret, "Found invalid solution")
         self.assertTrue(tm > 20., "Bad placement stopped early")
 
+    def test_rest_early_stop(self):
+        self.tp.restDict = {'window': 1.}
+        ret, tm, why = self.tp.runPlacement('obj1', WINNING_BASIC_POS)
+        self.assertTrue(ret and why == 'goal', "Resting run missed the goal")
+        self.assertTrue(approxeq(tm, WINNING_TIME),
+                        "Rest check changed the solution time")
+        ret, tm, why = self.tp.runPlacement('obj1', AWFUL_POSITION)
+        self.assertEqual(why, 'rest', "Run did not stop once at rest")
+        self.assertTrue(tm < 20., "Resting run was not cut short")
+        end, tm, why = pyRunGame(loadFromDict(self.worlddict),
+                                 restDict={'window': 1.})
+        self.assertEqual(why, 'rest', "Python run did not stop once at rest")
+        ret, tm, why = self.tp.runPlacement('obj1', [100, 215])
+        self.assertEqual((ret, tm, why), (None, -1, 'collide'),
+                         "Colliding placement has no stop reason")
+        self.assertEqual(self.tp.runPlacementBatch([['obj1', [100, 215]]])[0][-1],
+                         'collide', "Colliding batch placement has no stop reason")
+
+    def test_presettle(self):
+        tp = ToolPicker(copy.deepcopy(self.tpdict), presettle=True)
+        self.assertTrue(tp.settleTime > 0, "Level was not settled")
+        tp2 = ToolPicker(copy.deepcopy(self.tpdict), presettle=True)
+        self.assertEqual(tp2._worlddict, tp._worlddict,
+                         "Settled level was not reused")
+        ret, tm = tp.runPlacement('obj1', WINNING_BASIC_POS)
+        self.assertTrue(ret, "Settled level lost the solution")
+        ret, tm = tp.runPlacement('obj1', NEARMISS_BASIC_POS)
+        self.assertFalse(ret, "Settled level found invalid solution")
+        # The pymunk backend settles in process, with its own cache entry
+        ptp = ToolPicker(copy.deepcopy(self.tpdict), presettle=True,
+                         backend='pymunk')
+        wd = copy.deepcopy(self.tpdict['world'])
+        wd['bts'] = ptp.wts
+        pwd, pt, atRest = pySettleGame(loadFromDict(wd))
+        self.assertTrue(atRest, "Level did not settle in process")
+        self.assertEqual(ptp.settleTime, pt, "Level was not settled with pymunk")
+        self.assertEqual(ptp._worlddict['objects'],
+                         json.loads(json.dumps(pwd, cls=NpEncoder))['objects'],
+                         "Level was not settled with pymunk")
+        ret, tm = ptp.runPlacement('obj1', WINNING_BASIC_POS)
+        self.assertTrue(ret, "Level settled in process lost the solution")
+
+    def test_bump_branches(self):
+        bumps = [['Ball', [0, 0], None], ['Ball', [40000, 60000], None],
+                 ['PLACED', [0, 50000], None],
+                 ['PLACED', [0, 50000], [WINNING_BASIC_POS[0] + 5, WINNING_BASIC_POS[1]]]]
+        res = self.tp.runBumpBranches('obj1', WINNING_BASIC_POS, 2., bumps)
+        self.assertEqual(res[0], self.tp.observePlacementPath('obj1', WINNING_BASIC_POS),
+                         "Branch with no bump differs from a plain run")
+        # Single bumps are straight runs, so the branches must match them
+        for b, r in zip(bumps, res):
+            self.assertEqual(self.tp.runNoisyBumpPath('obj1', WINNING_BASIC_POS, 2.,
+                                                      b[0], b[1], b[2]), r,
+                             "Branched bump differs from a single bump run")
+        self.assertNotEqual(res[2], res[3], "Bump location had no effect")
+        self.assertNotEqual(res[0], res[1], "Bump had no effect")
+        self.assertEqual(res, self.tp.runBumpBranches('obj1', WINNING_BASIC_POS, 2., bumps,
+                                                      objAdjust={'Ball': {}}),
+                         "Bump branches by handle differ from sending the world")
+        self.assertEqual(self.tp.runBumpBranches('obj1', COLLIDE_POS, 2., bumps),
+                         [(None, None, -1)] * len(bumps),
+                         "Colliding bump placement was run")
+
+    def test_seeded_noise(self):
+        nd = dict(noise_position_static=5., noise_collision_direction=.2,
+                  noise_gravity=.1)
+        paths = [self.tp.runNoisyPath('obj1', WINNING_BASIC_POS, seed=(7, i), **nd)
+                 for i in [0, 0, 1]]
+        self.assertEqual(paths[0], paths[1], "Runs with the same seed differ")
+        self.assertNotEqual(paths[0], paths[2],
+                            "Runs with different seeds are the same")
+        bumps = [['Ball', [0, 0], None], ['Ball', [40000, 60000], None]]
+        ndict = dict(noise_collision_direction=.2, noise_collision_elasticity=.2)
+        res = self.tp.runBumpBranches('obj1', WINNING_BASIC_POS, 2., bumps,
+                                      ndict=ndict, seed=3)
+        for b, r in zip(bumps, res):
+            self.assertEqual(self.tp.runNoisyBumpPath('obj1', WINNING_BASIC_POS, 2.,
+                                                      b[0], b[1], seed=3, **ndict), r,
+                             "Seeded branch differs from a seeded single run")
+        self.assertNotEqual(res, self.tp.runBumpBranches('obj1', WINNING_BASIC_POS, 2., bumps),
+                            "Collision noise had no effect on the branches")
+        # The persistent worker goes back to the unseeded Math.random
+        self.assertTrue(self.tp._ctx.call(
+            "(function() { return Math.random === unseededRandom })"),
+            "Seeded generator leaked out of its run")
+
+    def test_simulation_cache(self):
+        with tempfile.TemporaryDirectory() as tdir:
+            dbpath = os.path.join(tdir, 'cache.sqlite')
+            with SimulationCache(dbpath) as cache:
+                tp = ToolPicker(self.tpdict, cache=cache)
+                path = tp.observePlacementPath('obj1', WINNING_BASIC_POS)
+                self.assertEqual(tp.observePlacementPath('obj1', WINNING_BASIC_POS),
+                                 path, "Cached result differs")
+                tp.runNoisyPath('obj1', WINNING_BASIC_POS,
+                                noise_position_static=5.)
+                self.assertEqual(cache.stats()['hits'], 1, "Missed the cache")
+                self.assertEqual(len(cache), 1, "Cached a run without a seed")
+            with SimulationCache(dbpath) as cache:
+                tp = ToolPicker(self.tpdict, cache=cache)
+                self.assertEqual(tp.observePlacementPath('obj1', WINNING_BASIC_POS),
+                                 path, "Result from disk differs")
+                self.assertEqual(cache.stats()['disk_hits'], 1,
+                                 "Missed the on-disk cache")
+                moved = copy.deepcopy(self.tpdict)
+                moved['world']['objects']['Ball']['position'][0] += 10
+                ToolPicker(moved, cache=cache).observePlacementPath(
+                    'obj1', WINNING_BASIC_POS)
+                self.assertEqual(cache.stats()['misses'], 1,
+                                 "Used a cached result for a changed level")
+
+    def test_pymunk_backend(self):
+        tp = ToolPicker(self.tpdict, backend='pymunk')
+        for pos in [WINNING_BASIC_POS, NEARMISS_BASIC_POS]:
+            world = loadFromDict(self.tpdict['world'])
+            polys = [[[v[0] + pos[0], v[1] + pos[1]] for v in verts]
+                     for verts in self.tpdict['tools']['obj1']]
+            world.addPlacedCompound('PLACED', polys, (0, 0, 255, 255), 1)
+            self.assertEqual(list(tp.runPlacement('obj1', pos)),
+                             list(pyRunGame(world, 20., .1)),
+                             "In-process run differs from the Python engine")
+        path, end, t = tp.observePlacementPath('obj1', WINNING_BASIC_POS)
+        jpath = self.tp.observePlacementPath('obj1', WINNING_BASIC_POS)[0]
+        self.assertTrue(end, "In-process run missed the goal")
+        self.assertEqual(sorted(path.keys()), sorted(jpath.keys()),
+                         "In-process path tracks different objects")
+        self.assertTrue(np.allclose(path['PLACED'][0], jpath['PLACED'][0]),
+                        "In-process path starts elsewhere")
+        states, names = tp.observePlacementStatePath('obj1', WINNING_BASIC_POS,
+                                                     asArray=True)[0]
+        self.assertEqual(states.shape, (len(path['PLACED']), len(names), 5),
+                         "In-process state array has the wrong shape")
+        nd = dict(noise_position_static=5., noise_collision_direction=.2)
+        self.assertEqual(tp.runNoisyPath('obj1', WINNING_BASIC_POS, seed=3, **nd),
+                         tp.runNoisyPath('obj1', WINNING_BASIC_POS, seed=3, **nd),
+                         "Seeded in-process noisy runs differ")
+        self.assertEqual(tp.observeCollisionEvents('obj1', WINNING_BASIC_POS)[1][0][:2],
+                         ['Ball', 'Table'], "In-process collisions differ")
+        bumps = [['Ball', [0, 0], None], ['Ball', [40000, 60000], None]]
+        for seed in [None, 3]:
+            ndict = dict(noise_collision_direction=.2) if seed else {}
+            res = tp.runBumpBranches('obj1', WINNING_BASIC_POS, 2., bumps,
+                                     ndict=ndict, seed=seed)
+            for b, r in zip(bumps, res):
+                self.assertEqual(tp.runNoisyBumpPath('obj1', WINNING_BASIC_POS, 2.,
+                                                     b[0], b[1], seed=seed, **ndict), r,
+                                 "In-process bump branch differs from a single bump")
+            self.assertNotEqual(res[0], res[1], "In-process bump had no effect")
+
+    def test_parity_harness(self):
+        from pyGameWorld.parity import compareLevel
+        placements = [('obj1', WINNING_BASIC_POS), ('obj2', AWFUL_POSITION)]
+        res = compareLevel(self.tpdict, placements,
+                           engines=['js', 'pymunk_inproc'])
+        self.assertEqual(res['outcomes']['js'], [True, False],
+                         "Parity run changed the JS outcomes")
+        self.assertEqual(res['agreement']['js'], 1.,
+                         "JS does not agree with itself")
+        self.assertEqual(res['divergence']['js'], 0.,
+                         "JS diverges from itself")
+        div = res['divergence']['pymunk_inproc']
+        self.assertTrue(np.isfinite(div) and div >= 0,
+                        "Divergence is not a distance")
+        self.assertTrue(0 <= res['agreement']['pymunk_inproc'] <= 1,
+                        "Agreement is not a fraction")
+        self.assertTrue(res['recommended'] in res['sims_per_sec'],
+                        "Recommended an engine that was not run")
+
+    def test_success_estimate(self):
+        nd = dict(noise_position_static=5., noise_collision_direction=.2)
+        p, ci, n = self.tp.estimateSuccessProbability('obj1', [300, 300], nd,
+                                                      maxSamples=200, seed=0)
+        self.assertEqual(p, 0., "Estimate for a clear miss is not 0")
+        self.assertTrue(n < 200 and ci[1] - ci[0] <= .1,
+                        "Estimate did not stop early on a clear miss")
+        self.assertEqual(self.tp.estimateSuccessProbability('obj1', [300, 300], nd,
+                                                            maxSamples=200, seed=0),
+                         (p, ci, n), "Seeded estimates differ")
+        self.assertEqual(self.tp.estimateSuccessProbability('obj1', WINNING_BASIC_POS, {}),
+                         (1., (1., 1.), 1), "Noiseless estimate is not the single run")
+        self.assertEqual(self.tp.estimateSuccessProbability('obj3', COLLIDE_POS, nd),
+                         (None, None, 0), "Estimate for a colliding placement")
+
+    def test_placement_batch(self):
+        placements = [('obj1', WINNING_BASIC_POS), ('obj3', COLLIDE_POS),
+                      ('obj1', NEARMISS_BASIC_POS)]
+        res = self.tp.runPlacementBatch(placements)
+        for (tnm, pos), r in zip(placements, res):
+            self.assertEqual(list(self.tp.runPlacement(tnm, pos)), list(r),
+                             "Batched result differs from single placement")
+        paths = self.tp.observePlacementPathBatch(placements[:1])
+        self.assertEqual(paths[0], self.tp.observePlacementPath(*placements[0]),
+                         "Batched path differs from single placement")
+
+    def test_world_handles(self):
+        tpdict = ToolPicker(self.tpdict, useWorker=False)
+        for stopOnGoal in [True, False]:
+            self.assertEqual(
+                self.tp.observePlacementPath('obj1', WINNING_BASIC_POS,
+                                             stopOnGoal=stopOnGoal),
+                tpdict.observePlacementPath('obj1', WINNING_BASIC_POS,
+                                            stopOnGoal=stopOnGoal),
+                "Runs from a registered world differ from runs from the dict")
+
+    def test_pool_matches_toolpicker(self):
+        jobs = [('obj1', WINNING_BASIC_POS), ('obj1', NEARMISS_BASIC_POS),
+                ('obj3', COLLIDE_POS)]
+        with ToolPickerPool(self.tp, 2) as pool:
+            res = pool.map(jobs)
+        for (tnm, pos), r in zip(jobs, res):
+            self.assertEqual(list(self.tp.runPlacement(tnm, pos)), r,
+                             "Pool result differs from ToolPicker")
+
+class ImportTest(unittest.TestCase):
+    def test_light_import(self):
+        # Importing the package should not bring in the heavy optional parts
+        heavy = ['pygame', 'scipy', 'execjs', 'pyGameWorld.toolpicker_js']
+        code = ("import sys, pyGameWorld; print(' '.join(m for m in %r "
+                "if m in sys.modules))" % heavy)
+        start = time.time()
+        out = subprocess.run([sys.executable, '-c', code], check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE).stdout.decode()
+        # pymunk prints a banner, so only the last line is ours
+        out = out.splitlines()[-1].split()
+        elapsed = time.time() - start
+        self.assertEqual(out, [], "Importing pyGameWorld loaded %s (in %.2fs)"
+                         % (out, elapsed))
+        # Generous, since it counts starting a new interpreter too
+        self.assertLess(elapsed, 10., "Importing pyGameWorld took %.2fs"
+                        % elapsed)
+        self.assertTrue(callable(ToolPicker), "Lazy imports are broken")
+
+
 if __name__ == '__main__':
     unittest.main()